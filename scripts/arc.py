@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# Geometry of G2/G3 arc moves for the collision checks and the splitting of moves.
+# An arc goes from the current position to X/Y around a center given either by the offset I/J from the start or by
+# the radius R. G2 is clockwise, G3 counter clockwise. A negative R selects the arc longer than a half circle,
+# I/J with the end equal to the start is a full circle. Z of helical arcs does not matter for the checks.
+#
+# Both toolheads are axis aligned rectangles of the same size, so the toolhead moving along an arc touches the
+# inactive one exactly when the arc enters the rectangle of twice the toolhead size around the inactive toolhead.
+# This is tested analytically, with either backend: an end of the arc lies inside or the arc crosses an edge.
+
+import math
+
+from point import Point
+from toolhead import check_for_overlap_sweep, get_sweep_extents
+
+TWO_PI = 2.0 * math.pi
+ANGLE_EPSILON = 1e-9
+
+
+def is_arc(line) -> bool:
+    """True if the move line is a G2/G3 arc"""
+    return line.command[1] in (2, 3)
+
+
+class Arc:
+    __slots__ = ('start', 'end', 'center_x', 'center_y', 'radius', 'start_angle', 'sweep')
+
+    def __init__(self, start: Point, end: Point, center_x: float, center_y: float, clockwise: bool):
+        """Arc from start to end around the center. sweep is the signed angle, negative if clockwise."""
+        self.start = start
+        self.end = end
+        self.center_x = center_x
+        self.center_y = center_y
+        self.radius = math.hypot(start.x - center_x, start.y - center_y)
+        self.start_angle = math.atan2(start.y - center_y, start.x - center_x)
+        end_angle = math.atan2(end.y - center_y, end.x - center_x)
+        if clockwise:
+            sweep = -((self.start_angle - end_angle) % TWO_PI)
+        else:
+            sweep = (end_angle - self.start_angle) % TWO_PI
+        if sweep == 0.0:
+            sweep = -TWO_PI if clockwise else TWO_PI   # full circle
+        self.sweep = sweep
+
+    @property
+    def length(self) -> float:
+        return self.radius * abs(self.sweep)
+
+    def get_fraction(self, angle: float) -> float:
+        """Part of the sweep done when the arc passes angle, above 1 if it does not"""
+        delta = angle - self.start_angle
+        if self.sweep > 0:
+            return (delta % TWO_PI) / self.sweep
+        return (-delta % TWO_PI) / -self.sweep
+
+    def point_at(self, fraction: float) -> Point:
+        if fraction >= 1.0:
+            return self.end.copy()
+        angle = self.start_angle + self.sweep * fraction
+        return Point(self.center_x + self.radius * math.cos(angle), self.center_y + self.radius * math.sin(angle))
+
+    def find_ys(self, y: float) -> list:
+        """Parts of the sweep done when the arc reaches y after its start, in order. Empty if it does not."""
+        if self.radius == 0.0 or abs(y - self.center_y) > self.radius:
+            return []
+        angle = math.asin((y - self.center_y) / self.radius)
+        return sorted(set(f for f in (self.get_fraction(angle), self.get_fraction(math.pi - angle))
+                          if ANGLE_EPSILON < f <= 1.0))
+
+    def find_y(self, y: float):
+        """Part of the sweep done when the arc last reaches y, the rest of it stays on one side of y. None if it
+        does not reach y."""
+        fractions = self.find_ys(y)
+        return fractions[-1] if fractions else None
+
+    def get_point_fraction(self, p: Point) -> float:
+        """Part of the sweep done at p on the arc"""
+        return self.get_fraction(math.atan2(p.y - self.center_y, p.x - self.center_x))
+
+    def get_part(self, start_fraction: float, end_fraction: float):
+        """Arc along this one between two parts of its sweep"""
+        start = self.start if start_fraction <= 0.0 else self.point_at(start_fraction)
+        return Arc(start, self.point_at(end_fraction), self.center_x, self.center_y, self.sweep < 0)
+
+    def get_center_offset(self, pos: Point) -> tuple:
+        """I/J of the center from pos"""
+        return self.center_x - pos.x, self.center_y - pos.y
+
+    def get_bounds(self) -> tuple:
+        """(min_x, min_y, max_x, max_y) of the arc"""
+        xs = [self.start.x, self.end.x]
+        ys = [self.start.y, self.end.y]
+        for quadrant in range(4):
+            angle = quadrant * math.pi / 2
+            if self.get_fraction(angle) <= 1.0:
+                xs.append(self.center_x + self.radius * math.cos(angle))
+                ys.append(self.center_y + self.radius * math.sin(angle))
+        return min(xs), min(ys), max(xs), max(ys)
+
+
+def get_arc(start: Point, end: Point, line):
+    """Arc of the G2/G3 line from start to end, None if the line does not give a proper arc"""
+    clockwise = line.command[1] == 2
+    i = line.get_param('I')
+    j = line.get_param('J')
+    if i is not None or j is not None:
+        center_x = start.x + (float(i) if i is not None else 0.0)
+        center_y = start.y + (float(j) if j is not None else 0.0)
+        if center_x == start.x and center_y == start.y:
+            return None
+        return Arc(start, end, center_x, center_y, clockwise)
+    r = line.get_param('R')
+    if r is None:
+        return None
+    r = float(r)
+    dx = end.x - start.x
+    dy = end.y - start.y
+    distance = math.hypot(dx, dy)
+    if distance == 0.0 or r == 0.0:
+        return None
+    # center on the perpendicular bisector, right of the chord for a short clockwise arc. Too small radii are
+    # stretched to a half circle, as the firmware does.
+    h = math.sqrt(max(0.0, r * r - distance * distance / 4)) / distance
+    if clockwise != (r > 0):
+        h = -h
+    return Arc(start, end, (start.x + end.x) / 2 + h * dy, (start.y + end.y) / 2 - h * dx, clockwise)
+
+
+def check_for_overlap_arc(arc: Arc, inactive_toolhead_pos: Point) -> bool:
+    """True if the toolhead moving along arc sweeps over the inactive toolhead"""
+    extent_x, extent_y = get_sweep_extents()
+    min_x = inactive_toolhead_pos.x - extent_x
+    max_x = inactive_toolhead_pos.x + extent_x
+    min_y = inactive_toolhead_pos.y - extent_y
+    max_y = inactive_toolhead_pos.y + extent_y
+    for p in (arc.start, arc.end):
+        if min_x <= p.x <= max_x and min_y <= p.y <= max_y:
+            return True
+    arc_min_x, arc_min_y, arc_max_x, arc_max_y = arc.get_bounds()
+    if arc_max_x < min_x or arc_min_x > max_x or arc_max_y < min_y or arc_min_y > max_y:
+        return False
+    center_x, center_y, radius = arc.center_x, arc.center_y, arc.radius
+    # crossings of the circle with the edges, on the edge and on the arc
+    for x in (min_x, max_x):
+        dx = x - center_x
+        if abs(dx) <= radius:
+            dy = math.sqrt(radius * radius - dx * dx)
+            for y in (center_y - dy, center_y + dy):
+                if min_y <= y <= max_y and arc.get_fraction(math.atan2(y - center_y, dx)) <= 1.0:
+                    return True
+    for y in (min_y, max_y):
+        dy = y - center_y
+        if abs(dy) <= radius:
+            dx = math.sqrt(radius * radius - dy * dy)
+            for x in (center_x - dx, center_x + dx):
+                if min_x <= x <= max_x and arc.get_fraction(math.atan2(dy, x - center_x)) <= 1.0:
+                    return True
+    return False
+
+
+def check_for_overlap_move(toolhead_pos: Point, next_toolhead_pos: Point, inactive_toolhead_pos: Point,
+                           line) -> bool:
+    """Swept area check of the move line, along the arc for G2/G3 and straight otherwise"""
+    if is_arc(line):
+        arc = get_arc(toolhead_pos, next_toolhead_pos, line)
+        if arc is not None:
+            return check_for_overlap_arc(arc, inactive_toolhead_pos)
+    return check_for_overlap_sweep(toolhead_pos, next_toolhead_pos, inactive_toolhead_pos)
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# Batch post processing of many G-code files in parallel worker processes.
+# Each worker keeps its interpreter and imports for all files it gets, a combined summary of the
+# DuelRunner metrics and wall times is printed at the end.
+#
+# Sample invocations:
+#   ./duelingzero_postprocessing.py --batch queue/
+#       writes queue/<name>_d0.gcode for every queue/<name>.gcode
+#   ./duelingzero_postprocessing.py --batch "queue/*.gcode" --output-dir ready --jobs 4 --summary summary.json
+
+import glob
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from duelingzero_postprocessing import DuelRunner
+from toolhead import set_collision_backend, set_sweep_margins
+
+BATCH_SUFFIX = "_d0"   # added to outputs written next to their inputs
+
+
+def collect_batch_files(pattern: str) -> list:
+    """Return the gcode files of a directory or glob, without outputs of an earlier batch run"""
+    if os.path.isdir(pattern):
+        pattern = os.path.join(pattern, "*.gcode")
+    files = sorted(f for f in glob.glob(pattern) if os.path.isfile(f))
+    return [f for f in files if not os.path.splitext(f)[0].endswith(BATCH_SUFFIX)]
+
+
+def get_batch_output_path(f_input: str, output_dir) -> str:
+    if output_dir:
+        return os.path.join(output_dir, os.path.basename(f_input))
+    stem, ext = os.path.splitext(f_input)
+    return stem + BATCH_SUFFIX + ext
+
+
+def process_file(passed_args, f_input: str, f_output: str) -> dict:
+    """Worker: post process one file, return its metrics and wall time"""
+    set_collision_backend(passed_args.collision_backend)
+    set_sweep_margins(passed_args.sweep_margin_x, passed_args.sweep_margin_y)
+    start = time.perf_counter()
+    dr = DuelRunner(passed_args)
+    dr.play_file(f_input, f_output)
+    result = {'input': f_input, 'output': f_output, 'wall_time': time.perf_counter() - start}
+    result.update(dr.get_metrics())
+    return result
+
+
+def get_batch_totals(results: list) -> dict:
+    totals = {}
+    for result in results:
+        for key, value in result.items():
+            if key not in ('input', 'output', 'error'):
+                totals[key] = totals.get(key, 0) + value
+    return totals
+
+
+def print_batch_summary(results: list, totals: dict, wall_time: float):
+    print("%-50s %7s %7s %9s %6s %8s" % ("file", "simple", "backup", "segmented", "parks", "time/s"))
+    for result in results:
+        if 'error' in result:
+            print("%-50s failed: %s" % (result['input'], result['error']))
+            continue
+        print("%-50s %7d %7d %9d %6d %8.2f" % (
+            result['input'],
+            result['simple_shuffles_t0'] + result['simple_shuffles_t1'],
+            result['backup_shuffles_t0'] + result['backup_shuffles_t1'],
+            result['segmented_shuffles_t0'] + result['segmented_shuffles_t1'],
+            result['park_moves_t0'] + result['park_moves_t1'],
+            result['wall_time']))
+    if totals:
+        print("%-50s %7d %7d %9d %6d %8.2f" % (
+            "total",
+            totals['simple_shuffles_t0'] + totals['simple_shuffles_t1'],
+            totals['backup_shuffles_t0'] + totals['backup_shuffles_t1'],
+            totals['segmented_shuffles_t0'] + totals['segmented_shuffles_t1'],
+            totals['park_moves_t0'] + totals['park_moves_t1'],
+            totals['wall_time']))
+    print("Batch wall time: %.2fs" % wall_time)
+
+
+def run_batch(passed_args) -> int:
+    """Post process all files of passed_args.batch in a process pool. Returns the exit code."""
+    if passed_args.stats:
+        # one report file for all workers, the metrics per file are in the --summary
+        print("--batch does not support --stats, use --summary")
+        return 1
+    files = collect_batch_files(passed_args.batch)
+    if not files:
+        print("No gcode files found for: %s" % passed_args.batch)
+        return 1
+    if passed_args.output_dir:
+        os.makedirs(passed_args.output_dir, exist_ok=True)
+    jobs = passed_args.jobs
+    if not jobs:
+        jobs = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+    jobs = max(1, min(jobs, len(files)))
+
+    print("Running batch of %d files with %d workers:" % (len(files), jobs))
+    start = time.perf_counter()
+    results = []
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(process_file, passed_args, f, get_batch_output_path(f, passed_args.output_dir))
+                   for f in files]
+        for f_input, future in zip(files, futures):
+            try:
+                results.append(future.result())
+            except (Exception, SystemExit) as e:  # DuelRunner exits on invalid gcode
+                results.append({'input': f_input, 'error': repr(e)})
+    wall_time = time.perf_counter() - start
+
+    totals = get_batch_totals(r for r in results if 'error' not in r)
+    print_batch_summary(results, totals, wall_time)
+    if passed_args.summary:
+        with open(passed_args.summary, 'w') as f:
+            json.dump({'files': results, 'totals': totals, 'wall_time': wall_time, 'jobs': jobs}, f, indent=2)
+    print("Finished.")
+    return 1 if any('error' in r for r in results) else 0
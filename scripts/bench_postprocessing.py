@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+# Benchmark suite of the post processing.
+# Runs DuelRunner over the gcode/ and examples/ corpus plus large and synthetic generated files and reports
+# lines/sec, the split of the time between parsing, collision checking and output, and the peak RSS of every file.
+# The synthetic files run one avoidance path each (none, simple, backup, segmented), see gcode_generator.py.
+# Each file is measured in a fresh process, so the peak RSS is the one of that file only.
+#
+# The time split is taken from the phase timers of run_stats.py (--stats), all phases timed within the same run:
+# parse is getting the next tokenized line including reading the input, output the formatting and writing of lines,
+# collision the rest. The timers add some overhead, so these are runs of their own and lines/sec is taken from
+# complete runs without them.
+#
+# Results can be stored as JSON and compared to an earlier run, files whose lines/sec dropped by more than the
+# threshold are flagged and the exit code is 1.
+#
+# --memory reports the bytes per move held instead: the moves as tokenized line objects and as the columns of
+# move_columns.py, measured with tracemalloc.
+#
+# Sample invocations:
+#   ./bench_postprocessing.py --save bench.json
+#   ./bench_postprocessing.py --compare bench.json --threshold 10
+#   ./bench_postprocessing.py --parser gcodeparser --large-copies 0 gcode/square_2_layer.gcode
+#   ./bench_postprocessing.py --memory --synthetic-layers 0
+
+import argparse
+import glob
+import json
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from multiprocessing import get_context
+
+from duelingzero_postprocessing import DuelRunner, get_arg_parser, parse_gcode_stream
+from gcode_generator import GcodeGenerator, get_generator_arg_parser, TARGETS
+from gcode_tokenizer import tokenize_gcode_stream
+from gcodeparser.commands import Commands
+from move_columns import MoveColumns
+from run_stats import RunStats
+from toolhead import set_collision_backend, COLLISION_BACKENDS, LEFT_PARK_POS, RIGHT_PARK_POS
+
+LARGE_SOURCE = "gcode/cylinder_1_layer_filled_10_perim.gcode"
+DEFAULT_THRESHOLD = 10.0   # percent of lines/sec
+SYNTHETIC_CHANGES_PER_LAYER = 3
+MIN_COMPARE_LINES = 500    # smaller files are dominated by start up noise, they are reported but not compared
+
+
+def get_corpus_files() -> list:
+    return sorted(glob.glob("gcode/*.gcode")) + sorted(glob.glob("examples/*.gcode"))
+
+
+def write_repeated_file(source: str, copies: int, path: str):
+    """Write a large file by repeating the content of source"""
+    with open(source, 'r') as f:
+        content = f.read()
+    if not content.endswith('\n'):
+        content += '\n'
+    with open(path, 'w') as f:
+        for _ in range(copies):
+            f.write(content)
+
+
+def write_synthetic_file(target: str, layers: int, path: str):
+    """Write a generated file running the target avoidance path of the post processing in every tool segment"""
+    generator_args = get_generator_arg_parser().parse_args(
+        ['--layers', str(layers), '--changes-per-layer', str(SYNTHETIC_CHANGES_PER_LAYER), '--target', target])
+    GcodeGenerator(generator_args).write_file(path)
+
+
+def get_peak_rss_kb() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak   # bytes on macOS, KiB elsewhere
+
+
+def best_time(func, repeat: int) -> float:
+    """Best wall time of repeat runs of func()"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def measure_file(gcode_file: str, runner_args: list, repeat: int) -> dict:
+    """Worker, measures one file. Returns lines, times, peak RSS and the DuelRunner metrics."""
+    passed_args = get_arg_parser().parse_args(runner_args)
+    set_collision_backend(passed_args.collision_backend)
+    with open(gcode_file, 'r') as f:
+        line_count = sum(1 for _ in f)
+    tmp_dir = tempfile.mkdtemp()
+    output = os.path.join(tmp_dir, "out.gcode")
+
+    def new_runner():
+        dr = DuelRunner(passed_args)
+        dr.verbose = False
+        return dr
+
+    def run_complete():
+        new_runner().play_file(gcode_file, output)
+
+    def run_timed_phases() -> DuelRunner:
+        dr = new_runner()
+        dr.stats = RunStats()
+        dr.stats.attach(dr)
+        dr.play_file(gcode_file, output)
+        return dr
+
+    try:
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            total_time = best_time(run_complete, repeat)
+            peak_rss_kb = get_peak_rss_kb()
+            dr = min((run_timed_phases() for _ in range(repeat)), key=lambda runner: runner.stats.wall_time)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    phases = dr.stats.get_report()['phases']
+    result = {'file': gcode_file, 'lines': line_count, 'bytes': os.path.getsize(gcode_file),
+              'total_time': total_time, 'phase_time': dr.stats.wall_time, 'parse_time': phases['parse'],
+              'collision_time': phases['collision'], 'output_time': phases['emit'],
+              'lines_per_sec': line_count / total_time if total_time else 0.0,
+              'peak_rss_kb': peak_rss_kb}
+    result.update(dr.get_metrics())
+    return result
+
+
+def get_traced_size(func) -> tuple:
+    """Result of func() and the bytes allocated by it which are still in use"""
+    tracemalloc.start()
+    try:
+        result = func()
+        size, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, size
+
+
+def measure_move_memory(gcode_file: str, parser: str) -> dict:
+    """Worker, measures the bytes per move of the moves of one file held as line objects and as columns"""
+    def read_lines():
+        with open(gcode_file, 'r') as f:
+            lines = parse_gcode_stream(f) if parser == 'gcodeparser' else tokenize_gcode_stream(f)
+            return [line for line in lines if line.type == Commands.MOVE]
+
+    def read_columns():
+        with open(gcode_file, 'r') as f:
+            lines = parse_gcode_stream(f) if parser == 'gcodeparser' else tokenize_gcode_stream(f)
+            return MoveColumns.from_lines(lines, 'left', LEFT_PARK_POS, RIGHT_PARK_POS)
+
+    lines, lines_size = get_traced_size(read_lines)
+    moves = len(lines)
+    del lines
+    columns, columns_size = get_traced_size(read_columns)
+    assert len(columns) == moves
+    return {'file': gcode_file, 'moves': moves, 'lines_bytes_per_move': lines_size / moves if moves else 0.0,
+            'columns_bytes_per_move': columns_size / moves if moves else 0.0}
+
+
+def measure_in_new_process(gcode_file: str, runner_args: list, repeat: int) -> dict:
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+        return executor.submit(measure_file, gcode_file, runner_args, repeat).result()
+
+
+def get_totals(results: list) -> dict:
+    totals = {'lines': 0, 'total_time': 0.0, 'phase_time': 0.0, 'parse_time': 0.0, 'collision_time': 0.0,
+              'output_time': 0.0, 'peak_rss_kb': 0}
+    for result in results:
+        for key in totals:
+            if key == 'peak_rss_kb':
+                totals[key] = max(totals[key], result[key])
+            else:
+                totals[key] += result[key]
+    totals['lines_per_sec'] = totals['lines'] / totals['total_time'] if totals['total_time'] else 0.0
+    return totals
+
+
+def get_rates(bench_result: dict) -> dict:
+    """lines/sec by file of a benchmark result, files too small to be timed reliably are left out"""
+    return {r['file']: r['lines_per_sec'] for r in bench_result['files'] if r['lines'] >= MIN_COMPARE_LINES}
+
+
+def get_common_rate(bench_result: dict, files: set) -> float:
+    """Total lines/sec of the given files of a benchmark result"""
+    results = [r for r in bench_result['files'] if r['file'] in files]
+    total_time = sum(r['total_time'] for r in results)
+    return sum(r['lines'] for r in results) / total_time if total_time else 0.0
+
+
+def find_regressions(baseline: dict, current: dict, threshold: float) -> list:
+    """Compare the lines/sec of two benchmark results. Returns (file, baseline lines/sec, current lines/sec,
+    change in percent) of every file which got slower by more than threshold percent, the files found in both
+    results together as 'total'. Files missing in either result are not compared."""
+    baseline_rates = get_rates(baseline)
+    current_rates = get_rates(current)
+    common = {r['file'] for r in baseline['files']} & {r['file'] for r in current['files']}
+    baseline_rates['total'] = get_common_rate(baseline, common)
+    current_rates['total'] = get_common_rate(current, common)
+    regressions = []
+    for name, rate in current_rates.items():
+        old_rate = baseline_rates.get(name)
+        if not old_rate:
+            continue
+        change = (rate - old_rate) / old_rate * 100
+        if change < -threshold:
+            regressions.append((name, old_rate, rate, change))
+    return regressions
+
+
+def print_results(results: list, totals: dict, baseline=None):
+    baseline_rates = get_rates(baseline) if baseline else {}
+    if baseline:
+        baseline_rates['total'] = baseline['totals']['lines_per_sec']
+    print("%-50s %9s %10s %6s %6s %6s %8s %8s" % ("file", "lines", "lines/s", "parse", "coll", "output",
+                                                    "peak MB", "change"))
+    for result in results + [dict(totals, file='total')]:
+        phase_time = result['phase_time'] or 1.0   # shares of the run timed by phase
+        old_rate = baseline_rates.get(result['file'])
+        change = "%+7.1f%%" % ((result['lines_per_sec'] - old_rate) / old_rate * 100) if old_rate else ""
+        print("%-50s %9d %10.0f %5.0f%% %5.0f%% %5.0f%% %8.1f %8s" % (
+            result['file'], result['lines'], result['lines_per_sec'],
+            result['parse_time'] / phase_time * 100, result['collision_time'] / phase_time * 100,
+            result['output_time'] / phase_time * 100, result['peak_rss_kb'] / 1024, change))
+
+
+def print_memory_results(results: list):
+    print("%-50s %9s %12s %12s" % ("file", "moves", "lines B/mv", "columns B/mv"))
+    for result in results:
+        print("%-50s %9d %12.0f %12.0f" % (result['file'], result['moves'], result['lines_bytes_per_move'],
+                                           result['columns_bytes_per_move']))
+
+
+def run_benchmark(passed_args) -> int:
+    """Run the benchmark, returns the exit code"""
+    runner_args = ['--parser', passed_args.parser, '--collision-backend', passed_args.collision_backend]
+    if passed_args.no_prescreen:
+        runner_args.append('--no-prescreen')
+    gcode_files = passed_args.gcodefiles or get_corpus_files()
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        if passed_args.large_copies:
+            large_file = os.path.join(tmp_dir, "%s_x%d.gcode" % (
+                os.path.splitext(os.path.basename(passed_args.large_source))[0], passed_args.large_copies))
+            write_repeated_file(passed_args.large_source, passed_args.large_copies, large_file)
+            gcode_files = gcode_files + [large_file]
+        if passed_args.synthetic_layers:
+            for target in TARGETS:
+                synthetic_file = os.path.join(tmp_dir, "synthetic_%s_%d_layers.gcode" % (
+                    target, passed_args.synthetic_layers))
+                write_synthetic_file(target, passed_args.synthetic_layers, synthetic_file)
+                gcode_files = gcode_files + [synthetic_file]
+        results = []
+        for gcode_file in gcode_files:
+            if passed_args.memory:
+                with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+                    result = executor.submit(measure_move_memory, gcode_file, passed_args.parser).result()
+            else:
+                result = measure_in_new_process(gcode_file, runner_args, passed_args.repeat)
+            if result['file'].startswith(tmp_dir):
+                result['file'] = "generated/" + os.path.basename(result['file'])
+            results.append(result)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    if passed_args.memory:
+        print_memory_results(results)
+        return 0
+    current = {'python': platform.python_version(), 'machine': platform.machine(), 'time': time.time(),
+               'settings': {'parser': passed_args.parser, 'collision_backend': passed_args.collision_backend,
+                            'prescreen': not passed_args.no_prescreen, 'repeat': passed_args.repeat},
+               'files': results, 'totals': get_totals(results)}
+    baseline = None
+    if passed_args.compare:
+        with open(passed_args.compare, 'r') as f:
+            baseline = json.load(f)
+    print_results(results, current['totals'], baseline)
+    if passed_args.save:
+        with open(passed_args.save, 'w') as f:
+            json.dump(current, f, indent=2)
+
+    if baseline:
+        regressions = find_regressions(baseline, current, passed_args.threshold)
+        for name, old_rate, rate, change in regressions:
+            print("REGRESSION %s: %.0f -> %.0f lines/s (%+.1f%%)" % (name, old_rate, rate, change))
+        if regressions:
+            return 1
+    return 0
+
+
+def get_bench_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Benchmark the post processing: lines/sec, time split, peak RSS.")
+    parser.add_argument('--repeat', help="Runs per file and phase, best one counts", type=int, default=3)
+    parser.add_argument('--parser', help="G-code parser to benchmark", choices=['fast', 'gcodeparser'],
+                        default='fast')
+    parser.add_argument('--collision-backend', help="Collision check backend to benchmark",
+                        choices=COLLISION_BACKENDS, default=COLLISION_BACKENDS[0])
+    parser.add_argument('--no-prescreen', help="Benchmark without the NumPy prescreen", action='store_true')
+    parser.add_argument('--large-source', help="File repeated into the generated large file", default=LARGE_SOURCE)
+    parser.add_argument('--large-copies', help="Copies of --large-source in the generated large file, 0 for none",
+                        type=int, default=20)
+    parser.add_argument('--synthetic-layers', help="Layers of the synthetic files generated for every avoidance path, "
+                                                   "0 for none", type=int, default=10)
+    parser.add_argument('--memory', help="Report the bytes per move of the moves held as line objects and as "
+                                         "columns instead of the timings", action='store_true')
+    parser.add_argument('--save', help="Write the results as JSON to this file")
+    parser.add_argument('--compare', help="JSON results of an earlier run to compare with")
+    parser.add_argument('--threshold', help="Flag lines/sec drops of more than this percent, default: %.0f" %
+                        DEFAULT_THRESHOLD, type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument('gcodefiles', nargs='*', help="Files to benchmark, default: gcode/ and examples/")
+    return parser
+
+
+if __name__ == "__main__":
+    sys.exit(run_benchmark(get_bench_arg_parser().parse_args()))
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# Benchmark of the built-in fast tokenizer against gcodeparser.
+#
+# Sample invocations:
+#   ./bench_tokenizer.py
+#       for all files in gcode/
+#   ./bench_tokenizer.py --repeat 10 gcode/square_2_layer.gcode
+
+import argparse
+import glob
+import time
+
+from gcodeparser import GcodeParser
+
+from gcode_tokenizer import tokenize_gcode
+
+
+def best_time(func, content, repeat: int) -> float:
+    """Best wall time of repeat runs of func(content)"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(content)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def run_benchmark(gcode_files, repeat: int):
+    print("%-50s %8s %14s %14s %8s" % ("file", "lines", "gcodeparser/s", "tokenizer/s", "speedup"))
+    total_lines = 0
+    total_gcodeparser = 0.0
+    total_tokenizer = 0.0
+    for gcode_file in gcode_files:
+        with open(gcode_file, 'r') as f:
+            content = f.read()
+        line_count = content.count('\n') + 1
+        t_gcodeparser = best_time(lambda c: GcodeParser(c, include_comments=True).lines, content, repeat)
+        t_tokenizer = best_time(tokenize_gcode, content, repeat)
+        print("%-50s %8d %14.0f %14.0f %7.1fx" % (gcode_file, line_count, line_count / t_gcodeparser,
+                                                  line_count / t_tokenizer, t_gcodeparser / t_tokenizer))
+        total_lines += line_count
+        total_gcodeparser += t_gcodeparser
+        total_tokenizer += t_tokenizer
+    if total_lines:
+        print("%-50s %8d %14.0f %14.0f %7.1fx" % ("total", total_lines, total_lines / total_gcodeparser,
+                                                  total_lines / total_tokenizer, total_gcodeparser / total_tokenizer))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare lines/sec of the fast tokenizer and gcodeparser.")
+    parser.add_argument('--repeat', help="Runs per file, best one counts", type=int, default=5)
+    parser.add_argument('gcodefiles', nargs='*')
+    args = parser.parse_args()
+
+    run_benchmark(args.gcodefiles or sorted(glob.glob("gcode/*.gcode")), args.repeat)
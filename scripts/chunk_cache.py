@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+# On-disk cache of post processed layer chunks, for reprocessing a file re-sliced with a small change.
+# The input is split at every ;LAYER_CHANGE. A chunk is keyed by a hash of its content and of the DuelRunner state
+# (toolhead positions, active toolhead, feed rate and Z-lift state) at its start, which is all the output of the
+# chunk depends on. Chunks found in the cache are written as they are and their end state is taken over, only
+# changed chunks, or chunks reached with a different state, are played again.
+#
+# Keys include a hash of the geometry and speed constants of toolhead.py, the cache is cleared once these change.
+# Options changing the output, the sweep margins and the collision backend among them, are part of the keys only,
+# so runs with different options share the cache. Entries used least recently are evicted once the cache grows
+# above --cache-size.
+#
+# Sample invocation:
+#   ./duelingzero_postprocessing.py --cache-dir ~/.cache/d0 --input sample.gcode --output sample_d0_ready.gcode
+
+import hashlib
+import io
+import json
+import os
+import tempfile
+
+import toolhead
+from duelingzero_postprocessing import DuelRunner, atomic_output, parse_gcode_stream, DEFAULT_CACHE_SIZE
+from gcode_tokenizer import tokenize_gcode_stream
+from layer_parallel import LAYER_CHANGE
+
+CACHE_VERSION = 1   # increase when the output of the post processing changes
+CACHE_SUFFIX = ".chunk"
+GEOMETRY_FILE = "geometry"
+# constants of toolhead.py the output depends on, not the ones set at run time
+GEOMETRY_CONSTANTS = ('Y_HEIGHT', 'Y_HIGH', 'Y_LOW', 'X_WIDTH', 'X_HIGH', 'X_LOW', 'LEFT_ALT_Y', 'RIGHT_ALT_Y',
+                      'LEFT_PARK_POS', 'RIGHT_PARK_POS', 'Z_LIFT', 'SHUFFLE_SPEED', 'BACKOFF_SPEED', 'PARK_SPEED',
+                      'MOVE_TO_SPEED', 'EXTRA_TOOLHEAD_CLEARANCE', 'TOOLHEAD_X_WIDTH', 'TOOLHEAD_Y_HEIGHT',
+                      'X_BACKOFF_LEN', 'T0_X_BACKOFF', 'T1_X_BACKOFF')
+
+
+def get_geometry_hash() -> str:
+    """Hash of the geometry constants of toolhead.py, i.e. sizes, park positions and speeds"""
+    h = hashlib.sha256()
+    for name in GEOMETRY_CONSTANTS:
+        h.update(("%s=%r\n" % (name, getattr(toolhead, name))).encode())
+    return h.hexdigest()
+
+
+def iter_chunks(text_lines):
+    """Generator of lists of lines, a new list starting at every layer change"""
+    chunk = []
+    for text_line in text_lines:
+        if text_line.startswith(LAYER_CHANGE) and chunk:
+            yield chunk
+            chunk = []
+        chunk.append(text_line)
+    if chunk:
+        yield chunk
+
+
+class ChunkCache:
+    def __init__(self, cache_dir: str, max_bytes: int = DEFAULT_CACHE_SIZE * 1024 * 1024, options=()):
+        """Cache in cache_dir. options are the arguments changing the output, they are part of every key."""
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        geometry_hash = get_geometry_hash()
+        self.invalidate_stale(geometry_hash)
+        self.prefix = ("%d %s %r\n" % (CACHE_VERSION, geometry_hash, tuple(options))).encode()
+
+    def invalidate_stale(self, geometry_hash: str):
+        """Remove all entries if they were made with other toolhead constants"""
+        geometry_path = os.path.join(self.cache_dir, GEOMETRY_FILE)
+        try:
+            with open(geometry_path) as f:
+                if f.read() == geometry_hash:
+                    return
+        except FileNotFoundError:
+            pass
+        for path in self.get_entries():
+            os.remove(path)
+        with open(geometry_path, 'w') as f:
+            f.write(geometry_hash)
+
+    def get_entries(self) -> list:
+        return [os.path.join(self.cache_dir, name) for name in os.listdir(self.cache_dir)
+                if name.endswith(CACHE_SUFFIX)]
+
+    def get_key(self, state: dict, chunk: list) -> str:
+        h = hashlib.sha256(self.prefix)
+        h.update(json.dumps(state, sort_keys=True).encode())
+        for text_line in chunk:
+            h.update(text_line.encode('utf-8', 'surrogateescape'))
+        return h.hexdigest()
+
+    def get(self, key: str):
+        """Return (end state, metrics, output) of the chunk, None if not cached"""
+        path = os.path.join(self.cache_dir, key + CACHE_SUFFIX)
+        try:
+            with open(path, encoding='utf-8', errors='surrogateescape', newline='') as f:
+                entry = json.loads(f.readline())
+                output = f.read()
+        except (FileNotFoundError, ValueError):
+            self.misses += 1
+            return None
+        os.utime(path)   # most recently used
+        self.hits += 1
+        return entry['state'], entry['metrics'], output
+
+    def put(self, key: str, state: dict, metrics: dict, output: str):
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8', errors='surrogateescape', newline='') as f:
+                f.write(json.dumps({'state': state, 'metrics': metrics}) + "\n")
+                f.write(output)
+            os.replace(tmp_path, os.path.join(self.cache_dir, key + CACHE_SUFFIX))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits into max_bytes"""
+        entries = []
+        for path in self.get_entries():
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+
+
+def play_chunk(dr: DuelRunner, chunk: list) -> tuple:
+    """Play the lines of chunk from the current state, return the metrics added and the output"""
+    before = dr.get_metrics()
+    output = io.StringIO()
+    dr.output = output
+    if dr.parser == 'gcodeparser':
+        dr.continue_gcode_lines(parse_gcode_stream(chunk))
+    else:
+        dr.continue_gcode_lines(tokenize_gcode_stream(chunk))
+    dr.output = None
+    metrics = {key: value - before[key] for key, value in dr.get_metrics().items()}
+    return metrics, output.getvalue()
+
+
+def play_file_cached(dr: DuelRunner, cache: ChunkCache, f_input: str, f_output: str):
+    """Post process f_input into f_output, which may be the same file, taking unchanged chunks from cache"""
+    dr.reset_toolheads()
+    with open(f_input, 'r') as f_in, atomic_output(f_output) as f_out:
+        for chunk in iter_chunks(f_in):
+            key = cache.get_key(dr.get_state(), chunk)
+            entry = cache.get(key)
+            if entry is None:
+                metrics, output = play_chunk(dr, chunk)
+                cache.put(key, dr.get_state(), metrics, output)
+            else:
+                state, metrics, output = entry
+                dr.set_state(state)
+                for name, value in metrics.items():
+                    setattr(dr, name, getattr(dr, name) + value)
+            f_out.write(output)
+    cache.evict()
+
+
+def get_cache_options(passed_args) -> tuple:
+    return (passed_args.parser, passed_args.verboseGcode, passed_args.collision_backend, passed_args.sweep_margin_x,
+            passed_args.sweep_margin_y)
+
+
+def run_cached(passed_args) -> int:
+    """Command line entry for --cache-dir. Returns the exit code."""
+    f_input = passed_args.gcodefile or passed_args.input
+    f_output = passed_args.gcodefile or passed_args.output
+    if not f_input or not f_output or not os.path.exists(f_input):
+        print("Invalid input file path: %s" % f_input)
+        return 1
+    if passed_args.planner != 'greedy' or passed_args.park != 'fixed' or passed_args.peephole or \
+            passed_args.zero_copy or passed_args.parallel or passed_args.stats or passed_args.reorder or \
+            passed_args.preheat:
+        # chunks are played on their own, lookahead planning and the peephole optimiser look at lines to come
+        print("--cache-dir supports the greedy planner and fixed park positions without --peephole, --zero-copy, "
+              "--parallel, --stats, --reorder or --preheat only")
+        return 1
+    cache = ChunkCache(passed_args.cache_dir, passed_args.cache_size * 1024 * 1024, get_cache_options(passed_args))
+    print("Running:")
+    play_file_cached(DuelRunner(passed_args), cache, f_input, f_output)
+    print("Cache: %d of %d chunks reused" % (cache.hits, cache.hits + cache.misses))
+    print("Finished.")
+    return 0
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# Thin client of the post processing daemon (d0_daemon.py), for use as post processing command of the slicer.
+# Only the standard library is imported, so the client starts fast. The arguments are passed on to the daemon,
+# which processes the file with its modules already loaded. If no daemon is running, the file is processed by
+# duelingzero_postprocessing.py in a new process.
+#
+# Protocol, the same over the Unix socket and localhost TCP: the request is one JSON line with the arguments
+# ("args"), the working directory of the client ("cwd") and optionally the byte count ("length") of raw G-code
+# following it. The response is one JSON line with "exit_code", "message" and "metrics", followed by the
+# processed G-code if the request had some. Over TCP the request carries the "token" the daemon wrote to a file
+# only the user can read, any local user may connect to the port.
+#
+# The socket and the token file are in a runtime directory private to the user: $XDG_RUNTIME_DIR, or
+# d0_postprocessing-<uid> in the temp directory if it is not set, i.e. for services.
+#
+# Sample invocations:
+#   ./d0_client.py sliced.gcode
+#       post process sliced.gcode in place, as called by the slicer
+#   ./d0_client.py --port 7130 --park dynamic --input sample.gcode --output sample_d0_ready.gcode
+#   ./d0_client.py --stdin < sample.gcode > sample_d0_ready.gcode
+
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+
+
+def get_runtime_dir() -> str:
+    """Directory of the socket and the token file, private to the user"""
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir:
+        return runtime_dir
+    return os.path.join(tempfile.gettempdir(), "d0_postprocessing-%d" % os.getuid())
+
+
+DEFAULT_SOCKET = os.path.join(get_runtime_dir(), "d0_postprocessing.sock")
+DEFAULT_TOKEN_FILE = os.path.join(get_runtime_dir(), "d0_postprocessing.token")
+POSTPROCESSING_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "duelingzero_postprocessing.py")
+
+
+def write_message(f, header: dict, data: bytes = None):
+    """Write the JSON header line, followed by data if given"""
+    if data is not None:
+        header = dict(header, length=len(data))
+    f.write(json.dumps(header).encode() + b"\n")
+    if data is not None:
+        f.write(data)
+    f.flush()
+
+
+def read_message(f) -> tuple:
+    """Read a message written by write_message, returns (header, data or None)"""
+    line = f.readline()
+    if not line:
+        raise ConnectionError("Connection closed without message")
+    header = json.loads(line)
+    data = None
+    if 'length' in header:
+        data = f.read(header['length'])
+        if len(data) != header['length']:
+            raise ConnectionError("Connection closed within message")
+    return header, data
+
+
+def connect(socket_path: str = DEFAULT_SOCKET, port: int = None) -> socket.socket:
+    if port:
+        return socket.create_connection(("127.0.0.1", port))
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+def read_token(token_file: str = DEFAULT_TOKEN_FILE) -> str:
+    with open(token_file, 'r') as f:
+        return f.read().strip()
+
+
+def send_job(args: list, gcode: bytes = None, socket_path: str = DEFAULT_SOCKET, port: int = None,
+             token_file: str = DEFAULT_TOKEN_FILE) -> tuple:
+    """Run a job on the daemon: args of duelingzero_postprocessing.py, relative to the current directory.
+    Returns (response, processed gcode or None). Raises OSError if no daemon is listening."""
+    request = {'args': args, 'cwd': os.getcwd()}
+    if port:
+        request['token'] = read_token(token_file)
+    with connect(socket_path, port) as sock, sock.makefile('rwb') as f:
+        write_message(f, request, gcode)
+        return read_message(f)
+
+
+def get_client_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Post process a gcode file by the post processing daemon. "
+                                                 "Other arguments are passed on, see duelingzero_postprocessing.py -h")
+    parser.add_argument('--socket', help="Unix socket of the daemon", default=DEFAULT_SOCKET)
+    parser.add_argument('--port', help="Localhost TCP port of the daemon, instead of the Unix socket", type=int)
+    parser.add_argument('--token-file', help="Token of the daemon for --port", default=DEFAULT_TOKEN_FILE)
+    parser.add_argument('--stdin', help="Read the gcode from stdin and write the result to stdout, "
+                                        "needs a running daemon", action='store_true')
+    parser.add_argument('--no-fallback', help="Fail if no daemon is running instead of processing in a new process",
+                        action='store_true')
+    return parser
+
+
+def main(argv: list) -> int:
+    client_args, args = get_client_arg_parser().parse_known_args(argv)
+    gcode = sys.stdin.buffer.read() if client_args.stdin else None
+    try:
+        response, output = send_job(args, gcode, client_args.socket, client_args.port, client_args.token_file)
+    except OSError as e:
+        if client_args.stdin or client_args.no_fallback:
+            print("No post processing daemon: %s" % e, file=sys.stderr)
+            return 2
+        return subprocess.call([sys.executable, POSTPROCESSING_SCRIPT] + args)
+    if output is not None:
+        sys.stdout.buffer.write(output)
+    if response['message']:
+        print(response['message'], file=sys.stderr if client_args.stdin else sys.stdout)
+    return response['exit_code']
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+# Resident post processing daemon. Python, gcodeparser, NumPy and shapely are loaded once, so a job only costs
+# the processing itself. For small files the start of a new process is most of the run time otherwise.
+# Jobs come from d0_client.py (slicer post processing command) or the Moonraker component moonraker_d0.py over
+# a Unix socket, or localhost TCP with --port. They are either a file path given by the arguments of
+# duelingzero_postprocessing.py, or raw G-code sent along, which is returned processed.
+#
+# Jobs run one after the other. A DuelRunner is kept for every set of options and reset between jobs.
+#
+# Only the user running the daemon may send jobs. The socket is created 0600 in the runtime directory of
+# d0_client.py, which is created 0700 if missing. A path in the way is only removed if it is a socket. With --port
+# a random token is written to a 0600 file next to it and every request has to carry it.
+#
+# Sample invocations:
+#   ./d0_daemon.py
+#       listens on $XDG_RUNTIME_DIR/d0_postprocessing.sock
+#   ./d0_daemon.py --port 7130
+#       listens on 127.0.0.1:7130 instead, the token in $XDG_RUNTIME_DIR/d0_postprocessing.token
+
+import argparse
+import hmac
+import io
+import os
+import secrets
+import signal
+import socketserver
+import stat
+import sys
+
+from d0_client import get_runtime_dir, read_message, write_message, DEFAULT_SOCKET, DEFAULT_TOKEN_FILE
+from duelingzero_postprocessing import DuelRunner, get_arg_parser
+from toolhead import set_collision_backend, set_sweep_margins
+
+UNSUPPORTED_OPTIONS = ['batch', 'parallel', 'cache_dir', 'stats', 'profile']
+PATH_OPTIONS = ['input', 'output', 'gcodefile']
+LOG_OPTIONS = ['log']   # paths too, but part of the runner options: the runner keeps its log open
+
+
+class JobError(Exception):
+    pass
+
+
+def resolve_paths(passed_args, cwd: str):
+    """Make the paths of the job relative to the working directory of the client"""
+    for name in PATH_OPTIONS + LOG_OPTIONS:
+        path = getattr(passed_args, name)
+        if path:
+            setattr(passed_args, name, os.path.join(cwd, os.path.expanduser(path)))
+
+
+class PostProcessingDaemon:
+    def __init__(self):
+        self.runners: dict = {}   # options without paths -> DuelRunner
+
+    def get_runner(self, passed_args) -> DuelRunner:
+        """DuelRunner for the options of the job, reset from the job before"""
+        key = tuple(sorted((name, value) for name, value in vars(passed_args).items() if name not in PATH_OPTIONS))
+        dr = self.runners.get(key)
+        if dr is None:
+            dr = self.runners[key] = DuelRunner(passed_args)
+        else:
+            dr.reset()
+        return dr
+
+    def parse_job(self, request: dict):
+        try:
+            passed_args = get_arg_parser().parse_args(request['args'])
+        except SystemExit:
+            raise JobError("Invalid arguments: %s" % " ".join(request['args']))
+        for name in UNSUPPORTED_OPTIONS:
+            if getattr(passed_args, name):
+                raise JobError("--%s is not supported by the daemon" % name.replace('_', '-'))
+        if passed_args.peephole and passed_args.zero_copy:
+            raise JobError("--peephole does not work with --zero-copy")
+        if passed_args.reorder and passed_args.zero_copy:
+            raise JobError("--reorder does not work with --zero-copy")
+        if passed_args.preheat and passed_args.zero_copy:
+            raise JobError("--preheat does not work with --zero-copy")
+        resolve_paths(passed_args, request.get('cwd', os.getcwd()))
+        return passed_args
+
+    def run_job(self, request: dict, gcode: bytes = None) -> tuple:
+        """Run a job, returns the response and the processed gcode, None for a file job"""
+        try:
+            passed_args = self.parse_job(request)
+        except JobError as e:
+            return {'exit_code': 2, 'message': str(e), 'metrics': {}}, None
+        set_collision_backend(passed_args.collision_backend)
+        set_sweep_margins(passed_args.sweep_margin_x, passed_args.sweep_margin_y)
+        dr = self.get_runner(passed_args)
+        if gcode is not None:
+            return self.run_gcode_job(dr, passed_args, gcode)
+        f_input = passed_args.input or passed_args.gcodefile
+        f_output = passed_args.output or passed_args.gcodefile
+        if not f_input or not os.path.exists(f_input):
+            return {'exit_code': 2, 'message': "Invalid input file path: %s" % f_input, 'metrics': {}}, None
+        if passed_args.check:
+            error = dr.check_file(f_input)
+            return self.get_check_response(dr, error, f_input), None
+        if not f_output:
+            return {'exit_code': 2, 'message': "No output file path", 'metrics': {}}, None
+        dr.play_file(f_input, f_output)
+        return {'exit_code': 0, 'message': "Finished: %s" % f_output, 'metrics': dr.get_metrics()}, None
+
+    def run_gcode_job(self, dr: DuelRunner, passed_args, gcode: bytes) -> tuple:
+        if passed_args.check:
+            return self.get_check_response(dr, dr.check_buffer(gcode), "gcode"), None
+        output = io.StringIO()
+        dr.play_gcodes_stream_to(io.StringIO(gcode.decode('utf-8', 'surrogateescape')), output)
+        return ({'exit_code': 0, 'message': "", 'metrics': dr.get_metrics()},
+                output.getvalue().encode('utf-8', 'surrogateescape'))
+
+    @staticmethod
+    def get_check_response(dr: DuelRunner, error, name: str) -> dict:
+        if error is not None:
+            return {'exit_code': 1, 'message': "Unsafe %s" % error, 'metrics': dr.get_metrics()}
+        return {'exit_code': 0, 'message': "Safe: %s" % name, 'metrics': dr.get_metrics()}
+
+
+def make_private_dir(path: str):
+    """Create the directory of path for the user only if missing. The runtime directory has to be private."""
+    directory = os.path.dirname(os.path.abspath(path))
+    if not os.path.isdir(directory):
+        os.makedirs(directory, mode=0o700)
+    if directory == get_runtime_dir():
+        info = os.lstat(directory)
+        if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+            raise PermissionError("Runtime directory not private to the user: %s" % directory)
+
+
+def remove_stale_socket(socket_path: str):
+    """Remove a socket left behind by a daemon not shut down, nothing else"""
+    try:
+        info = os.lstat(socket_path)
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(info.st_mode):
+        raise FileExistsError("Not a socket, not removed: %s" % socket_path)
+    os.remove(socket_path)
+
+
+def write_token(token_file: str) -> str:
+    """Write a new random token to token_file, readable by the user only"""
+    make_private_dir(token_file)
+    token = secrets.token_hex(16)
+    if os.path.lexists(token_file):
+        os.remove(token_file)
+    fd = os.open(token_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        f.write(token + "\n")
+    return token
+
+
+class JobHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        request, gcode = read_message(self.rfile)
+        token = self.server.token
+        if token is not None and not hmac.compare_digest(str(request.get('token', '')), token):
+            write_message(self.wfile, {'exit_code': 2, 'message': "Invalid token", 'metrics': {}})
+            return
+        try:
+            response, output = self.server.postprocessing.run_job(request, gcode)
+        except (Exception, SystemExit) as e:   # the daemon keeps running for the next job, DuelRunner exits on
+            # an unknown tool or a feed rate not restored
+            response, output = {'exit_code': 1, 'message': "Post processing failed: %r" % e, 'metrics': {}}, None
+        write_message(self.wfile, response, output)
+
+
+class UnixJobServer(socketserver.UnixStreamServer):
+    token = None   # the permissions of the socket decide who may connect
+
+    def __init__(self, socket_path: str, daemon: PostProcessingDaemon):
+        make_private_dir(socket_path)
+        remove_stale_socket(socket_path)
+        super().__init__(socket_path, JobHandler)
+        self.postprocessing = daemon
+
+    def server_bind(self):
+        umask = os.umask(0o177)   # 0600 from the start, no window for others to connect
+        try:
+            super().server_bind()
+        finally:
+            os.umask(umask)
+
+    def server_close(self):
+        super().server_close()
+        try:
+            remove_stale_socket(self.server_address)
+        except FileExistsError:
+            pass   # replaced by something else meanwhile, left alone
+
+
+class TcpJobServer(socketserver.TCPServer):
+    allow_reuse_address = True
+
+    def __init__(self, port: int, daemon: PostProcessingDaemon, token_file: str = DEFAULT_TOKEN_FILE):
+        super().__init__(("127.0.0.1", port), JobHandler)
+        self.postprocessing = daemon
+        self.token_file = token_file
+        self.token = write_token(token_file)
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.token_file):
+            os.remove(self.token_file)
+
+
+def create_server(socket_path: str = DEFAULT_SOCKET, port: int = None, token_file: str = DEFAULT_TOKEN_FILE):
+    daemon = PostProcessingDaemon()
+    if port is not None:
+        return TcpJobServer(port, daemon, token_file)
+    return UnixJobServer(socket_path, daemon)
+
+
+def get_daemon_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Resident post processing daemon for d0_client.py and Moonraker.")
+    parser.add_argument('--socket', help="Unix socket to listen on", default=DEFAULT_SOCKET)
+    parser.add_argument('--port', help="Listen on this localhost TCP port instead of the Unix socket", type=int)
+    parser.add_argument('--token-file', help="File the token for --port is written to", default=DEFAULT_TOKEN_FILE)
+    return parser
+
+
+def stop(signum, frame):
+    raise SystemExit(0)   # closes the server, i.e. removes the socket or the token file
+
+
+def main(passed_args) -> int:
+    signal.signal(signal.SIGTERM, stop)
+    with create_server(passed_args.socket, passed_args.port, passed_args.token_file) as server:
+        print("Listening on %s" % (server.server_address,))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(get_daemon_arg_parser().parse_args()))
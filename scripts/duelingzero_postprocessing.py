@@ -9,48 +9,206 @@
 # Sample invocations:
 #   ./dueling_postprocessing.py --input sample.gcode --output sample_d0_ready.gcode
 #   ./dueling_postprocessing.py --verbose --input sample.gcode --output sample_d0_ready.gcode
-#       for more output on the console
+#       for debug events as JSON lines on the console
+#   ./dueling_postprocessing.py --log d0.log --log-level trace --input sample.gcode --output sample_d0_ready.gcode
+#       for a JSON lines log with the toolhead positions at every line, see run_log.py
 #   ./dueling_postprocessing.py --verboseGcode  sliced.gcode
 #       for commented gcode for slicer (i.e. post-processing call)
+#   ./dueling_postprocessing.py --batch "queue/*.gcode" --output-dir ready --summary summary.json
+#       for post processing many files in parallel
+#   ./dueling_postprocessing.py --parallel --jobs 4 --input sample.gcode --output sample_d0_ready.gcode
+#       for post processing a single large file in parallel chunks
+#   ./dueling_postprocessing.py --planner lookahead --input sample.gcode --output sample_d0_ready.gcode
+#       for planning shuffles over the upcoming moves instead of deciding per move
+#   ./dueling_postprocessing.py --check sample_d0_ready.gcode
+#       for checking a processed file without writing, exit code 1 if unsafe
+#   ./dueling_postprocessing.py --cache-dir ~/.cache/d0 --input sample.gcode --output sample_d0_ready.gcode
+#       for reprocessing a re-sliced file, only layers which changed are played again
+#   ./dueling_postprocessing.py --reorder --input sample.gcode --output sample_d0_ready.gcode
+#       for grouping the islands of every layer by tool before, see island_reorder.py
+#   ./dueling_postprocessing.py --preheat --idle-temp 170 --input sample.gcode --output sample_d0_ready.gcode
+#       for keeping the inactive toolhead at idle temperature, heated back ahead of its next tool change
+#   ./d0_client.py sliced.gcode
+#       for post processing by the resident daemon d0_daemon.py, i.e. as post processing command of the slicer
 # Features:
 #  - Collision avoidance based on zruncho3d code.
 #  - Split extrusion move
+#  - G2/G3 arcs (I/J and R form), checked along the arc and split into two arcs
 #  - Feed rate restoration
 #  - Interface usable by Slicers
 #  - Z-lift for inserted moves
 #  - Optional comments in output gcode to mark inserted sections
 #  - Once processed output can be reprocessed with no change, means no collision causing gcode insertions ;)
+#  - Files are streamed line by line, output replaces the target file atomically once finished
+#  - Fast built-in tokenizer, only moves and tool changes are parsed. All other lines are passed through untouched
+#  - Analytic collision checks, shapely is optional and only used as reference backend
+#  - Exact swept area of moves (Minkowski sum of toolhead and move) with configurable safety margins
+#  - Batched NumPy prescreen, only moves which may collide get the detailed check (skipped without NumPy)
+#  - Optional zero-copy mode, input is memory mapped and unchanged lines are copied as byte ranges
+#  - Batch mode for many files and parallel chunks at layer changes for a single large file
+#  - Run statistics per layer and phase as JSON (--stats), cProfile report of the hot functions (--profile)
+#  - Optional lookahead planner, shuffles the inactive toolhead early where this avoids backup sequences
+#  - Optional dynamic park positions, chosen from the upcoming tool segment or skipped if not needed
+#  - Optional peephole optimiser removing redundant lines of neighbouring inserted sequences
+#  - Read-only --check of already processed files, stops at the first line post processing would change
+#  - Optional on-disk cache of processed layers, keyed by their content and the state at their start
+#  - Resident daemon with thin client and Moonraker component, modules are loaded once for all jobs
+#  - Optional island reordering, layers with several tool changes are grouped by tool
+#  - Optional idle temperature for the inactive toolhead, heated back ahead of the tool change (--preheat)
+#  - Leveled JSON lines log (--log), flight recorder of the last lines written at an unsafe line or an error exit
 
 import argparse
+import mmap
 import os
 import sys
+import tempfile
+from collections import deque
+from contextlib import contextmanager
 
 from gcodeparser import GcodeParser, GcodeLine
 from gcodeparser.commands import Commands
 
-from toolhead import check_for_overlap, check_for_overlap_sweep
-from toolhead import Y_HEIGHT, T0_X_BACKOFF, T1_X_BACKOFF, Y_HIGH, Y_LOW
-from toolhead import X_BACKOFF_LEN, BACKOFF_SPEED, PARK_SPEED, SHUFFLE_SPEED,MOVE_TO_SPEED, TOOLHEAD_Y_HEIGHT
+from gcode_tokenizer import tokenize_gcode, tokenize_gcode_stream, tokenize_mapped, PP_comment
+from mapped_output import MappedOutput
+from run_stats import RunStats
+from run_log import RunLog, LEVELS, DEFAULT_LEVEL, DEFAULT_RECORDER_SIZE
+from arc import is_arc, get_arc, check_for_overlap_arc, check_for_overlap_move
+from lookahead_planner import LookaheadPlanner, PLANNERS, DEFAULT_LOOKAHEAD_WINDOW
+from peephole import PeepholeWriter
+from preheat import PreheatWriter
+from park_planner import plan_parks, PARK_MODES, DEFAULT_PARK_WINDOW
+from park_planner import get_column_parks, get_park_path, runs_into, PARK_POS, OTHER
+from move_prescreen import prescreen_available, prescreen_moves, iter_blocks, PRESCREEN_BLOCK_SIZE
+from toolhead import check_for_overlap, check_for_overlap_margins, check_for_overlap_sweep, get_sweep_extents
+from toolhead import set_collision_backend, COLLISION_BACKENDS
+from toolhead import set_sweep_margins, SWEEP_MARGIN_X, SWEEP_MARGIN_Y
+from toolhead import T0_X_BACKOFF, T1_X_BACKOFF, Y_HIGH, Y_LOW
+from toolhead import X_BACKOFF_LEN, BACKOFF_SPEED, PARK_SPEED, SHUFFLE_SPEED,MOVE_TO_SPEED
 from toolhead import LEFT_PARK_POS, RIGHT_PARK_POS
 from toolhead import Z_LIFT
+from toolhead import IDLE_TEMP, HEATER_WARMUP_TIME
 from point import Point
 
 T0: GcodeLine = GcodeLine(('T', 0), {}, "")
 T1: GcodeLine = GcodeLine(('T', 1), {}, "")
 
-PP_comment : str = "PPfD0"   # Post-processed for Dueling Zero
+PROFILE_TOP: int = 25   # functions listed by --profile
+DEFAULT_CACHE_SIZE: int = 256   # MB, for --cache-dir
+SPLIT_CLEARANCE: float = 0.5   # mm, a segmented move is split this far beyond touching the shuffled toolhead
+
+
+def parse_gcode_stream(text_lines):
+    """Generator parsing G-code line by line, so only the current line is held in memory."""
+    for text_line in text_lines:
+        yield from GcodeParser(text_line, include_comments=True).lines
+
+
+@contextmanager
+def atomic_output(path: str, mode: str = "w"):
+    """Open a temporary file next to path for writing. It replaces path only if the block finished without error,
+    so a crash mid-run never leaves a truncated file behind."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix="." + os.path.basename(path) + ".", suffix=".tmp")
+    success = False
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.exists(path):
+            # keep permissions of the file we replace, mkstemp creates 0600
+            os.chmod(tmp_path, os.stat(path).st_mode & 0o7777)
+        os.replace(tmp_path, path)
+        success = True
+    finally:
+        if not success and os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
+
+class UnsafeGcodeError(Exception):
+    def __init__(self, line, reason: str, toolhead_pos: Point, next_toolhead_pos: Point, inactive_toolhead_pos: Point):
+        """Raised by --check at the first line post processing would have to change"""
+        super().__init__(reason)
+        self.line = line
+        self.line_no = None   # set by check_file
+        self.reason = reason
+        self.toolhead_pos = toolhead_pos
+        self.next_toolhead_pos = next_toolhead_pos
+        self.inactive_toolhead_pos = inactive_toolhead_pos
+
+    def __str__(self):
+        return "line %s: %s: %s, active toolhead at %s -> %s, inactive toolhead at %s" % (
+            self.line_no, self.reason, self.line.gcode_str.strip(), self.toolhead_pos, self.next_toolhead_pos,
+            self.inactive_toolhead_pos)
+
 
 class DuelRunner:
     def __init__(self, passed_args):
         """Init function for DuelRunner. Storing passed arguments and initialising statistics"""
         if passed_args is not None:
             self.output = None  # output file handler
-            self.verbose: bool   = passed_args.verbose
+            if passed_args.log:
+                self.log = RunLog.open(passed_args.log, passed_args.log_level, passed_args.flight_recorder)
+            else:
+                self.log = RunLog(None, passed_args.log_level, passed_args.flight_recorder)
+            self.verbose = passed_args.verbose
             self.verboseGcode: bool= passed_args.verboseGcode
+            self.parser: str = passed_args.parser
+            self.prescreen: bool = not passed_args.no_prescreen
+            self.zero_copy: bool = passed_args.zero_copy
+            self.stats = RunStats() if passed_args.stats else None
+            self.planner: str = passed_args.planner
+            self.lookahead_window: int = passed_args.lookahead_window
+            self.park: str = passed_args.park
+            self.park_window: int = passed_args.park_window
+            self.peephole: bool = passed_args.peephole
+            self.check: bool = passed_args.check
+            self.reorder: bool = passed_args.reorder
+            self.preheat: bool = passed_args.preheat
+            self.idle_temp: float = passed_args.idle_temp
+            self.heater_warmup_time: float = passed_args.heater_warmup_time
         else:
             self.output = None  # output file handler
-            self.verbose: bool = True
+            self.log = RunLog()
+            self.verbose = True
             self.verboseGcode: bool = True
+            self.parser: str = 'fast'
+            self.prescreen: bool = True
+            self.zero_copy: bool = False
+            self.stats = None
+            self.planner: str = 'greedy'
+            self.lookahead_window: int = DEFAULT_LOOKAHEAD_WINDOW
+            self.park: str = 'fixed'
+            self.park_window: int = DEFAULT_PARK_WINDOW
+            self.peephole: bool = False
+            self.check: bool = False
+            self.reorder: bool = False
+            self.preheat: bool = False
+            self.idle_temp: float = IDLE_TEMP
+            self.heater_warmup_time: float = HEATER_WARMUP_TIME
+        self.recorder = self.log.recorder  # flight recorder, None if disabled
+        self.park_plans: deque = deque()  # (x, y) per upcoming park, queued by plan_parks for --park dynamic
+        self.mapped_output = None  # set while processing a memory mapped input
+        self.reset()
+        if self.stats is not None:
+            self.stats.attach(self)
+
+    @property
+    def verbose(self) -> bool:
+        """Debug events are logged, to stdout without a log file"""
+        return self.log.debugging
+
+    @verbose.setter
+    def verbose(self, verbose: bool):
+        self.log.set_verbose(verbose)
+
+    def reset(self):
+        """Start over with parked toolheads and zero metrics, i.e. to reuse the DuelRunner for the next file"""
+        self.park_plans.clear()
+        self.prescreen_stale: bool = False   # set by a stray park, the prescreen saw the inactive toolhead elsewhere
+        if self.recorder is not None:
+            self.recorder.clear()   # lines of the file before
+        self.reset_toolheads()
         self.z_lifted: bool = False
         self.last_feed_rate:float = 0
         self.need_to_restore_feed_rate: bool = False
@@ -64,25 +222,42 @@ class DuelRunner:
         self.park_moves_t0 : int = 0
         self.park_moves_t1 : int = 0
 
-    def t0_park(self)-> Point:
-        """Park TO at LEFT_PARK_POS. Activates toolhead T0"""
+    def get_metrics(self) -> dict:
+        """Return the metrics of inserted sequences"""
+        return {'simple_shuffles_t0': self.simple_shuffles_t0, 'simple_shuffles_t1': self.simple_shuffles_t1,
+                'backup_shuffles_t0': self.backup_shuffles_t0, 'backup_shuffles_t1': self.backup_shuffles_t1,
+                'segmented_shuffles_t0': self.segmented_shuffles_t0, 'segmented_shuffles_t1': self.segmented_shuffles_t1,
+                'park_moves_t0': self.park_moves_t0, 'park_moves_t1': self.park_moves_t1}
+
+    def t0_park(self, pos: Point = LEFT_PARK_POS)-> Point:
+        """Park TO at pos, LEFT_PARK_POS by default. Activates toolhead T0"""
         self.park_moves_t0 += 1
         self.z_up()
-        for gcode in ["T0 ; %s t0_park"%PP_comment, "G0 X%s F%s" % (LEFT_PARK_POS.x, PARK_SPEED), "G0 Y%s F%s" % (LEFT_PARK_POS.y, PARK_SPEED)]:
+        for gcode in ["T0 ; %s t0_park"%PP_comment, "G0 X%s F%s" % (pos.x, PARK_SPEED), "G0 Y%s F%s" % (pos.y, PARK_SPEED)]:
             self.write_gcode_to_file(gcode)
         self.z_down()
         self.need_to_restore_feed_rate = True
-        return LEFT_PARK_POS
+        return pos
 
-    def t1_park(self) -> Point:
-        """Park T1 at RIGHT_PARK_POS. Activates toolhead T1"""
+    def t1_park(self, pos: Point = RIGHT_PARK_POS) -> Point:
+        """Park T1 at pos, RIGHT_PARK_POS by default. Activates toolhead T1"""
         self.park_moves_t1 += 1
         self.z_up()
-        for gcode in ["T1 ; %s t1_park"%PP_comment, "G0 X%s F%s" % (RIGHT_PARK_POS.x, PARK_SPEED), "G0 Y%s F%s" % (RIGHT_PARK_POS.y, PARK_SPEED)]:
+        for gcode in ["T1 ; %s t1_park"%PP_comment, "G0 X%s F%s" % (pos.x, PARK_SPEED), "G0 Y%s F%s" % (pos.y, PARK_SPEED)]:
             self.write_gcode_to_file(gcode)
         self.z_down()
         self.need_to_restore_feed_rate = True
-        return RIGHT_PARK_POS
+        return pos
+
+    def get_park_pos(self, pos: Point, default: Point):
+        """Park position for the outgoing toolhead at pos: the next one planned by plan_parks, otherwise default.
+        None if the toolhead stays at pos, i.e. parking is skipped."""
+        if not self.park_plans:
+            return default
+        x, y = self.park_plans.popleft()
+        if x == pos.x and y == pos.y:
+            return None
+        return Point(x, y)
 
     def t0_backoff(self, pos : Point) ->Point:
         """Backoff T0 to clear path for T1. NO activation of T0"""
@@ -184,10 +359,19 @@ class DuelRunner:
 
     def write_gcode_to_file(self, gcode_line: str):
         """Write given string to output file. with stripped double spaces"""
-        if self.output:
+        if self.mapped_output is not None:
+            self.mapped_output.write(' '.join(gcode_line.split()) + "\n")
+        elif self.output:
             # self.output.write(gcode_line + "\n")  #  may include double spaces
             self.output.write(' '.join(gcode_line.split()) + "\n")   # strips double spaces
 
+    def write_line(self, line):
+        """Write an unchanged input line. For a memory mapped input it is copied as part of a byte range instead."""
+        if self.mapped_output is not None and line.span is not None:
+            self.mapped_output.pass_line()
+        else:
+            self.write_gcode_to_file(line.gcode_str)
+
     @staticmethod
     def get_corresponding_x(toolhead_pos: Point, next_toolhead_pos: Point, target_y: float) -> float:
         """Get the corresponding x for a target y; useful for splitting moves for segmented avoidance."""
@@ -204,14 +388,46 @@ class DuelRunner:
         x = (target_y - b) / m
         return x
 
+    def get_split_positions(self, toolhead_pos: Point, next_toolhead_pos: Point, target_y: float, line: GcodeLine,
+                            inactive_toolhead_pos: Point) -> list:
+        """Positions where the move is split to shuffle the inactive toolhead, where it reaches target_y.
+        An arc is split where it last reaches target_y, the rest of it stays beyond. If the arc runs into the inactive
+        toolhead before, it crossed target_y twice: the inactive toolhead is shuffled at the first crossing and back
+        at the last one. Empty if the move can not be split, i.e. it does not cross target_y or runs into the inactive
+        toolhead before."""
+        if is_arc(line):
+            arc = get_arc(toolhead_pos, next_toolhead_pos, line)
+            if arc is not None:
+                fractions = arc.find_ys(target_y)
+                if not fractions:
+                    return []
+                if not check_for_overlap_arc(arc.get_part(0.0, fractions[-1]), inactive_toolhead_pos):
+                    return [arc.point_at(fractions[-1])]
+                if len(fractions) == 2 and not check_for_overlap_arc(arc.get_part(0.0, fractions[0]),
+                                                                     inactive_toolhead_pos):
+                    return [arc.point_at(fraction) for fraction in fractions]
+                return []
+        if not min(toolhead_pos.y, next_toolhead_pos.y) < target_y < max(toolhead_pos.y, next_toolhead_pos.y):
+            return []
+        mid_pos = Point(self.get_corresponding_x(toolhead_pos, next_toolhead_pos, target_y), target_y)
+        if check_for_overlap_sweep(toolhead_pos, mid_pos, inactive_toolhead_pos):
+            return []
+        return [mid_pos]
+
     def do_partial_org_move_start(self, start_pos : Point, mid_pos : Point, final_pos: Point, line: GcodeLine) -> Point:
         """Execute the first part of movement vom start_pos to final_pos. By moving from start_pos up to mid_pos. Extrusion and feed rate are extracted from original line"""
         cmd:str = line.command[0] + "%d" % line.command[1]
-        fraction_of_move:float = (mid_pos.y - start_pos.y) / (final_pos.y - start_pos.y)
-        if line.get_param('X') is not None:
-            cmd += " X%f" % mid_pos.x
-        if line.get_param('Y') is not None:
-            cmd += " Y%f"% mid_pos.y
+        arc = get_arc(start_pos, final_pos, line) if is_arc(line) else None
+        if arc is not None:
+            # first part of the arc around the same center, always with X, Y, I and J
+            fraction_of_move = arc.get_point_fraction(mid_pos)
+            cmd += " X%f Y%f I%f J%f" % ((mid_pos.x, mid_pos.y) + arc.get_center_offset(start_pos))
+        else:
+            fraction_of_move:float = (mid_pos.y - start_pos.y) / (final_pos.y - start_pos.y)
+            if line.get_param('X') is not None:
+                cmd += " X%f" % mid_pos.x
+            if line.get_param('Y') is not None:
+                cmd += " Y%f"% mid_pos.y
         if line.get_param('E') is not None:
             cmd += " E%f" %(line.get_param('E') * fraction_of_move)
         if line.get_param('F') is not None:
@@ -223,11 +439,18 @@ class DuelRunner:
     def do_partial_org_move_end(self, start_pos : Point, mid_pos : Point, final_pos: Point, line: GcodeLine) -> Point:
         """Execute the second part of movement from start_pos to final_pos by moving from mid_pos up to final_pos. Extrusion and feed rate are extracted from original line"""
         cmd:str = line.command[0] + "%d" % line.command[1]
-        fraction_of_move = (mid_pos.y - start_pos.y) / (final_pos.y - start_pos.y)
-        if line.get_param('X') is not None:
-            cmd += " X%f" % final_pos.x
-        if line.get_param('Y') is not None:
-            cmd += " Y%f"% final_pos.y
+        arc = get_arc(start_pos, final_pos, line) if is_arc(line) else None
+        if arc is not None:
+            fraction_of_move = arc.get_point_fraction(mid_pos)
+            cmd += " X%f Y%f I%f J%f" % ((final_pos.x, final_pos.y) + arc.get_center_offset(mid_pos))
+            if line.get_param('Z') is not None:
+                cmd += " Z%f" % line.get_param('Z')   # helical arcs climb in the second part
+        else:
+            fraction_of_move = (mid_pos.y - start_pos.y) / (final_pos.y - start_pos.y)
+            if line.get_param('X') is not None:
+                cmd += " X%f" % final_pos.x
+            if line.get_param('Y') is not None:
+                cmd += " Y%f"% final_pos.y
         if line.get_param('E') is not None:
             cmd += " E%f" %(line.get_param('E') * (1-fraction_of_move))
         if line.get_param('F') is not None:
@@ -236,304 +459,610 @@ class DuelRunner:
         self.write_gcode_to_file(cmd)
         return final_pos
 
+    def do_partial_arc_move(self, start_pos: Point, from_pos: Point, to_pos: Point, final_pos: Point,
+                            line: GcodeLine) -> Point:
+        """Execute the part of the arc from start_pos to final_pos between from_pos and to_pos, both on the arc.
+        Extrusion and feed rate are extracted from original line"""
+        arc = get_arc(start_pos, final_pos, line)
+        cmd: str = line.command[0] + "%d" % line.command[1]
+        cmd += " X%f Y%f I%f J%f" % ((to_pos.x, to_pos.y) + arc.get_center_offset(from_pos))
+        if line.get_param('E') is not None:
+            cmd += " E%f" % (line.get_param('E') * (arc.get_point_fraction(to_pos) - arc.get_point_fraction(from_pos)))
+        if line.get_param('F') is not None:
+            cmd += " F%f" % (line.get_param('F'))
+        self.write_gcode_to_file(cmd)
+        return to_pos
+
     def do_right_segmented_sequence(self, toolhead_pos : Point, target_y : float, next_toolhead_pos: Point, inactive_toolhead_pos: Point, line:GcodeLine):
         # If a simple backup-X move, followed by resume-X, were to cause a collision,
         # then execute enough of the move to clear the shuffled inactive extruder, back it away,
         # do the shuffle, then resume with the second part of the move.
 
-        x = self.get_corresponding_x(toolhead_pos, next_toolhead_pos, target_y)
-        mid_pos = Point(x, target_y)
+        mid_positions = self.get_split_positions(toolhead_pos, next_toolhead_pos, target_y, line, inactive_toolhead_pos)
+        if not mid_positions:
+            return self.do_right_backup_sequence(toolhead_pos, inactive_toolhead_pos, line)
         if self.verboseGcode: self.write_gcode_to_file("; Right segmented sequence start")
-        if self.verbose:print("  ! Right segmented sequence")
-        if self.verbose:print("  ! Doing first part of move sequence till mid_pos")
-        self.do_partial_org_move_start (toolhead_pos, mid_pos, next_toolhead_pos, line)
-        if self.verbose:print("  ! Backing up t0")
-        self.z_up()
-        self.t0_backoff(Point(0,0)) # no activation needed
-        if self.verbose:print("  ! Shuffling inactive t1")
-        right_toolhead_pos = self.t1_shuffle(inactive_toolhead_pos)
-        if self.verbose:print(" ! Restoring t0 to mid_pos after backup: %s" % mid_pos)
-        self.t0_go_to_w_a(mid_pos)
-        self.z_down()
-        if self.verbose:print(" ! Doing second part of move sequence from %s to %s" % (mid_pos,next_toolhead_pos ))
-        self.restore_feed_rate()
-        self.do_partial_org_move_end(toolhead_pos, mid_pos, next_toolhead_pos, line)
+        self.log.debug('right_segmented_sequence', start=toolhead_pos, mid=mid_positions, end=next_toolhead_pos,
+                       inactive=inactive_toolhead_pos)
+        self.do_partial_org_move_start (toolhead_pos, mid_positions[0], next_toolhead_pos, line)
+        right_toolhead_pos = inactive_toolhead_pos
+        for i, mid_pos in enumerate(mid_positions):
+            if i > 0:
+                # arc back across target_y, T1 is shuffled back
+                self.segmented_shuffles_t1 += 1
+                self.do_partial_arc_move(toolhead_pos, mid_positions[i - 1], mid_pos, next_toolhead_pos, line)
+            self.z_up()
+            self.t0_backoff(Point(0,0)) # no activation needed
+            right_toolhead_pos = self.t1_shuffle(right_toolhead_pos)
+            self.t0_go_to_w_a(mid_pos)
+            self.z_down()
+            self.restore_feed_rate()
+        self.do_partial_org_move_end(toolhead_pos, mid_positions[-1], next_toolhead_pos, line)
         if self.verboseGcode:self.write_gcode_to_file("; Right segmented sequence end")
         return right_toolhead_pos
 
     def do_right_backup_sequence(self, toolhead_pos, inactive_toolhead_pos, line):
         if self.verboseGcode :self.write_gcode_to_file("; Right Backup sequence start")
-        if self.verbose : print(" ! Right backup sequence")
-        if self.verbose : print(" ! Backup sequence: t0 Backing up")
+        self.log.debug('right_backup_sequence', position=toolhead_pos, inactive=inactive_toolhead_pos)
         self.z_up()
         self.t0_backoff(Point(0,0))  # no T0 needed
-        if self.verbose : print(" ! Shuffling inactive t1")
         right_toolhead_pos = self.t1_shuffle(inactive_toolhead_pos)
         # Restore original x for active instance
-        if self.verbose : print(" ! Resuming after backup: t0 restoring to %s" % toolhead_pos)
         self.t0_go_to_w_a(toolhead_pos)
         self.z_down()
         if self.verboseGcode: self.write_gcode_to_file("; Right backup sequence end")
-        if self.verbose : print(" ! Running original move.")
         self.restore_feed_rate()
-        self.write_gcode_to_file(line.gcode_str)
+        self.write_line(line)
         return right_toolhead_pos
 
     def do_left_segmented_sequence(self, toolhead_pos, target_y, next_toolhead_pos, inactive_toolhead_pos, line: GcodeLine):
         # If a simple backup-X move, followed by resume-X, were to cause a collision,
         # then execute enough of the move to clear the shuffled inactive extruder, back it away,
         # do the shuffle, then resume with the second part of the move.
-        x = self.get_corresponding_x(toolhead_pos, next_toolhead_pos, target_y)
-        mid_pos = Point(x, target_y)
+        mid_positions = self.get_split_positions(toolhead_pos, next_toolhead_pos, target_y, line, inactive_toolhead_pos)
+        if not mid_positions:
+            return self.do_left_backup_sequence(toolhead_pos, inactive_toolhead_pos, line)
         if self.verboseGcode : self.write_gcode_to_file("; Left segmented sequence start")
-        if self.verbose : print(" ! Left segmented sequence")
-        if self.verbose : print(" ! Doing first part of move sequence")
-        self.do_partial_org_move_start (toolhead_pos, mid_pos, next_toolhead_pos, line)
-        if self.verbose : print(" ! Backing up t1")
-        self.z_up()
-        self.t1_backoff(Point(0,0)) # no activation needed
-        if self.verbose : print(" ! Shuffling inactive 0")
-        left_toolhead_pos = self.t0_shuffle(inactive_toolhead_pos)
-        if self.verbose : print(" ! Restoring t1 to mid_pos after backup: %s" % mid_pos)
-        self.t1_go_to_w_a(mid_pos)
-        self.z_down()
-        self.restore_feed_rate()
-        if self.verbose : print(" ! Doing second part of move sequence from %s to %s"  % (mid_pos,next_toolhead_pos ))
-        self.do_partial_org_move_end(toolhead_pos, mid_pos, next_toolhead_pos, line)
+        self.log.debug('left_segmented_sequence', start=toolhead_pos, mid=mid_positions, end=next_toolhead_pos,
+                       inactive=inactive_toolhead_pos)
+        self.do_partial_org_move_start (toolhead_pos, mid_positions[0], next_toolhead_pos, line)
+        left_toolhead_pos = inactive_toolhead_pos
+        for i, mid_pos in enumerate(mid_positions):
+            if i > 0:
+                # arc back across target_y, T0 is shuffled back
+                self.segmented_shuffles_t0 += 1
+                self.do_partial_arc_move(toolhead_pos, mid_positions[i - 1], mid_pos, next_toolhead_pos, line)
+            self.z_up()
+            self.t1_backoff(Point(0,0)) # no activation needed
+            left_toolhead_pos = self.t0_shuffle(left_toolhead_pos)
+            self.t1_go_to_w_a(mid_pos)
+            self.z_down()
+            self.restore_feed_rate()
+        self.do_partial_org_move_end(toolhead_pos, mid_positions[-1], next_toolhead_pos, line)
         if self.verboseGcode: self.write_gcode_to_file("; Left segmented sequence end")
         return left_toolhead_pos
 
     def do_left_backup_sequence(self, toolhead_pos, inactive_toolhead_pos, line):
-        self.write_gcode_to_file("; Left backup sequence start")
-        print("  ! Left backup sequence ")
-        print("  ! Backup shuffle: t1 Backing up")
+        if self.verboseGcode: self.write_gcode_to_file("; Left backup sequence start")
+        self.log.debug('left_backup_sequence', position=toolhead_pos, inactive=inactive_toolhead_pos)
         self.z_up()
         self.t1_backoff(Point(0,0)) # no activation needed
-        print("  ! Shuffling inactive t0")
         left_toolhead_pos = self.t0_shuffle(inactive_toolhead_pos)
         # Restore original x for active instance
-        print("  ! Resuming after backup: t1 restoring to %s" % toolhead_pos)
         self.t1_go_to_w_a(toolhead_pos)
         self.z_down()
         self.restore_feed_rate()
-        self.write_gcode_to_file("; Left backup sequence end")
-        print("  ! Running original move.")
-
-        self.write_gcode_to_file(line.gcode_str)
+        if self.verboseGcode: self.write_gcode_to_file("; Left backup sequence end")
+        self.write_line(line)
         return left_toolhead_pos
 
     def do_right_simple_shuffle(self,toolhead_pos: Point, inactive_toolhead_pos: Point, line: GcodeLine) -> Point :
+        right_toolhead_pos = self.right_simple_shuffle(toolhead_pos, inactive_toolhead_pos)
+        self.write_line(line)
+        return right_toolhead_pos
+
+    def right_simple_shuffle(self,toolhead_pos: Point, inactive_toolhead_pos: Point) -> Point :
+        """Shuffle inactive T1 while T0 stays where it is, i.e. outside the end zone"""
         self.simple_shuffles_t1 += 1
         if self.verboseGcode: self.write_gcode_to_file("; Right simple shuffle start")
-        if self.verbose: print(" ! Right simple shuffle")
-        if self.verbose: print(" ! Shuffling inactive t1")
+        self.log.debug('right_simple_shuffle', position=toolhead_pos, inactive=inactive_toolhead_pos)
         self.z_up()
         right_toolhead_pos = self.t1_shuffle(inactive_toolhead_pos)
         self.z_down()
         self.t0_activate(toolhead_pos)
         self.restore_feed_rate()
         if self.verboseGcode: self.write_gcode_to_file("; Right simple shuffle end")
-        self.write_gcode_to_file(line.gcode_str)
         return right_toolhead_pos
 
     def do_left_simple_shuffle(self,toolhead_pos: Point, inactive_toolhead_pos: Point, line: GcodeLine) -> Point :
+        left_toolhead_pos = self.left_simple_shuffle(toolhead_pos, inactive_toolhead_pos)
+        self.write_line(line)
+        return left_toolhead_pos
+
+    def left_simple_shuffle(self,toolhead_pos: Point, inactive_toolhead_pos: Point) -> Point :
+        """Shuffle inactive T0 while T1 stays where it is, i.e. outside the end zone"""
         self.simple_shuffles_t0 += 1
         if self.verboseGcode: self.write_gcode_to_file("; Left simple shuffle start")
-        if self.verbose: print(" ! Left simple shuffle")
-        if self.verbose: print(" ! Shuffling inactive t0")
+        self.log.debug('left_simple_shuffle', position=toolhead_pos, inactive=inactive_toolhead_pos)
         left_toolhead_pos = self.t0_shuffle(inactive_toolhead_pos)
         self.t1_activate(toolhead_pos)
         self.restore_feed_rate()
         if self.verboseGcode: self.write_gcode_to_file("; Left simple shuffle end")
-        self.write_gcode_to_file(line.gcode_str)
         return left_toolhead_pos
 
+    def do_preemptive_shuffle(self):
+        """Simple shuffle of the inactive toolhead before it is in the way, as decided by the lookahead planner"""
+        if self.active_instance == 'left':
+            self.right_toolhead_pos = self.right_simple_shuffle(self.left_toolhead_pos, self.right_toolhead_pos)
+        else:
+            self.left_toolhead_pos = self.left_simple_shuffle(self.right_toolhead_pos, self.left_toolhead_pos)
+
+    @staticmethod
+    def is_in_column(instance: str, pos: Point) -> bool:
+        """True if the toolhead of instance at pos can be shuffled: at the X of its park position, at Y_LOW or Y_HIGH"""
+        return pos.x == PARK_POS[instance].x and (pos.y == Y_LOW or pos.y == Y_HIGH)
+
+    def park_stray_inactive(self, toolhead_pos: Point, next_toolhead_pos: Point, inactive_toolhead_pos: Point) -> Point:
+        """Park the inactive toolhead, left out of its column by --park dynamic, before the move from toolhead_pos to
+        next_toolhead_pos runs into it. Shuffles and backups only work in the column. Returns the park position,
+        the active toolhead is active again at toolhead_pos."""
+        if self.active_instance == 'left':
+            park_active, park_inactive, go_to_w_a, activate = self.t0_park, self.t1_park, self.t0_go_to_w_a, \
+                self.t0_activate
+        else:
+            park_active, park_inactive, go_to_w_a, activate = self.t1_park, self.t0_park, self.t1_go_to_w_a, \
+                self.t1_activate
+        inactive = OTHER[self.active_instance]
+        move = [(toolhead_pos.x, toolhead_pos.y, next_toolhead_pos.x, next_toolhead_pos.y)]
+        # a park the move does not run into first, then the nearer one
+        parks = sorted(get_column_parks(inactive),
+                       key=lambda park: (runs_into(move, park) == 0, abs(inactive_toolhead_pos.y - park.y)))
+        clear = [park for park in parks if runs_into(get_park_path(inactive_toolhead_pos, park), toolhead_pos) == 2]
+        if self.verboseGcode: self.write_gcode_to_file("; Stray park start")
+        self.log.debug('stray_park', tool=0 if inactive == 'left' else 1, position=inactive_toolhead_pos,
+                       park=(clear or parks)[0])
+        if clear:
+            park = park_inactive(clear[0])
+            activate(toolhead_pos)
+        else:
+            # the active toolhead is in the way of the park, it waits at its own park position
+            park_active(PARK_POS[self.active_instance])
+            park = park_inactive(parks[0])
+            go_to_w_a(toolhead_pos)
+        self.need_to_restore_feed_rate = True
+        self.restore_feed_rate()
+        if self.verboseGcode: self.write_gcode_to_file("; Stray park end")
+        self.prescreen_stale = True
+        return park
+
     def play_gcodes_file(self, gcode_file:str):
-        """Post processes the given file, overwriting the original input as requested by i.e. Orca slicer"""
-        with open(gcode_file, 'r') as f:
-            file_content = f.read()
-        f.close()
-        # now open the same file as output.
-        self.output = open(gcode_file, "w")
-        if self.output is None:
-            print("Could not create output file: %s" % gcode_file)
-            sys.exit(1)
-        self.play_gcodes(file_content)
+        """Post processes the given file, overwriting the original input as requested by i.e. Orca slicer.
+        The output is streamed into a temporary file which atomically replaces the input once finished."""
+        with open(gcode_file, 'r') as f_in, atomic_output(gcode_file) as f_out:
+            self.play_gcodes_stream_to(f_in, f_out)
 
     def play_gcodes_file_sep(self, f_input:str, f_output:str):
         """Post processes the given input file, overwriting the given output file. Useful for "chained" call testing and inspecting the inserted gcodes"""
-        with open(f_input, 'r') as f:
-            file_content = f.read()
-        f.close()
-        # now open output. which could be the same as input
-        self.output = open(f_output, "w")  # reset given output file
-        if self.output is None:
-            print("Could not create output file: %s" % f_output)
-            sys.exit(1)
-
-        self.play_gcodes(file_content)
+        # output could be the same as input, so never write into it directly
+        with open(f_input, 'r') as f_in, atomic_output(f_output) as f_out:
+            self.play_gcodes_stream_to(f_in, f_out)
+
+    def play_gcodes_stream_to(self, f_in, f_out):
+        """Post processes the open input file into the open output file, through the peephole optimiser and the
+        preheat writer if selected. With --reorder the islands of every layer are reordered before."""
+        if self.reorder:
+            from island_reorder import IslandReorder
+            reorder = IslandReorder()
+            f_in = reorder.reorder_lines(f_in)
+        self.output = PeepholeWriter(f_out) if self.peephole else f_out
+        if self.preheat:
+            self.output = PreheatWriter(self.output, self.idle_temp, self.heater_warmup_time)
+        self.play_gcodes_stream(f_in)
+        if self.preheat:
+            self.output.finish()
+            self.log.info('preheat', **self.output.counts)
+            self.output = self.output.output
+        if self.peephole:
+            self.output.finish()
+            self.log.info('peephole', **self.output.counts)
+        if self.reorder:
+            self.log.info('reorder', reordered_layers=reorder.reordered_layers, layers=reorder.layers)
+        self.output = None
+
+    def play_gcodes_file_mapped(self, f_input:str, f_output:str):
+        """Post processes the memory mapped input file into the given output file, which could be the same.
+        Lines passing through unchanged are copied as byte ranges, only inserted and rewritten lines are formatted."""
+        with open(f_input, 'rb') as f_in, atomic_output(f_output, "wb") as f_out:
+            if os.fstat(f_in.fileno()).st_size == 0:
+                return  # nothing to map
+            with mmap.mmap(f_in.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                self.mapped_output = MappedOutput(mapped, f_out)
+                try:
+                    self.play_gcode_lines(tokenize_mapped(mapped))
+                    self.mapped_output.close()
+                finally:
+                    self.mapped_output = None
+
+    def play_file(self, f_input:str, f_output:str):
+        """Post processes f_input into f_output, which may be the same file, in the selected mode"""
+        if self.stats is not None:
+            self.stats.start_run(f_input, self.get_metrics())
+        self.log.context = {'file': f_input}
+        self.log.info('start', output=f_output)
+        if self.zero_copy:
+            self.play_gcodes_file_mapped(f_input, f_output)
+        elif f_input == f_output:
+            self.play_gcodes_file(f_input)
+        else:
+            self.play_gcodes_file_sep(f_input, f_output)
+        self.log.info('finish', **self.get_metrics())
+        if self.stats is not None:
+            self.stats.finish_run(f_output, self.get_metrics())
+
+    def check_file(self, f_input: str):
+        """Replay f_input through the collision checks without writing anything, for --check.
+        Returns None if post processing would not change it, otherwise the UnsafeGcodeError of the first line it
+        would change. Only moves and tool changes are read from the memory mapped input."""
+        with open(f_input, 'rb') as f_in:
+            if os.fstat(f_in.fileno()).st_size == 0:
+                return None
+            with mmap.mmap(f_in.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return self.check_buffer(mapped)
+
+    def check_buffer(self, data):
+        """check_file of G-code given as bytes or memory mapped file"""
+        self.check = True
+        self.planner = 'greedy'   # tagged insertions are replayed as they are, nothing is planned
+        self.park = 'fixed'
+        if self.log.output is None or self.log.console:
+            # the unsafe line is reported by --check itself, the flight recorder is only dumped to a --log file
+            self.recorder = self.log.recorder = None
+        lines = tokenize_mapped(data)
+        try:
+            self.check_gcode_lines(lines)
+        except UnsafeGcodeError as e:
+            e.line_no = data[:e.line.span[0]].count(b'\n') + 1
+            return e
+        finally:
+            lines.close()   # releases the mapped buffer
+        return None
+
+    def check_gcode_lines(self, lines):
+        """Execute parsed G-code lines for --check. Moves ruled out by the prescreen only update the position."""
+        self.reset_toolheads()
+        if not (self.prescreen and prescreen_available()):
+            self.continue_gcode_lines(lines)
+            return
+        with self.recording():
+            for block in iter_blocks(lines, PRESCREEN_BLOCK_SIZE):
+                candidates = prescreen_moves(block, self.active_instance, self.left_toolhead_pos,
+                                             self.right_toolhead_pos)
+                for line, may_collide in zip(block, candidates):
+                    if may_collide or line.type != Commands.MOVE:
+                        self.play_gcode_line(line, may_collide)
+                        continue
+                    self.line_no += 1
+                    if self.recorder is not None:
+                        self.recorder.append((self.line_no, line, self.left_toolhead_pos, self.right_toolhead_pos,
+                                              self.active_instance))
+                    self.follow_move(line)
+
+    def follow_move(self, line):
+        """Update the position of the active toolhead and the feed rate for a move ruled out by the prescreen,
+        without writing anything"""
+        feed_rate = line.get_param('F')
+        if feed_rate is not None:
+            self.last_feed_rate = feed_rate
+        x = line.get_param('X')
+        y = line.get_param('Y')
+        if x is None and y is None:
+            return
+        pos = self.left_toolhead_pos if self.active_instance == 'left' else self.right_toolhead_pos
+        pos = Point(pos.x if x is None else float(x), pos.y if y is None else float(y))
+        if self.active_instance == 'left':
+            self.left_toolhead_pos = pos
+        else:
+            self.right_toolhead_pos = pos
 
     def play_gcodes(self, input_file_content):
         """Execute all G-codes from file content, inserting backups/shuffles/splits as needed."""
-        lines = GcodeParser(input_file_content, include_comments=True).lines
-
-        right_toolhead_pos = RIGHT_PARK_POS
-        left_toolhead_pos = LEFT_PARK_POS
-        active_instance: str = 'left'
-
-        for line in lines:
-            if self.verbose :print("pos T0: X:%.1f Y:%.1f" % (left_toolhead_pos.x, left_toolhead_pos.y))
-            if self.verbose :print("pos T1: X:%.1f Y:%.1f" % (right_toolhead_pos.x, right_toolhead_pos.y))
-            if self.verbose :print("input : " + line.gcode_str)
-
+        if self.parser == 'gcodeparser':
+            self.play_gcode_lines(GcodeParser(input_file_content, include_comments=True).lines)
+        else:
+            self.play_gcode_lines(tokenize_gcode(input_file_content))
 
-            if line.type == Commands.TOOLCHANGE:
-                # Decide on action     
-                if line.command == T0.command:
-                    if active_instance == 'left':
-                        if self.verbose :print( "Tool already active")
+    def play_gcodes_stream(self, text_lines):
+        """Execute G-codes read line by line from text_lines (i.e. an open file), writing output as it goes.
+        Memory usage does not depend on the size of the input."""
+        if self.parser == 'gcodeparser':
+            self.play_gcode_lines(parse_gcode_stream(text_lines))
+        else:
+            self.play_gcode_lines(tokenize_gcode_stream(text_lines))
+
+    def reset_toolheads(self):
+        """Both toolheads parked and T0 active, as at the start of every G-code file."""
+        self.right_toolhead_pos: Point = RIGHT_PARK_POS
+        self.left_toolhead_pos: Point = LEFT_PARK_POS
+        self.active_instance: str = 'left'
+        self.line_no: int = 0   # lines played, for the log
+
+    def get_state(self) -> dict:
+        """Return the state carried from line to line, everything needed to continue processing at the next line"""
+        return {'left_toolhead_pos': (self.left_toolhead_pos.x, self.left_toolhead_pos.y),
+                'right_toolhead_pos': (self.right_toolhead_pos.x, self.right_toolhead_pos.y),
+                'active_instance': self.active_instance,
+                'last_feed_rate': self.last_feed_rate,
+                'need_to_restore_feed_rate': self.need_to_restore_feed_rate,
+                'z_lifted': self.z_lifted}
+
+    def set_state(self, state: dict):
+        """Continue processing with a state returned by get_state"""
+        self.left_toolhead_pos = Point(*state['left_toolhead_pos'])
+        self.right_toolhead_pos = Point(*state['right_toolhead_pos'])
+        self.active_instance = state['active_instance']
+        self.last_feed_rate = state['last_feed_rate']
+        self.need_to_restore_feed_rate = state['need_to_restore_feed_rate']
+        self.z_lifted = state['z_lifted']
+
+    def play_gcode_lines(self, lines):
+        """Execute all parsed G-code lines, inserting backups/shuffles/splits as needed."""
+        self.reset_toolheads()
+        self.continue_gcode_lines(lines)
+
+    def continue_gcode_lines(self, lines):
+        """Execute parsed G-code lines starting from the current state, i.e. one set by set_state"""
+        if self.stats is not None:
+            lines = self.stats.timed_lines(lines)
+        park_plans = None
+        if self.park == 'dynamic':
+            self.park_plans.clear()
+            lines = plan_parks(lines, self, self.park_window)
+            park_plans = self.park_plans
+        planner = None
+        play_line = self.play_gcode_line
+        if self.planner == 'lookahead':
+            planner = LookaheadPlanner(self, self.lookahead_window)
+            play_line = planner.play_line
+        with self.recording():
+            if self.prescreen and prescreen_available():
+                # Rule out collisions for most moves in batches, only candidates get the full check
+                for block in iter_blocks(lines, PRESCREEN_BLOCK_SIZE):
+                    while block:
+                        # lines held back by the planner are not executed yet, the prescreen has to follow them
+                        pending = planner.pending_lines() if planner is not None else []
+                        candidates = prescreen_moves(pending + block, self.active_instance, self.left_toolhead_pos,
+                                                     self.right_toolhead_pos, park_plans)
+                        if self.prescreen_stale:
+                            if planner is not None:
+                                planner.set_candidates(candidates[:len(pending)])
+                            self.prescreen_stale = False
+                        played = 0
+                        for line, may_collide in zip(block, candidates[len(pending):]):
+                            play_line(line, may_collide)
+                            played += 1
+                            if self.prescreen_stale:
+                                break   # the rest of the block is screened again with the parked toolhead
+                        block = block[played:]
+            else:
+                for line in lines:
+                    play_line(line)
+            if planner is not None:
+                planner.drain()
+
+    @contextmanager
+    def recording(self):
+        """Dump the flight recorder if processing stops at an unsafe line or on an error"""
+        try:
+            yield
+        except UnsafeGcodeError as e:
+            self.log.dump('unsafe_line', reason=e.reason, line=e.line.gcode_str.strip(), position=e.toolhead_pos,
+                          next=e.next_toolhead_pos, inactive=e.inactive_toolhead_pos)
+            raise
+        except (Exception, SystemExit) as e:
+            self.log.dump('error_exit', error=repr(e), state=self.get_state())
+            raise
+
+    def play_gcode_line(self, line, may_collide: bool = True):
+        """Execute a single G-code line, inserting backups/shuffles/splits as needed.
+        may_collide=False skips the collision checks of a move, as the prescreen ruled out any collision."""
+        if self.mapped_output is not None:
+            self.mapped_output.begin_line(line)
+        if self.stats is not None:
+            self.stats.lines += 1
+        self.line_no += 1
+        if self.recorder is not None:
+            self.recorder.append((self.line_no, line, self.left_toolhead_pos, self.right_toolhead_pos,
+                                  self.active_instance))
+        if self.log.tracing:
+            self.log.trace('line', line_no=self.line_no, line=line.gcode_str.strip(), t0=self.left_toolhead_pos,
+                           t1=self.right_toolhead_pos, active=self.active_instance)
+
+        if line.type == Commands.TOOLCHANGE:
+            # Decide on action     
+            if line.command == T0.command:
+                if self.active_instance == 'left':
+                    self.log.debug('tool_already_active', tool=0)
+                else:
+                    if PP_comment in line.comment :
+                        # Just swap active instance without adding additional gcode
+                        self.log.debug('inserted_activation', tool=0)
+                        self.active_instance = 'left'
                     else:
-                        if PP_comment in line.comment :
-                            # Just swap active instance without adding additional gcode
-                            if self.verbose :print("Tool activation was inserted by PostProcessing.")
-                            active_instance = 'left'
-                        else:
-                            right_toolhead_pos = self.t1_park()
+                        if self.check:
+                            raise UnsafeGcodeError(line, "tool change without park", self.right_toolhead_pos,
+                                                   self.right_toolhead_pos, self.left_toolhead_pos)
+                        park_pos = self.get_park_pos(self.right_toolhead_pos, RIGHT_PARK_POS)
+                        if park_pos is not None:
+                            self.log.debug('park', tool=1, position=park_pos)
+                            self.right_toolhead_pos = self.t1_park(park_pos)
                             self.restore_feed_rate()
-                            active_instance = 'left'
-                elif line.command == T1.command:
-                    if active_instance == 'right':
-                        if self.verbose :print("Tool already active")
-                    else:
-                        if PP_comment in line.comment :
-                            # Just swap active instance without adding additional gcode
-                            if self.verbose :print("Tool activation was inserted by PostProcessing.")
-                            active_instance = 'right'
                         else:
-                            if self.verbose :print("Park T0")
-                            left_toolhead_pos = self.t0_park()
-                            self.restore_feed_rate()
-                            active_instance = 'right'
+                            # clear of the upcoming segment
+                            self.log.debug('park_skipped', tool=1, position=self.right_toolhead_pos)
+                        self.active_instance = 'left'
+            elif line.command == T1.command:
+                if self.active_instance == 'right':
+                    self.log.debug('tool_already_active', tool=1)
                 else:
-                    print("Unknown toolhead number")
-                    sys.exit(1)
+                    if PP_comment in line.comment :
+                        # Just swap active instance without adding additional gcode
+                        self.log.debug('inserted_activation', tool=1)
+                        self.active_instance = 'right'
+                    else:
+                        if self.check:
+                            raise UnsafeGcodeError(line, "tool change without park", self.left_toolhead_pos,
+                                                   self.left_toolhead_pos, self.right_toolhead_pos)
+                        park_pos = self.get_park_pos(self.left_toolhead_pos, LEFT_PARK_POS)
+                        if park_pos is not None:
+                            self.log.debug('park', tool=0, position=park_pos)
+                            self.left_toolhead_pos = self.t0_park(park_pos)
+                            self.restore_feed_rate()
+                        else:
+                            # clear of the upcoming segment
+                            self.log.debug('park_skipped', tool=0, position=self.left_toolhead_pos)
+                        self.active_instance = 'right'
+            else:
+                self.log.error('unknown_tool', line=line.gcode_str.strip())
+                print("Unknown toolhead number")
+                sys.exit(1)
 
-                # Add input toolchange to file, so the printer knows about it, too
-                if PP_comment in line.comment:
-                    self.write_gcode_to_file(line.gcode_str)
-                else:
-                    # Add comment, that this Toolchange has been post processed i.e. parking inserted
-                    self.write_gcode_to_file(line.gcode_str + " ; handled by %s " % PP_comment)
-
-            elif line.type == Commands.MOVE:
-
-                # Form target of move.
-                next_toolhead_pos : Point = Point(0,0)
-                inactive_toolhead_pos : Point = Point(0,0)
-                if active_instance == 'left':
-                    next_toolhead_pos = left_toolhead_pos.copy()
-                    toolhead_pos = left_toolhead_pos.copy()
-                    inactive_toolhead_pos = right_toolhead_pos.copy()
-                elif active_instance == 'right':
-                    next_toolhead_pos = right_toolhead_pos.copy()
-                    toolhead_pos = right_toolhead_pos.copy()
-                    inactive_toolhead_pos = left_toolhead_pos.copy()
-                else:
-                    print ("No active_instance set!")
+            # Add input toolchange to file, so the printer knows about it, too
+            if PP_comment in line.comment:
+                self.write_line(line)
+            else:
+                # Add comment, that this Toolchange has been post processed i.e. parking inserted
+                self.write_gcode_to_file(line.gcode_str + " ; handled by %s " % PP_comment)
+
+        elif line.type == Commands.MOVE:
+
+            # Form target of move. Positions are never changed in place, they are shared instead of copied.
+            if self.active_instance == 'left':
+                toolhead_pos = self.left_toolhead_pos
+                inactive_toolhead_pos = self.right_toolhead_pos
+            elif self.active_instance == 'right':
+                toolhead_pos = self.right_toolhead_pos
+                inactive_toolhead_pos = self.left_toolhead_pos
+            else:
+                self.log.error('no_active_instance', line=line.gcode_str.strip())
+                print ("No self.active_instance set!")
+                sys.exit(1)
+
+            # update new pos
+            x = line.get_param('X')
+            y = line.get_param('Y')
+            if x is None and y is None:
+                next_toolhead_pos: Point = toolhead_pos
+            else:
+                next_toolhead_pos: Point = Point(toolhead_pos.x if x is None else float(x),
+                                                 toolhead_pos.y if y is None else float(y))
+
+            # extract more parameter from the move like and F
+            if line.get_param('F') is not None:
+                if self.need_to_restore_feed_rate:
+                    self.log.error('feed_rate_not_restored', line=line.gcode_str.strip())
+                    print("Error: Feed rate was not restored before!")
                     sys.exit(1)
+                else:
+                    self.last_feed_rate =line.get_param('F')
+                    self.need_to_restore_feed_rate = False  # we just read one. no need to set it, if not changed
 
-                # update new pos
-                if line.get_param('X') is not None:
-                    next_toolhead_pos.x = float(line.get_param('X'))
-                if line.get_param('Y') is not None:
-                    next_toolhead_pos.y = float(line.get_param('Y'))
-
-                # extract more parameter from the move like and F
-                if line.get_param('F') is not None:
-                    if self.need_to_restore_feed_rate:
-                        print("Error: Feed rate was not restored before!")
-                        sys.exit(1)
-                    else:
-                        self.last_feed_rate =line.get_param('F')
-                        self.need_to_restore_feed_rate = False  # we just read one. no need to set it, if not changed
-
-                # Ensure move is safe.
+            # Ensure move is safe.
+            overlap_rect = False
+            overlap_swept = False
+            if may_collide or self.prescreen_stale:
                 # (1) Check against destination bounding box.
-                overlap_rect = check_for_overlap(inactive_toolhead_pos, next_toolhead_pos)
+                overlap_rect = check_for_overlap_margins(next_toolhead_pos, inactive_toolhead_pos)
                 if overlap_rect:
-                    if self.verbose :print("overlap end pos: inactive: %s ,next pos: %s" %(inactive_toolhead_pos, next_toolhead_pos))
+                    self.log.debug('overlap_end', inactive=inactive_toolhead_pos, next=next_toolhead_pos)
 
                 # (2) Check swept area against inactive bounding box
-                overlap_swept = check_for_overlap_sweep(toolhead_pos, next_toolhead_pos, inactive_toolhead_pos)
+                overlap_swept = check_for_overlap_move(toolhead_pos, next_toolhead_pos, inactive_toolhead_pos, line)
                 if overlap_swept:
-                    if self.verbose :print("overlap swept  inactive: %s ,current pos : %s, next pos: %s" %(inactive_toolhead_pos,toolhead_pos, next_toolhead_pos))
-
-                # Check if a single move will suffice.
-                if overlap_rect or overlap_swept:
-                    min_y_to_clear_inactive_toolhead = TOOLHEAD_Y_HEIGHT
-                    max_y_to_clear_inactive_toolhead = Y_HEIGHT - min_y_to_clear_inactive_toolhead
-
-                    if active_instance == 'left':
-                        # Target must be on the right.
-
-                        # Simple shuffle if we're not in the end zone yet.
-                        if left_toolhead_pos.x < T0_X_BACKOFF:
-                            right_toolhead_pos = self.do_right_simple_shuffle(left_toolhead_pos, right_toolhead_pos, line)
-
-                        # Segmented move: active is now in the front, and would conflict with a back-to-front shuffled inactive toolhead
-                        elif toolhead_pos.y <= min_y_to_clear_inactive_toolhead:
-                            self.segmented_shuffles_t1 += 1
-                            right_toolhead_pos = self.do_right_segmented_sequence(left_toolhead_pos, min_y_to_clear_inactive_toolhead,
-                                                                                  next_toolhead_pos, right_toolhead_pos, line)
-
-                        # Segmented move: active is in the rear
-                        elif toolhead_pos.y >= max_y_to_clear_inactive_toolhead:
-                            self.segmented_shuffles_t1 += 1
-                            right_toolhead_pos = self.do_right_segmented_sequence(left_toolhead_pos, max_y_to_clear_inactive_toolhead,
-                                                                                  next_toolhead_pos, right_toolhead_pos, line)
-
-                        # Backup move.
-                        else:
-                            self.backup_shuffles_t1 += 1
-                            right_toolhead_pos = self.do_right_backup_sequence(left_toolhead_pos, right_toolhead_pos, line)
-
-                    elif active_instance == 'right':
-                        # Target must be on the left.
+                    self.log.debug('overlap_swept', inactive=inactive_toolhead_pos, position=toolhead_pos,
+                                   next=next_toolhead_pos)
+
+            # Check if a single move will suffice.
+            if (overlap_rect or overlap_swept) and self.check:
+                raise UnsafeGcodeError(line, "move collides", toolhead_pos, next_toolhead_pos, inactive_toolhead_pos)
+            if (overlap_rect or overlap_swept) and not self.is_in_column(OTHER[self.active_instance],
+                                                                         inactive_toolhead_pos):
+                # no shuffle out of the column, the inactive toolhead parks first
+                inactive_toolhead_pos = self.park_stray_inactive(toolhead_pos, next_toolhead_pos, inactive_toolhead_pos)
+                if self.active_instance == 'left':
+                    self.right_toolhead_pos = inactive_toolhead_pos
+                else:
+                    self.left_toolhead_pos = inactive_toolhead_pos
+                overlap_rect = check_for_overlap_margins(next_toolhead_pos, inactive_toolhead_pos)
+                overlap_swept = check_for_overlap_move(toolhead_pos, next_toolhead_pos, inactive_toolhead_pos, line)
+            if overlap_rect or overlap_swept:
+                # beyond these the active toolhead is clear of the inactive one shuffled to Y_LOW or Y_HIGH
+                _, extent_y = get_sweep_extents()
+                min_y_to_clear_inactive_toolhead = Y_LOW + extent_y + SPLIT_CLEARANCE
+                max_y_to_clear_inactive_toolhead = Y_HIGH - extent_y - SPLIT_CLEARANCE
+
+                if self.active_instance == 'left':
+                    # Target must be on the right.
+
+                    # Simple shuffle if we're not in the end zone yet.
+                    if self.left_toolhead_pos.x < T0_X_BACKOFF:
+                        self.right_toolhead_pos = self.do_right_simple_shuffle(self.left_toolhead_pos, self.right_toolhead_pos, line)
+
+                    # Segmented move: active is now in the front, and would conflict with a back-to-front shuffled inactive toolhead
+                    elif toolhead_pos.y <= min_y_to_clear_inactive_toolhead:
+                        self.segmented_shuffles_t1 += 1
+                        self.right_toolhead_pos = self.do_right_segmented_sequence(self.left_toolhead_pos, min_y_to_clear_inactive_toolhead,
+                                                                              next_toolhead_pos, self.right_toolhead_pos, line)
+
+                    # Segmented move: active is in the rear
+                    elif toolhead_pos.y >= max_y_to_clear_inactive_toolhead:
+                        self.segmented_shuffles_t1 += 1
+                        self.right_toolhead_pos = self.do_right_segmented_sequence(self.left_toolhead_pos, max_y_to_clear_inactive_toolhead,
+                                                                              next_toolhead_pos, self.right_toolhead_pos, line)
+
+                    # Backup move.
+                    else:
+                        self.backup_shuffles_t1 += 1
+                        self.right_toolhead_pos = self.do_right_backup_sequence(self.left_toolhead_pos, self.right_toolhead_pos, line)
 
-                        # Simple shuffle if we're not in the end zone yet.
-                        if toolhead_pos.x > X_BACKOFF_LEN:
-                            left_toolhead_pos = self.do_left_simple_shuffle(right_toolhead_pos, left_toolhead_pos, line)
+                elif self.active_instance == 'right':
+                    # Target must be on the left.
 
+                    # Simple shuffle if we're not in the end zone yet.
+                    if toolhead_pos.x > X_BACKOFF_LEN:
+                        self.left_toolhead_pos = self.do_left_simple_shuffle(self.right_toolhead_pos, self.left_toolhead_pos, line)
 
-                        # Segmented move: active is in the front
-                        elif toolhead_pos.y <= min_y_to_clear_inactive_toolhead:
-                            self.segmented_shuffles_t0 += 1
-                            left_toolhead_pos = self.do_left_segmented_sequence(right_toolhead_pos, min_y_to_clear_inactive_toolhead,
-                                                                                  next_toolhead_pos, left_toolhead_pos, line)
 
-                        # Segmented move: active is in the rear
-                        elif toolhead_pos.y >= max_y_to_clear_inactive_toolhead:
-                            self.segmented_shuffles_t0 += 1
-                            left_toolhead_pos = self.do_left_segmented_sequence(right_toolhead_pos, max_y_to_clear_inactive_toolhead,
-                                                                                  next_toolhead_pos, left_toolhead_pos, line)
+                    # Segmented move: active is in the front
+                    elif toolhead_pos.y <= min_y_to_clear_inactive_toolhead:
+                        self.segmented_shuffles_t0 += 1
+                        self.left_toolhead_pos = self.do_left_segmented_sequence(self.right_toolhead_pos, min_y_to_clear_inactive_toolhead,
+                                                                              next_toolhead_pos, self.left_toolhead_pos, line)
 
-                        # Backup move.
-                        else:
-                            self.backup_shuffles_t0 += 1
-                            left_toolhead_pos = self.do_left_backup_sequence(right_toolhead_pos, left_toolhead_pos, line)
+                    # Segmented move: active is in the rear
+                    elif toolhead_pos.y >= max_y_to_clear_inactive_toolhead:
+                        self.segmented_shuffles_t0 += 1
+                        self.left_toolhead_pos = self.do_left_segmented_sequence(self.right_toolhead_pos, max_y_to_clear_inactive_toolhead,
+                                                                              next_toolhead_pos, self.left_toolhead_pos, line)
 
-                # If no overlap, just do the straight line.
-                else:
-                    self.write_gcode_to_file(line.gcode_str)
+                    # Backup move.
+                    else:
+                        self.backup_shuffles_t0 += 1
+                        self.left_toolhead_pos = self.do_left_backup_sequence(self.right_toolhead_pos, self.left_toolhead_pos, line)
 
-                # Update position of toolhead after execution
-                if active_instance == 'left':
-                    left_toolhead_pos = next_toolhead_pos
-                elif active_instance == 'right':
-                    right_toolhead_pos = next_toolhead_pos
+            # If no overlap, just do the straight line.
             else:
-                # Add all other lines, non toolchange / non move lines to file
-                self.write_gcode_to_file(line.gcode_str)
+                self.write_line(line)
+
+            # Update position of toolhead after execution
+            if self.active_instance == 'left':
+                self.left_toolhead_pos = next_toolhead_pos
+            elif self.active_instance == 'right':
+                self.right_toolhead_pos = next_toolhead_pos
+        else:
+            if self.stats is not None and line.type == Commands.COMMENT and line.comment.startswith("LAYER_CHANGE"):
+                self.stats.start_layer(self.get_metrics())
+            # Add all other lines, non toolchange / non move lines to file
+            self.write_line(line)
 
     def run(self):
         if args.gcodefile and not os.path.exists(args.gcodefile):
@@ -545,24 +1074,150 @@ class DuelRunner:
 
         print("Running:")
         if args.gcodefile:
-            self.play_gcodes_file(args.gcodefile)
+            self.play_file(args.gcodefile, args.gcodefile)
         elif args.input and args.output:
-            self.play_gcodes_file_sep(args.input, args.output)
+            self.play_file(args.input, args.output)
 
         if self.output:  # file open was successful, then close
             self.output.close()
+        if self.stats is not None:
+            self.stats.write_report(args.stats)
+            print("Statistics written to %s" % args.stats)
+        self.log.close()
         print("Finished.")
 
 
-if __name__ == "__main__":
+def get_arg_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(description="Post process a gcode file for use with a dual gantry printer.")
     parser.add_argument('--input', help="Input gcode filepath")
     parser.add_argument('--output', help="Output gcode filepath")
-    parser.add_argument('--verbose', help="Use more-verbose debug output", action='store_true')
+    parser.add_argument('--verbose', help="Log debug events, to stdout without --log", action='store_true')
     parser.add_argument('--verboseGcode', help="Use more comments in output gcode", action='store_true')
+    parser.add_argument('--parser', help="G-code parser: built-in fast tokenizer (default) or the full gcodeparser",
+                        choices=['fast', 'gcodeparser'], default='fast')
+    parser.add_argument('--collision-backend', help="Collision check implementation, shapely is the (slow) reference, "
+                                                    "quad the former approximation of the swept area of moves",
+                        choices=COLLISION_BACKENDS, default='analytic')
+    parser.add_argument('--sweep-margin-x', help="Safety margin in mm kept in X between the toolheads while moving, "
+                                                 "on top of the toolhead clearance", type=float, default=SWEEP_MARGIN_X)
+    parser.add_argument('--sweep-margin-y', help="Safety margin in mm kept in Y between the toolheads while moving",
+                        type=float, default=SWEEP_MARGIN_Y)
+    parser.add_argument('--no-prescreen', help="Check every move in detail, skip the batched NumPy prescreen",
+                        action='store_true')
+    parser.add_argument('--zero-copy', help="Memory map the input and copy unchanged lines as byte ranges. "
+                                            "Only inserted and rewritten lines get double spaces stripped",
+                        action='store_true')
+    parser.add_argument('--planner', help="Shuffle strategy: greedy decides per move (default), lookahead plans "
+                                          "over a window of upcoming moves and shuffles early where cheaper",
+                        choices=PLANNERS, default='greedy')
+    parser.add_argument('--lookahead-window', help="For --planner lookahead: number of lines planned ahead",
+                        type=int, default=DEFAULT_LOOKAHEAD_WINDOW)
+    parser.add_argument('--park', help="Park position of the outgoing toolhead on a tool change: fixed corner "
+                                       "(default) or dynamic, chosen from the upcoming tool segment. Parking is "
+                                       "skipped if the toolhead is clear of the whole segment",
+                        choices=PARK_MODES, default='fixed')
+    parser.add_argument('--park-window', help="For --park dynamic: number of lines read ahead at a tool change",
+                        type=int, default=DEFAULT_PARK_WINDOW)
+    parser.add_argument('--peephole', help="Remove and fuse redundant inserted lines in the output, i.e. Z lifts "
+                                           "cancelling each other or repeated tool activations. Not for --zero-copy",
+                        action='store_true')
+    parser.add_argument('--reorder', help="Reorder the islands of every layer by tool, saves tool changes and "
+                                          "shuffles of layers printed with several tool changes. Not for --zero-copy",
+                        action='store_true')
+    parser.add_argument('--preheat', help="Set the outgoing toolhead of a tool change to --idle-temp and heat it "
+                                          "back ahead of the next tool change to it. Not for --zero-copy",
+                        action='store_true')
+    parser.add_argument('--idle-temp', help="For --preheat: temperature of the inactive toolhead",
+                        type=float, default=IDLE_TEMP)
+    parser.add_argument('--heater-warmup-time', help="For --preheat: seconds to heat from --idle-temp to print "
+                                                     "temperature, the heat-up starts this long before the tool change",
+                        type=float, default=HEATER_WARMUP_TIME)
+    parser.add_argument('--check', help="Only check that the input is safe, i.e. post processing would not change "
+                                        "it. Nothing is written, exit code 1 at the first unsafe line",
+                        action='store_true')
+    parser.add_argument('--cache-dir', help="Cache processed layers in this directory, unchanged layers of a "
+                                            "re-sliced file are taken from the cache")
+    parser.add_argument('--cache-size', help="For --cache-dir: size limit in MB, least recently used layers are "
+                                             "evicted", type=int, default=DEFAULT_CACHE_SIZE)
+    parser.add_argument('--batch', help="Directory or glob of gcode files to post process in parallel. "
+                                        "Outputs are written next to the inputs with suffix _d0 or into --output-dir")
+    parser.add_argument('--output-dir', help="Output directory for --batch")
+    parser.add_argument('--parallel', help="Process a single file in parallel chunks split at layer changes",
+                        action='store_true')
+    parser.add_argument('--chunk-lines', help="For --parallel: split every N lines instead of at layer changes",
+                        type=int)
+    parser.add_argument('--jobs', help="Number of worker processes for --batch / --parallel, default: number of CPUs",
+                        type=int)
+    parser.add_argument('--summary', help="Write the combined summary of --batch as JSON to this file")
+    parser.add_argument('--stats', help="Write a JSON report of counters per layer, line and byte counts and "
+                                        "wall time per phase to this file")
+    parser.add_argument('--profile', help="Run with cProfile and print the top functions by own time",
+                        action='store_true')
+    parser.add_argument('--log', help="Append a log of JSON lines to this file")
+    parser.add_argument('--log-level', help="Least level logged, trace logs the toolhead positions at every line",
+                        choices=list(LEVELS), default=DEFAULT_LEVEL)
+    parser.add_argument('--flight-recorder', help="Toolhead positions of the last N lines, written to the log (or "
+                                                  "stderr) at an unsafe line or an error exit. 0 disables it",
+                        type=int, default=DEFAULT_RECORDER_SIZE)
     parser.add_argument('gcodefile', nargs='?')
+    return parser
+
+
+def run_check(passed_args) -> int:
+    """--check: exit code 0 if the input is safe, 1 if it is not, 2 if there is no input"""
+    f_input = passed_args.input or passed_args.gcodefile
+    if not f_input or not os.path.exists(f_input):
+        print("Invalid input file path: %s" % f_input)
+        return 2
+    error = DuelRunner(passed_args).check_file(f_input)
+    if error is not None:
+        print("Unsafe %s" % error)
+        return 1
+    print("Safe: %s" % f_input)
+    return 0
+
+
+def main(passed_args) -> int:
+    if passed_args.check:
+        return run_check(passed_args)
+    if passed_args.batch:
+        from batch import run_batch
+        return run_batch(passed_args)
+    if passed_args.peephole and passed_args.zero_copy:
+        print("--peephole does not work with --zero-copy")
+        return 1
+    if passed_args.reorder and passed_args.zero_copy:
+        print("--reorder does not work with --zero-copy")
+        return 1
+    if passed_args.preheat and passed_args.zero_copy:
+        print("--preheat does not work with --zero-copy")
+        return 1
+    if passed_args.cache_dir:
+        from chunk_cache import run_cached
+        return run_cached(passed_args)
+    if passed_args.parallel:
+        from layer_parallel import run_parallel
+        return run_parallel(passed_args)
+
+    dr = DuelRunner(passed_args)
+    dr.run()
+    return 0
+
+
+def main_profiled(passed_args) -> int:
+    """Run main with cProfile, print the functions taking the most time"""
+    import cProfile
+    import pstats
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(main, passed_args)
+    finally:
+        pstats.Stats(profiler, stream=sys.stdout).sort_stats('tottime').print_stats(PROFILE_TOP)
 
-    args = parser.parse_args()
 
-    dr = DuelRunner(args)
-    dr.run()
\ No newline at end of file
+if __name__ == "__main__":
+    args = get_arg_parser().parse_args()
+    set_collision_backend(args.collision_backend)
+    set_sweep_margins(args.sweep_margin_x, args.sweep_margin_y)
+
+    sys.exit(main_profiled(args) if args.profile else main(args))
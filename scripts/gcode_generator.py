@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+# Generator of synthetic, slicer like G-code for scaling tests of the post processing.
+# Objects are printed as rectangular perimeters and rectilinear infill, layer by layer with relative extrusion.
+# The layer count, perimeters, infill density, object placement on the bed and the T0/T1 alternation are tunable.
+#
+# Target moves are added at the end of every tool segment to run one specific avoidance path of the post
+# processing: a simple shuffle, a backup sequence or a segmented move. The active toolhead moves into the column
+# of the inactive one, from the side (simple), from the middle of the bed (backup) or along the column (segmented).
+# The generator follows the Y of the inactive toolhead, every target move shuffles it once.
+# Objects reaching into the column of the parked toolhead (X below ~42 for T1, above ~123 for T0) make the post
+# processing shuffle on its own, in addition to the target moves.
+#
+# Sample invocations:
+#   ./gcode_generator.py --layers 200 --output large.gcode
+#   ./gcode_generator.py --layers 50 --changes-per-layer 3 --target segmented --output segmented.gcode
+#   ./gcode_generator.py --object 10,10,60,140 --object 95,10,60,140 --infill-density 0.4 --output two.gcode
+
+import argparse
+import io
+import math
+import sys
+
+from toolhead import X_WIDTH, Y_HEIGHT, X_HIGH, Y_LOW, Y_HIGH, LEFT_PARK_POS, RIGHT_PARK_POS, \
+    TOOLHEAD_X_WIDTH, T0_X_BACKOFF
+
+TARGETS = ['none', 'simple', 'backup', 'segmented']
+
+EXTRUSION_WIDTH = 0.45
+FILAMENT_AREA = math.pi * (1.75 / 2) ** 2
+FIRST_LAYER_HEIGHT = 0.24
+THUMBNAIL_LINE = "; " + "iVBORw0KGgoAAAANSUhEUgAAAEAAAABACAYAAACqaXHeAAAABHNCSVQICAgIfAhkiAAAAAlwSFlzAAAOxAAA"
+
+PERIMETER_SPEED = 2400
+INFILL_SPEED = 7200
+TRAVEL_SPEED = 12000
+RETRACT_SPEED = 1800
+RETRACT_LEN = 1.25
+Z_HOP = 0.14
+
+# Target move positions for T0 active, mirrored in X for T1. SAFE_X is outside the end zone and never collides,
+# NEAR_X is in the end zone and collides with the inactive toolhead at the same Y.
+SAFE_X = T0_X_BACKOFF - 20.0
+NEAR_X = max(T0_X_BACKOFF, X_HIGH - TOOLHEAD_X_WIDTH) + 2.0
+FRONT_Y = Y_LOW + 19.0
+REAR_Y = Y_HIGH - 19.0
+MID_Y = Y_HEIGHT / 2
+
+
+def parse_object(text: str) -> tuple:
+    """Parse an object placement 'X,Y,W,H' (front left corner and size in mm)"""
+    values = tuple(float(v) for v in text.split(','))
+    if len(values) != 4:
+        raise argparse.ArgumentTypeError("object must be X,Y,W,H: %s" % text)
+    x, y, w, h = values
+    if w <= 0 or h <= 0 or x < 0 or y < 0 or x + w > X_WIDTH or y + h > Y_HEIGHT:
+        raise argparse.ArgumentTypeError("object %s is not on the %gx%g bed" % (text, X_WIDTH, Y_HEIGHT))
+    return values
+
+
+class GcodeGenerator:
+    def __init__(self, passed_args=None):
+        if passed_args is None:
+            passed_args = get_generator_arg_parser().parse_args([])
+        self.layers: int = passed_args.layers
+        self.layer_height: float = passed_args.layer_height
+        self.objects: list = passed_args.object or [((X_WIDTH - 80) / 2, (Y_HEIGHT - 80) / 2, 80.0, 80.0)]
+        self.perimeters: int = passed_args.perimeters
+        self.infill_density: float = passed_args.infill_density
+        self.max_segment: float = passed_args.max_segment
+        self.tool_period: int = passed_args.tool_period
+        self.changes_per_layer: int = passed_args.changes_per_layer
+        self.target: str = passed_args.target
+        self.target_count: int = passed_args.target_count
+        self.thumbnail_lines: int = passed_args.thumbnail_lines
+
+        self.out = []          # lines of the current layer
+        self.tool = 0
+        self.pos = (0.0, 0.0)
+        self.z = 0.0
+        self.inactive_y = RIGHT_PARK_POS.y
+
+    def emit(self, line: str):
+        self.out.append(line)
+
+    def travel(self, x: float, y: float):
+        if (x, y) == self.pos:
+            return
+        self.emit("G1 E-%.2f F%d" % (RETRACT_LEN, RETRACT_SPEED))
+        self.emit("G1 Z%.3f F%d" % (self.z + Z_HOP, TRAVEL_SPEED))
+        self.emit("G1 X%.3f Y%.3f" % (x, y))
+        self.emit("G1 Z%.3f" % self.z)
+        self.emit("G1 E%.2f F%d" % (RETRACT_LEN, RETRACT_SPEED))
+        self.pos = (x, y)
+
+    def extrude_to(self, x: float, y: float, height: float, split: bool = True):
+        """Extrude a straight line, split into segments of up to max_segment like a curved outline would be"""
+        x0, y0 = self.pos
+        length = math.hypot(x - x0, y - y0)
+        steps = 1
+        if split and self.max_segment > 0:
+            steps = max(1, int(math.ceil(length / self.max_segment)))
+        e = length / steps * EXTRUSION_WIDTH * height / FILAMENT_AREA
+        for i in range(1, steps + 1):
+            self.emit("G1 X%.3f Y%.3f E%.5f" % (x0 + (x - x0) * i / steps, y0 + (y - y0) * i / steps, e))
+        self.pos = (x, y)
+
+    def move_to(self, x: float, y: float, height: float):
+        """Target move as a single line, mirrored in X for T1"""
+        if self.tool == 1:
+            x = X_WIDTH - x
+        self.extrude_to(x, y, height, split=False)
+
+    def write_perimeters(self, obj: tuple, height: float):
+        x, y, w, h = obj
+        self.emit(";TYPE:External perimeter")
+        self.emit("G1 F%d" % PERIMETER_SPEED)
+        for i in range(self.perimeters):
+            inset = EXTRUSION_WIDTH * (i + 0.5)
+            if 2 * inset >= min(w, h):
+                break
+            x0, y0, x1, y1 = x + inset, y + inset, x + w - inset, y + h - inset
+            self.travel(x0, y1)
+            for corner in ((x0, y0), (x1, y0), (x1, y1), (x0, y1)):
+                self.extrude_to(corner[0], corner[1], height)
+            if i == 0:
+                self.emit(";TYPE:Perimeter")
+
+    def write_infill(self, obj: tuple, height: float, layer: int):
+        if self.infill_density <= 0:
+            return
+        x, y, w, h = obj
+        inset = EXTRUSION_WIDTH * (self.perimeters + 0.5)
+        x0, y0, x1, y1 = x + inset, y + inset, x + w - inset, y + h - inset
+        if x1 <= x0 or y1 <= y0:
+            return
+        spacing = EXTRUSION_WIDTH / min(self.infill_density, 1.0)
+        self.emit(";TYPE:Internal infill")
+        self.emit("G1 F%d" % INFILL_SPEED)
+        horizontal = layer % 2 == 0   # alternate the infill direction by layer
+        count = int((y1 - y0 if horizontal else x1 - x0) / spacing) + 1
+        for i in range(count):
+            if horizontal:
+                line_y = y0 + i * spacing
+                start, end = ((x0, line_y), (x1, line_y)) if i % 2 == 0 else ((x1, line_y), (x0, line_y))
+            else:
+                line_x = x0 + i * spacing
+                start, end = ((line_x, y0), (line_x, y1)) if i % 2 == 0 else ((line_x, y1), (line_x, y0))
+            if i == 0:
+                self.travel(*start)
+            else:
+                self.extrude_to(start[0], start[1], height)   # connecting line of the zig zag
+            self.extrude_to(end[0], end[1], height)
+
+    def write_target_moves(self, height: float):
+        """Moves running the selected avoidance path once each, see the header"""
+        for _ in range(self.target_count):
+            toward_y = FRONT_Y if self.inactive_y == Y_LOW else REAR_Y
+            away_y = REAR_Y if self.inactive_y == Y_LOW else FRONT_Y
+            self.emit(";TYPE:Target %s" % self.target)
+            if self.target == 'simple':
+                self.travel(X_WIDTH - SAFE_X if self.tool else SAFE_X, MID_Y)
+                self.move_to(NEAR_X, toward_y, height)
+                self.move_to(SAFE_X, MID_Y, height)
+            elif self.target == 'backup':
+                self.travel(X_WIDTH - SAFE_X if self.tool else SAFE_X, MID_Y)
+                self.move_to(NEAR_X, MID_Y, height)
+                self.move_to(NEAR_X, toward_y, height)
+                self.move_to(NEAR_X, MID_Y, height)
+                self.move_to(SAFE_X, MID_Y, height)
+            elif self.target == 'segmented':
+                self.travel(X_WIDTH - SAFE_X if self.tool else SAFE_X, MID_Y)
+                self.move_to(SAFE_X, away_y, height)
+                self.move_to(NEAR_X, away_y, height)
+                self.move_to(NEAR_X, toward_y, height)
+                self.move_to(SAFE_X, toward_y, height)
+                self.move_to(SAFE_X, MID_Y, height)
+            self.inactive_y = Y_HIGH if self.inactive_y == Y_LOW else Y_LOW
+
+    def write_toolchange(self, tool: int):
+        self.emit("G1 E-10 F%d" % RETRACT_SPEED)
+        self.emit("; Filament-specific end gcode")
+        self.emit("T%d" % tool)
+        self.emit("G92 E0")
+        self.emit("M104 S245 T%d ; set temperature" % tool)
+        self.tool = tool
+        # the outgoing toolhead is parked by the post processing
+        self.inactive_y = RIGHT_PARK_POS.y if tool == 0 else LEFT_PARK_POS.y
+        self.pos = (None, None)
+
+    def get_layer_tools(self, layer: int) -> list:
+        """Tool of each tool segment of a layer"""
+        if self.tool_period <= 0:
+            first = 0
+        else:
+            first = (layer // self.tool_period) % 2
+        return [(first + i) % 2 for i in range(self.changes_per_layer + 1)]
+
+    def write_layer(self, layer: int):
+        height = FIRST_LAYER_HEIGHT if layer == 0 else self.layer_height
+        self.z = FIRST_LAYER_HEIGHT + layer * self.layer_height
+        self.emit(";LAYER_CHANGE")
+        self.emit(";Z:%.3f" % self.z)
+        self.emit(";HEIGHT:%.3f" % height)
+        self.emit("G1 Z%.3f F%d" % (self.z, TRAVEL_SPEED))
+        tools = self.get_layer_tools(layer)
+        # objects are spread over the tool segments of the layer, every segment prints at least one
+        for index, tool in enumerate(tools):
+            if tool != self.tool:
+                self.write_toolchange(tool)
+            segment_objects = self.objects[index::len(tools)] or self.objects[index % len(self.objects):][:1]
+            for obj in segment_objects:
+                self.write_perimeters(obj, height)
+                self.write_infill(obj, height, layer)
+            if self.target != 'none':
+                self.write_target_moves(height)
+            self.emit(";WIPE_START")
+            self.emit("G1 E-%.2f F%d" % (RETRACT_LEN, RETRACT_SPEED))
+            self.emit(";WIPE_END")
+
+    def write_start(self, f):
+        f.write("; generated by gcode_generator.py for DuelingZero post processing tests\n\n")
+        f.write("; thumbnail begin 64x64 %d\n" % (self.thumbnail_lines * len(THUMBNAIL_LINE)))
+        f.write((THUMBNAIL_LINE + "\n") * self.thumbnail_lines)
+        f.write("; thumbnail end\n\n")
+        f.write("; external perimeters extrusion width = %.2fmm\n\n" % EXTRUSION_WIDTH)
+        f.write("M140 S110 ; set bed temperature\n")
+        f.write("M104 S245 T0 ; set temperature\n")
+        f.write(";TYPE:Custom\n")
+        f.write("print_start EXT_TEMP=245 BED_TEMP=110\n")
+        f.write("G21 ; set units to millimeters\n")
+        f.write("G90 ; use absolute coordinates\n")
+        f.write("M83 ; use relative distances for extrusion\n")
+        f.write("T0\n")
+        f.write("G92 E0\n")
+        f.write("M109 S245 T0 ; set temperature and wait for it to be reached\n")
+
+    def write_end(self, f):
+        f.write("M107\n")
+        f.write("print_end ; end gcode\n")
+
+    def write(self, f):
+        """Write the G-code into the open file f"""
+        self.tool = 0
+        self.inactive_y = RIGHT_PARK_POS.y
+        self.pos = (None, None)
+        self.write_start(f)
+        for layer in range(self.layers):
+            self.out = []
+            self.write_layer(layer)
+            self.out.append("")
+            f.write("\n".join(self.out))
+        self.write_end(f)
+
+    def write_file(self, path: str):
+        with open(path, 'w') as f:
+            self.write(f)
+
+
+def get_generator_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Generate synthetic G-code for scaling tests of the post processing.")
+    parser.add_argument('--output', help="Output file, default: stdout")
+    parser.add_argument('--layers', help="Number of layers", type=int, default=200)
+    parser.add_argument('--layer-height', help="Layer height in mm", type=float, default=0.2)
+    parser.add_argument('--object', help="Object placement X,Y,W,H in mm, can be repeated, "
+                                         "default: an 80x80 object in the center", type=parse_object, action='append')
+    parser.add_argument('--perimeters', help="Perimeters per object", type=int, default=3)
+    parser.add_argument('--infill-density', help="Infill density 0..1", type=float, default=0.2)
+    parser.add_argument('--max-segment', help="Split perimeter lines into segments of up to this length in mm, "
+                                              "0 for none", type=float, default=2.0)
+    parser.add_argument('--tool-period', help="Switch between T0 and T1 every N layers, 0 for T0 only",
+                        type=int, default=1)
+    parser.add_argument('--changes-per-layer', help="Additional tool changes within every layer",
+                        type=int, default=0)
+    parser.add_argument('--target', help="Avoidance path run by target moves in every tool segment",
+                        choices=TARGETS, default='none')
+    parser.add_argument('--target-count', help="Target moves per tool segment", type=int, default=1)
+    parser.add_argument('--thumbnail-lines', help="Lines of the thumbnail comment block", type=int, default=200)
+    return parser
+
+
+def generate_gcode(generator_args: list) -> str:
+    """G-code generated for the command line arguments generator_args"""
+    gcode = io.StringIO()
+    GcodeGenerator(get_generator_arg_parser().parse_args(generator_args)).write(gcode)
+    return gcode.getvalue()
+
+
+if __name__ == "__main__":
+    args = get_generator_arg_parser().parse_args()
+    generator = GcodeGenerator(args)
+    if args.output:
+        generator.write_file(args.output)
+    else:
+        generator.write(sys.stdout)
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# Minimal G-code tokenizer for the post processing hot path.
+# Only tool changes (Tn) and moves (G0..G3) are split into command, params and comment, as these are the only
+# lines the post processing needs to look into. Every other line, i.e. the large thumbnail comment blocks,
+# is recognised by a cheap prefix check and passed through untouched.
+# Lines are compatible to gcodeparser.GcodeLine as far as used by the post processing
+# (command, params, comment, type, get_param, gcode_str).
+
+import re
+
+from gcodeparser.commands import Commands
+
+PP_comment: str = "PPfD0"   # Post-processed for Dueling Zero, tags every line inserted by the post processing
+_PARAM_RE = re.compile(r'([A-Za-z])([-+]?[\d.]*(?:e[-+]?\d+)?)')
+# Lines of a mapped input which may be a move or tool change, or are a layer change (for statistics).
+# All others are never looked at.
+_CANDIDATE_RE = re.compile(rb'^[ \t]*(?:[GgTt][0-9]|;LAYER_CHANGE)[^\n]*\n?', re.M)
+
+
+def _param_value(value: str):
+    """Convert a parameter value the same way gcodeparser does: int, float or True for flags.
+    A lower case e after the digits is an exponent as in '1e-3', not the E parameter."""
+    if value == '':
+        return True
+    if '.' in value or 'e' in value:
+        return float(value)
+    return int(value)
+
+
+def _split_params(code: str) -> dict:
+    """Split the parameters of a command, i.e. 'X10 Y2.5 E.4' into {'X': 10, 'Y': 2.5, 'E': 0.4}"""
+    params = {}
+    try:
+        for word in code.split():
+            params[word[0].upper()] = _param_value(word[1:])
+    except ValueError:
+        # unusual formatting like 'X10Y5', fall back to a regex. 'X10E5' is X10 and E5, 'X1e-3Y5' is X0.001 and Y5.
+        params = {}
+        for letter, value in _PARAM_RE.findall(code):
+            params[letter.upper()] = _param_value(value)
+    return params
+
+
+def _command_number(text: str):
+    """Return the number of a command like 'G01' / 'T1' if text is one, otherwise None"""
+    end = 1
+    while end < len(text) and text[end].isdigit():
+        end += 1
+    if end == 1 or (end < len(text) and text[end] not in ' \t;' and not text[end].isalpha()):
+        return None, end
+    return int(text[1:end]), end
+
+
+class FastGcodeLine:
+    """One line of G-code. Params are only parsed for moves and tool changes, gcode_str is the line as read.
+    span is the (start, end) byte range of the line including its line ending, if read from a mapped input."""
+    __slots__ = ('command', 'params', 'type', 'gcode_str', '_comment', 'span')
+
+    def __init__(self, command, params, line_type, gcode_str, comment=None):
+        self.command = command
+        self.params = params
+        self.type = line_type
+        self.gcode_str = gcode_str
+        self._comment = comment
+        self.span = None
+
+    @property
+    def comment(self) -> str:
+        if self._comment is None:
+            # only computed on demand for pass through lines
+            _, _, comment = self.gcode_str.partition(';')
+            self._comment = comment.strip()
+        return self._comment
+
+    def get_param(self, param: str, return_type=None, default=None):
+        """Returns the value of the param if it exists, otherwise the default value."""
+        value = self.params.get(param)
+        if value is None:
+            return default
+        if return_type is not None:
+            return return_type(value)
+        return value
+
+    def __repr__(self):
+        return 'FastGcodeLine (%s)' % self.gcode_str
+
+
+def tokenize_line(raw: str) -> FastGcodeLine:
+    """Tokenize a single line of G-code, given without line ending"""
+    first = raw[:1]
+    if first == ' ' or first == '\t':
+        text = raw.lstrip()
+        first = text[:1]
+    else:
+        text = raw
+    if first == 'G' or first == 'g' or first == 'T' or first == 't':
+        number, end = _command_number(text)
+        if number is not None:
+            letter = first.upper()
+            if letter == 'T':
+                line_type = Commands.TOOLCHANGE
+            elif number <= 3:
+                line_type = Commands.MOVE
+            else:
+                line_type = None
+            if line_type is None:
+                return FastGcodeLine((letter, number), {}, Commands.OTHER, raw)
+            code, _, comment = text[end:].partition(';')
+            params = _split_params(code) if line_type == Commands.MOVE else {}
+            return FastGcodeLine((letter, number), params, line_type, raw, comment.strip())
+        return FastGcodeLine(None, {}, Commands.OTHER, raw)
+    if first == ';':
+        return FastGcodeLine((';', None), {}, Commands.COMMENT, raw)
+    return FastGcodeLine(None, {}, Commands.OTHER, raw)
+
+
+def tokenize_gcode_stream(text_lines):
+    """Generator tokenizing G-code line by line, i.e. from an open file."""
+    for text_line in text_lines:
+        yield tokenize_line(text_line.rstrip('\r\n'))
+
+
+def tokenize_gcode(gcode: str):
+    """Tokenize all lines of the given G-code content"""
+    return [tokenize_line(text_line) for text_line in gcode.splitlines()]
+
+
+def tokenize_mapped(mapped):
+    """Generator tokenizing the lines of a memory mapped input which may be moves, tool changes or layer changes.
+    All other lines are skipped without being decoded, they are found between the spans of the returned lines."""
+    for match in _CANDIDATE_RE.finditer(mapped):
+        token = tokenize_line(match.group().decode('utf-8', 'surrogateescape').rstrip('\r\n'))
+        token.span = match.span()
+        yield token
@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+# Per layer island reordering, an optional stage in front of the post processing (--reorder).
+# Slicers may alternate T0 and T1 several times within a layer, every alternation costs a park of the outgoing
+# toolhead and often shuffles after it. Here an island is the part of a layer printed by one tool between two tool
+# changes. Its extrusion runs stay together, so they keep the retracts and G92 E of their tool change around them.
+# The islands in between the first and the last one of a layer are grouped by tool: the ones of the tool active at
+# the start of the layer first, the ones of the tool of the last island at the end. Tool changes to the tool already
+# active are commented out. Within a group, islands which do not run into the parked toolhead at its park Y come
+# first, then the ones with the fewest moves running into it at the other Y, where a shuffle leaves it.
+#
+# The first and the last island keep their place, so the tool, Z, E and feed rate the next layer starts with do not
+# change. Before a moved island the feed rate, E (absolute extrusion), Z and, if it starts extruding right away, the
+# XY of its toolhead are restored to where they were in the original order. Every reordered layer is checked by
+# replaying both versions: the same extrusion moves per tool and the same state at the end, otherwise the layer is
+# kept as it is. Layers are kept as well with relative XY moves, mode changes, temperature changes, a wipe or prime
+# tower, tools other than T0 / T1, or lines inserted by the post processing.
+#
+# Sample invocations:
+#   ./island_reorder.py gcode/square_2_layer_alternating_4_layers_total.gcode
+#       reports tool changes, parks and shuffles of the post processing before and after reordering
+#   ./island_reorder.py --output sample_reordered.gcode sample.gcode
+#   ./duelingzero_postprocessing.py --reorder --input sample.gcode --output sample_d0_ready.gcode
+
+import argparse
+import io
+import sys
+from contextlib import redirect_stdout
+
+from duelingzero_postprocessing import DuelRunner, get_arg_parser, atomic_output
+from gcode_tokenizer import PP_comment
+from peephole import split_line, is_tool
+from point import Point
+from toolhead import check_for_overlap_sweep, LEFT_PARK_POS, RIGHT_PARK_POS, Y_LOW, Y_HIGH
+from two_object import split_layers
+
+REORDER_COMMENT = "restored by island reordering"
+MOVE_CODES = ('G0', 'G1', 'G2', 'G3')
+MODE_CODES = ('G91', 'M82', 'M83')
+TEMPERATURE_CODES = ('M104', 'M109')
+TOWER_TYPES = (';TYPE:Wipe tower', ';TYPE:Prime tower')
+PARK_POS = {0: LEFT_PARK_POS, 1: RIGHT_PARK_POS}
+E_EPSILON = 1e-6
+REPORT_FILES = ["gcode/square_2_layer_alternating_4_layers_total.gcode"]
+
+
+class MachineState:
+    __slots__ = ('positions', 'tool', 'z', 'e', 'f', 'relative_e', 'temperatures')
+
+    def __init__(self):
+        self.positions = {tool: (pos.x, pos.y) for tool, pos in PARK_POS.items()}
+        self.tool: int = 0
+        self.z = None
+        self.e: str = '0'   # as written by the input, restored exactly
+        self.f = None
+        self.relative_e: bool = False
+        self.temperatures = {}   # tool -> S of its last M104 / M109
+
+    def copy(self):
+        state = MachineState()
+        state.positions = dict(self.positions)
+        state.tool, state.z, state.e, state.f, state.relative_e = self.tool, self.z, self.e, self.f, self.relative_e
+        state.temperatures = dict(self.temperatures)
+        return state
+
+    def get_key(self) -> tuple:
+        """What the lines after a layer depend on"""
+        return self.positions[self.tool], self.tool, self.z, float(self.e), self.f, self.relative_e
+
+    def track(self, code: str, params: dict):
+        """Follow a line given by split_line. Returns the extrusion (tool, z, de, x0, y0, x1, y1) of a move with E,
+        None for all other lines."""
+        if is_tool(code):
+            tool = int(code[1:])
+            if tool != self.tool:
+                # the post processing parks the outgoing toolhead, the incoming one starts from its park position
+                self.positions[self.tool] = (PARK_POS[self.tool].x, PARK_POS[self.tool].y)
+                self.tool = tool
+        elif code == 'M82':
+            self.relative_e = False
+        elif code == 'M83':
+            self.relative_e = True
+        elif code in TEMPERATURE_CODES and 'T' in params:
+            self.temperatures[params['T']] = params.get('S')
+        elif code == 'G92' and 'E' in params:
+            self.e = params['E']
+        elif code in MOVE_CODES:
+            x0, y0 = self.positions[self.tool]
+            x1 = float(params['X']) if 'X' in params else x0
+            y1 = float(params['Y']) if 'Y' in params else y0
+            self.positions[self.tool] = (x1, y1)
+            if 'Z' in params:
+                self.z = float(params['Z'])
+            if 'F' in params:
+                self.f = params['F']
+            if 'E' in params:
+                if self.relative_e:
+                    de = float(params['E'])
+                else:
+                    de = float(params['E']) - float(self.e)
+                    self.e = params['E']
+                if 'X' not in params and 'Y' not in params:
+                    return self.tool, self.z, round(de, 5)   # retract or unretract, wherever the toolhead is
+                return self.tool, self.z, round(de, 5), round(x0, 3), round(y0, 3), round(x1, 3), round(y1, 3)
+        return None
+
+
+class Island:
+    __slots__ = ('tool', 'lines', 'start')
+
+    def __init__(self, tool: int, lines: list, start: MachineState):
+        self.tool = tool
+        self.lines = lines
+        self.start = start   # state before the first line in the original order
+
+    def starts_extruding(self) -> bool:
+        """True if the first XY move of the island extrudes, it relies on the position it starts at"""
+        for line in self.lines:
+            code, params, _ = split_line(line)
+            if code in MOVE_CODES and ('X' in params or 'Y' in params):
+                return 'E' in params
+        return False
+
+    def count_conflicts(self, inactive_y: float) -> int:
+        """Moves of the island running into the parked inactive toolhead at inactive_y"""
+        inactive = Point(PARK_POS[1 - self.tool].x, inactive_y)
+        state = self.start.copy()
+        count = 0
+        for line in self.lines:
+            code, params, _ = split_line(line)
+            start = state.positions[state.tool]
+            state.track(code, params)
+            if code in MOVE_CODES and check_for_overlap_sweep(Point(*start), Point(*state.positions[state.tool]),
+                                                              inactive):
+                count += 1
+        return count
+
+
+def is_reorderable(lines: list, state: MachineState) -> bool:
+    """False if moving the islands of the layer may change more than the order of its moves. Temperature commands
+    are fine if they set the temperature a tool already has."""
+    for line in lines:
+        if PP_comment in line or line.startswith(TOWER_TYPES):
+            return False
+        code, params, _ = split_line(line)
+        if code in MODE_CODES or (is_tool(code) and code not in ('T0', 'T1')):
+            return False
+        if code in TEMPERATURE_CODES and ('T' not in params or state.temperatures.get(params['T']) != params.get('S')):
+            return False
+    return True
+
+
+def split_islands(lines: list, state: MachineState) -> list:
+    """Islands of a layer, a new one at every tool change. state is followed through the lines."""
+    islands = [Island(state.tool, [], state.copy())]
+    for line in lines:
+        code, params, _ = split_line(line)
+        if is_tool(code):
+            islands.append(Island(int(code[1:]), [], state.copy()))
+        islands[-1].lines.append(line)
+        state.track(code, params)
+    return islands
+
+
+def order_group(islands: list) -> list:
+    """Islands of one tool: first the ones clear of the parked toolhead at its park Y, then by the moves running into
+    it at the other Y"""
+    if not islands:
+        return []
+    park_y = PARK_POS[1 - islands[0].tool].y
+    other_y = Y_LOW if park_y == Y_HIGH else Y_HIGH
+    keys = {id(island): (island.count_conflicts(park_y) > 0, island.count_conflicts(other_y)) for island in islands}
+    return sorted(islands, key=lambda island: keys[id(island)])
+
+
+def order_islands(islands: list) -> list:
+    """Islands in the order printed: the first and the last one in place, in between grouped by tool"""
+    first, middle, last = islands[0], islands[1:-1], islands[-1]
+    tools = [first.tool] + [tool for tool in (0, 1) if tool not in (first.tool, last.tool)] + [last.tool]
+    ordered = [first]
+    for tool in dict.fromkeys(tools):
+        ordered += order_group([island for island in middle if island.tool == tool])
+    return ordered + [last]
+
+
+def get_restore_lines(island: Island, state: MachineState) -> list:
+    """Lines bringing state to the start state of island, after its tool change"""
+    comment = " ; " + REORDER_COMMENT
+    start = island.start
+    lines = []
+    if start.f is not None and state.f != start.f:
+        lines.append("G1 F%s" % start.f + comment)
+    if not start.relative_e and abs(float(state.e) - float(start.e)) > E_EPSILON:
+        lines.append("G92 E%s" % start.e + comment)
+    if start.z is not None and state.z != start.z:
+        lines.append("G1 Z%s" % start.z + comment)
+    position = start.positions[island.tool]
+    if island.starts_extruding() and state.positions[island.tool] != position:
+        lines.append("G1 X%s Y%s" % position + comment)
+    return lines
+
+
+def play_lines(lines: list, state: MachineState) -> list:
+    """Extrusions of lines, sorted, following state through them"""
+    extrusions = []
+    for line in lines:
+        code, params, _ = split_line(line)
+        extrusion = state.track(code, params)
+        if extrusion is not None:
+            extrusions.append(extrusion)
+    return sorted(extrusions, key=repr)
+
+
+def reorder_layer(lines: list, state: MachineState) -> list:
+    """Lines of the layer in the new order, the original lines if nothing changes or the check fails.
+    state is the state before the layer, it is followed through the layer."""
+    start = state.copy()
+    if not is_reorderable(lines, state):
+        play_lines(lines, state)
+        return lines
+    islands = split_islands(lines, state)
+    ordered = order_islands(islands) if len(islands) > 2 else islands
+    if ordered == islands:
+        return lines
+    reordered = []
+    current = start.copy()
+    for island in ordered:
+        island_lines = island.lines
+        if island is not islands[0]:
+            tool_line, island_lines = island_lines[0], island_lines[1:]
+            if island.tool == current.tool:
+                tool_line = "; %s removed by island reordering, tool already active" % tool_line
+            restore = [tool_line] + get_restore_lines(island, current)
+            play_lines(restore, current)
+            reordered += restore
+        play_lines(island_lines, current)
+        reordered += island_lines
+    original_end = start.copy()
+    if play_lines(lines, original_end) != play_lines(reordered, start.copy()) or \
+            current.get_key() != original_end.get_key():
+        return lines
+    return reordered
+
+
+class IslandReorder:
+    def __init__(self):
+        self.state = MachineState()
+        self.layers: int = 0
+        self.reordered_layers: int = 0
+
+    def reorder_lines(self, text_lines):
+        """Generator of the lines of text_lines with the islands of every layer reordered"""
+        for kind, lines in split_layers(text_lines):
+            if kind == 'layer':
+                self.layers += 1
+                reordered = reorder_layer(lines, self.state)
+                if reordered is not lines:
+                    self.reordered_layers += 1
+                lines = reordered
+            else:
+                play_lines(lines, self.state)
+            for line in lines:
+                yield line + "\n"
+
+
+def count_tool_changes(text_lines) -> int:
+    count = 0
+    tool = 'T0'
+    for line in text_lines:
+        code = split_line(line)[0]
+        if is_tool(code) and code != tool:
+            count += 1
+            tool = code
+    return count
+
+
+def get_postprocessing_counts(text_lines: list) -> dict:
+    """Tool changes of text_lines, parks and shuffles inserted by their post processing"""
+    dr = DuelRunner(get_arg_parser().parse_args([]))
+    with redirect_stdout(io.StringIO()):
+        dr.play_gcodes_stream_to(iter(text_lines), io.StringIO())
+    metrics = dr.get_metrics()
+    return {'tool_changes': count_tool_changes(text_lines),
+            'parks': sum(value for key, value in metrics.items() if key.startswith('park')),
+            'shuffles': sum(value for key, value in metrics.items() if 'shuffles' in key)}
+
+
+def get_reorder_report(gcode_file: str) -> dict:
+    with open(gcode_file, 'r') as f:
+        lines = f.readlines()
+    reorder = IslandReorder()
+    reordered = list(reorder.reorder_lines(lines))
+    return {'file': gcode_file, 'layers': reorder.layers, 'reordered_layers': reorder.reordered_layers,
+            'before': get_postprocessing_counts(lines), 'after': get_postprocessing_counts(reordered)}
+
+
+def print_reorder_report(reports: list):
+    print("%-55s %13s %13s %13s %13s" % ("file", "layers", "tool changes", "parks", "shuffles"))
+    for report in reports:
+        before, after = report['before'], report['after']
+        print("%-55s %6d/%-6d %6d->%-6d %6d->%-6d %6d->%-6d" % (
+            report['file'], report['reordered_layers'], report['layers'], before['tool_changes'],
+            after['tool_changes'], before['parks'], after['parks'], before['shuffles'], after['shuffles']))
+
+
+def get_reorder_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Reorder the islands of every layer to save tool changes. "
+                                                 "Reports the counts of the post processing before and after.")
+    parser.add_argument('--output', help="Write the reordered G-code of the single input to this file")
+    parser.add_argument('gcodefiles', nargs='*', help="Files to reorder, default: %s" % " ".join(REPORT_FILES))
+    return parser
+
+
+def main(passed_args) -> int:
+    gcode_files = passed_args.gcodefiles or REPORT_FILES
+    if passed_args.output:
+        if len(gcode_files) != 1:
+            print("--output needs a single input file")
+            return 1
+        with open(gcode_files[0], 'r') as f_in, atomic_output(passed_args.output) as f_out:
+            f_out.writelines(IslandReorder().reorder_lines(f_in))
+    print_reorder_report([get_reorder_report(gcode_file) for gcode_file in gcode_files])
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(get_reorder_arg_parser().parse_args()))
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# Post processing of a single file in parallel chunks.
+# Phase 1 decides the backups, shuffles and splits of the whole file, as the serial run does, but writes nothing.
+# The input is memory mapped and only moves, tool changes and layer changes are tokenized, moves ruled out by the
+# prescreen only update the position and feed rate. The text inserted and the lines rewritten are recorded by their
+# input offsets (MappedEdits), along with the offsets of every ;LAYER_CHANGE, or about every --chunk-lines lines.
+# Phase 2 splits the file at these offsets into chunks of similar size and writes them in worker processes, copying
+# the input with double spaces stripped and applying the edits of the chunk. The parts are stitched together, the
+# result is byte-identical to the serial output.
+#
+# The decisions depend on the shuffles done before, so phase 1 takes about as long as the serial run without its
+# output. Phase 2 only spreads the writing over the workers, --parallel is no faster than --zero-copy.
+#
+# Sample invocation:
+#   ./duelingzero_postprocessing.py --parallel --jobs 4 --input sample.gcode --output sample_d0_ready.gcode
+
+import mmap
+import os
+import shutil
+import tempfile
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor
+
+from duelingzero_postprocessing import DuelRunner, atomic_output
+from gcode_tokenizer import tokenize_mapped
+from gcodeparser.commands import Commands
+from mapped_output import MappedEdits
+from move_prescreen import prescreen_available, prescreen_moves, iter_blocks, PRESCREEN_BLOCK_SIZE
+
+LAYER_CHANGE: str = ";LAYER_CHANGE"
+CHUNKS_PER_JOB = 4   # more chunks than workers, so workers finishing early get another one
+
+
+def find_edits(passed_args, f_input: str, chunk_lines=None):
+    """Phase 1: process f_input without output. Returns the DuelRunner with the metrics of the whole file, the
+    byte offsets of every possible chunk start and the edits of the input."""
+    dr = DuelRunner(passed_args)
+    dr.verbose = False
+    dr.reset_toolheads()
+    boundaries = []
+    with open(f_input, 'rb') as f_in:
+        if os.fstat(f_in.fileno()).st_size == 0:
+            return dr, boundaries, []
+        with mmap.mmap(f_in.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            dr.mapped_output = MappedEdits(mapped)
+            line_no = 0   # for chunk_lines only: lines in front of end, the skipped ones are counted between spans
+            end = 0
+            next_boundary = chunk_lines
+            lines = tokenize_mapped(mapped)
+            try:
+                for block in iter_blocks(lines, PRESCREEN_BLOCK_SIZE):
+                    if dr.prescreen and prescreen_available():
+                        candidates = prescreen_moves(block, dr.active_instance, dr.left_toolhead_pos,
+                                                     dr.right_toolhead_pos)
+                    else:
+                        candidates = [True] * len(block)
+                    for line, may_collide in zip(block, candidates):
+                        start = line.span[0]
+                        if chunk_lines is None:
+                            if start > 0 and line.gcode_str.startswith(LAYER_CHANGE):
+                                boundaries.append(start)
+                        else:
+                            line_no += mapped[end:start].count(b'\n')
+                            if line_no >= next_boundary:
+                                boundaries.append(start)
+                                next_boundary = (line_no // chunk_lines + 1) * chunk_lines
+                            line_no += 1
+                        if may_collide or line.type != Commands.MOVE or dr.need_to_restore_feed_rate or \
+                                dr.prescreen_stale:
+                            dr.play_gcode_line(line, may_collide)
+                        else:
+                            dr.follow_move(line)   # passes through unchanged
+                        end = line.span[1]
+                dr.mapped_output.close()
+            finally:
+                lines.close()   # releases the mapped buffer
+                edits = dr.mapped_output.edits
+                dr.mapped_output = None
+    return dr, boundaries, edits
+
+
+def select_chunks(boundaries: list, size: int, chunk_count: int) -> list:
+    """Select boundaries so the file of size bytes is split into about chunk_count chunks of similar size.
+    Returns a list of (start offset, end offset or None)."""
+    min_bytes = size / max(chunk_count, 1)
+    starts = [0]
+    for offset in boundaries:
+        if offset - starts[-1] >= min_bytes:
+            starts.append(offset)
+    return [(offset, starts[i + 1] if i + 1 < len(starts) else None) for i, offset in enumerate(starts)]
+
+
+def split_edits(edits: list, chunks: list) -> list:
+    """Lists of the edits of every chunk, an edit at a chunk start belongs to that chunk"""
+    offsets = [offset for offset, _, _ in edits]
+    parts = []
+    for start, end in chunks:
+        parts.append(edits[bisect_left(offsets, start):len(edits) if end is None else bisect_left(offsets, end)])
+    return parts
+
+
+def strip_lines(data: bytes) -> bytes:
+    """Input lines passing through as DuelRunner writes them, with double spaces stripped and newline ends"""
+    if not data:
+        return data
+    text = data.decode('utf-8', 'surrogateescape').replace('\r\n', '\n').replace('\r', '\n')
+    text_lines = text.split('\n')
+    if not text_lines[-1]:
+        text_lines.pop()   # the last line ended with a newline
+    return ''.join(' '.join(text_line.split()) + '\n' for text_line in text_lines).encode('utf-8', 'surrogateescape')
+
+
+def process_chunk(f_input: str, start: int, end, edits: list, part_path: str):
+    """Phase 2 worker: write the input from start to end with the edits applied into part_path"""
+    with open(f_input, 'rb') as f_in, open(part_path, 'wb') as f_out:
+        f_in.seek(start)
+        data = f_in.read(-1 if end is None else end - start)
+        copied_up_to = 0
+        for offset, skip_to, text in edits:
+            f_out.write(strip_lines(data[copied_up_to:offset - start]))
+            f_out.write(text)
+            copied_up_to = skip_to - start
+        f_out.write(strip_lines(data[copied_up_to:]))
+
+
+def play_file_parallel(passed_args, f_input: str, f_output: str, jobs: int, chunk_lines=None) -> DuelRunner:
+    """Post process f_input into f_output in parallel chunks. Returns the phase 1 DuelRunner holding the metrics."""
+    dr, boundaries, edits = find_edits(passed_args, f_input, chunk_lines)
+    chunks = select_chunks(boundaries, os.path.getsize(f_input), jobs * CHUNKS_PER_JOB)
+    tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(f_output)), prefix=".d0_parts_")
+    try:
+        part_paths = [os.path.join(tmp_dir, "%06d.gcode" % i) for i in range(len(chunks))]
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = [executor.submit(process_chunk, f_input, start, end, chunk_edits, part_path)
+                       for (start, end), chunk_edits, part_path in zip(chunks, split_edits(edits, chunks),
+                                                                       part_paths)]
+            for future in futures:
+                future.result()
+        # stitch the parts together
+        with atomic_output(f_output, "wb") as f_out:
+            for part_path in part_paths:
+                with open(part_path, 'rb') as f_part:
+                    shutil.copyfileobj(f_part, f_out)
+    finally:
+        shutil.rmtree(tmp_dir)
+    return dr
+
+
+def get_jobs(passed_args) -> int:
+    if passed_args.jobs:
+        return passed_args.jobs
+    return len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+
+
+def run_parallel(passed_args) -> int:
+    """Command line entry for --parallel. Returns the exit code."""
+    f_input = passed_args.gcodefile or passed_args.input
+    f_output = passed_args.gcodefile or passed_args.output
+    if not f_input or not f_output or not os.path.exists(f_input):
+        print("Invalid input file path: %s" % f_input)
+        return 1
+    if passed_args.planner != 'greedy' or passed_args.park != 'fixed' or passed_args.peephole or \
+            passed_args.reorder or passed_args.preheat or passed_args.stats:
+        # edits are decided line by line, lookahead planning and the peephole optimiser look at lines to come.
+        # The phase timers of --stats would only see phase 1.
+        print("--parallel supports the greedy planner and fixed park positions without --peephole, --reorder, "
+              "--preheat or --stats only")
+        return 1
+    print("Running:")
+    play_file_parallel(passed_args, f_input, f_output, get_jobs(passed_args), passed_args.chunk_lines)
+    print("Finished.")
+    return 0
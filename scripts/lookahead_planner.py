@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# Lookahead planner for the shuffles of the inactive toolhead (--planner lookahead).
+# The greedy strategy of DuelRunner decides at the move which runs into the inactive toolhead, from that move
+# alone. Close to the inactive column this ends in backup or segmented sequences, which move the active toolhead
+# out of the end zone and back, where a simple shuffle a few moves earlier would have cleared the way.
+#
+# The planner holds back a window of upcoming lines of the active tool segment. The inactive toolhead is either
+# at Y_LOW or Y_HIGH, for every move of the window it is known which of both positions it runs into. Before
+# passing on a move, a dynamic program over these two states finds the cheapest way through the window, where
+# a state change is either a simple shuffle before a move (only outside the end zone) or, when a move runs into
+# the inactive toolhead, the sequence the greedy strategy inserts there. The planner inserts a simple shuffle
+# only if doing it now is cheaper than any plan without it. All moves are still executed by DuelRunner, with
+# its full collision checks, so an imperfect plan costs time but never safety.
+# Tool changes end the window, the inactive toolhead is parked anyway.
+
+from collections import deque
+
+from gcodeparser.commands import Commands
+
+from arc import check_for_overlap_move
+from print_time import read_printer_limits
+from toolhead import check_for_overlap
+from toolhead import Y_LOW, Y_HIGH, T0_X_BACKOFF, T1_X_BACKOFF, X_BACKOFF_LEN
+from toolhead import SHUFFLE_SPEED, BACKOFF_SPEED, MOVE_TO_SPEED, Z_LIFT
+from point import Point
+
+PLANNERS = ['greedy', 'lookahead']
+DEFAULT_LOOKAHEAD_WINDOW = 200   # lines held back by the planner
+
+SHUFFLE_TIME = (Y_HIGH - Y_LOW) / (SHUFFLE_SPEED / 60.0)
+INFINITE_COST = float('inf')
+STATES = (Y_LOW, Y_HIGH)
+OTHER_STATE = {Y_LOW: Y_HIGH, Y_HIGH: Y_LOW}
+ALWAYS_COMPATIBLE = {Y_LOW: True, Y_HIGH: True}
+
+
+def can_shuffle_simple(active_instance: str, x: float) -> bool:
+    """True if the inactive toolhead can be shuffled while the active one stays at x, same rule as DuelRunner"""
+    if active_instance == 'left':
+        return x < T0_X_BACKOFF
+    return x > X_BACKOFF_LEN
+
+
+def get_shuffle_cost(active_instance: str, x: float, z_lift_time: float) -> float:
+    """Estimated time in s of the sequence DuelRunner inserts for a move starting at x running into the
+    inactive toolhead: simple shuffle, or a backup / segmented sequence moving the active toolhead out and back"""
+    if can_shuffle_simple(active_instance, x):
+        return SHUFFLE_TIME
+    backoff_x = T0_X_BACKOFF if active_instance == 'left' else T1_X_BACKOFF
+    backoff = abs(x - backoff_x)
+    return SHUFFLE_TIME + backoff / (BACKOFF_SPEED / 60.0) + backoff / (MOVE_TO_SPEED / 60.0) + z_lift_time
+
+
+class PlannedMove:
+    __slots__ = ('start_x', 'compatible')
+
+    def __init__(self, start_x: float, compatible: dict):
+        self.start_x = start_x
+        self.compatible = compatible   # inactive Y state -> move does not run into the inactive toolhead there
+
+
+class LookaheadPlanner:
+    def __init__(self, dr, window: int = DEFAULT_LOOKAHEAD_WINDOW, limits: dict = None):
+        """Planner feeding lines to DuelRunner dr, holding back up to window lines. limits of printer.cfg as read
+        by read_printer_limits."""
+        self.dr = dr
+        self.window: int = max(1, window)
+        limits = limits or read_printer_limits()
+        self.z_lift_time: float = 2 * max(Z_LIFT, 0.0) / limits['max_z_velocity']
+        self.pending: deque = deque()   # (line, may_collide, PlannedMove or None)
+        self.blocked = {Y_LOW: 0, Y_HIGH: 0}   # pending moves running into the inactive toolhead per state
+        self.tail = None   # (x, y) of the active toolhead after the pending lines
+        self.preemptive_shuffles: int = 0
+
+    def pending_lines(self) -> list:
+        return [entry[0] for entry in self.pending]
+
+    def set_candidates(self, candidates: list):
+        """Replace the prescreen flags of the pending lines, screened again after the inactive toolhead moved"""
+        self.pending = deque((line, may_collide, move) for (line, _, move), may_collide in zip(self.pending, candidates))
+
+    def get_active_pos(self) -> Point:
+        dr = self.dr
+        return dr.left_toolhead_pos if dr.active_instance == 'left' else dr.right_toolhead_pos
+
+    def get_inactive_pos(self) -> Point:
+        dr = self.dr
+        return dr.right_toolhead_pos if dr.active_instance == 'left' else dr.left_toolhead_pos
+
+    def play_line(self, line, may_collide: bool = True):
+        """Queue line, executing the oldest pending line once the window is full"""
+        if line.type == Commands.TOOLCHANGE:
+            self.pending.append((line, may_collide, None))
+            self.drain()
+            return
+        move = None
+        if line.type == Commands.MOVE:
+            move = self.plan_move(line, may_collide)
+        self.pending.append((line, may_collide, move))
+        if len(self.pending) > self.window:
+            self.play_next()
+
+    def plan_move(self, line, may_collide: bool) -> PlannedMove:
+        if self.tail is None:
+            pos = self.get_active_pos()
+            self.tail = (pos.x, pos.y)
+        x, y = self.tail
+        new_x = line.get_param('X')
+        new_y = line.get_param('Y')
+        new_x = x if new_x is None else float(new_x)
+        new_y = y if new_y is None else float(new_y)
+        self.tail = (new_x, new_y)
+        if not may_collide:
+            # the prescreen column covers both states
+            return PlannedMove(x, ALWAYS_COMPATIBLE)
+        # No tool change is pending, see play_line, so the inactive toolhead keeps its X until this move
+        inactive_x = self.get_inactive_pos().x
+        start = Point(x, y)
+        end = Point(new_x, new_y)
+        compatible = {}
+        for state in STATES:
+            inactive = Point(inactive_x, state)
+            compatible[state] = not (check_for_overlap(inactive, end) or
+                                     check_for_overlap_move(start, end, inactive, line))
+            if not compatible[state]:
+                self.blocked[state] += 1
+        return PlannedMove(x, compatible)
+
+    def drain(self):
+        """Execute all pending lines"""
+        while self.pending:
+            self.play_next()
+        self.tail = None
+
+    def play_next(self):
+        line, may_collide, move = self.pending[0]
+        if move is not None:
+            state = self.get_inactive_pos().y
+            if state in OTHER_STATE and self.blocked[state] > 0 and self.should_shuffle_now(move, state):
+                self.dr.do_preemptive_shuffle()
+                self.preemptive_shuffles += 1
+            if move.compatible is not ALWAYS_COMPATIBLE:
+                for s in STATES:
+                    if not move.compatible[s]:
+                        self.blocked[s] -= 1
+        self.pending.popleft()
+        self.dr.play_gcode_line(line, may_collide)
+
+    def get_moves(self) -> list:
+        return [move for _, _, move in self.pending if move is not None]
+
+    def should_shuffle_now(self, move: PlannedMove, state: float) -> bool:
+        """True if a simple shuffle before move, the next pending one, makes the cheapest plan for the window"""
+        if not can_shuffle_simple(self.dr.active_instance, move.start_x):
+            return False
+        moves = self.get_moves()
+        other = OTHER_STATE[state]
+        stay = self.get_plan_cost(moves, {state: 0.0, other: INFINITE_COST})
+        shuffle = self.get_plan_cost(moves, {state: INFINITE_COST, other: SHUFFLE_TIME})
+        return shuffle < stay
+
+    def get_plan_cost(self, moves: list, costs: dict) -> float:
+        """Minimal cost of executing moves, starting with costs per state of the inactive toolhead.
+        No simple shuffle is planned before the first move, that decision is made by the caller."""
+        active_instance = self.dr.active_instance
+        for i, move in enumerate(moves):
+            if i > 0 and can_shuffle_simple(active_instance, move.start_x):
+                low, high = costs[Y_LOW], costs[Y_HIGH]
+                costs = {Y_LOW: min(low, high + SHUFFLE_TIME), Y_HIGH: min(high, low + SHUFFLE_TIME)}
+            next_costs = {Y_LOW: INFINITE_COST, Y_HIGH: INFINITE_COST}
+            shuffle_cost = get_shuffle_cost(active_instance, move.start_x, self.z_lift_time)
+            for state in STATES:
+                cost = costs[state]
+                if cost == INFINITE_COST:
+                    continue
+                if move.compatible[state]:
+                    next_costs[state] = min(next_costs[state], cost)
+                else:
+                    # DuelRunner shuffles at this move
+                    other = OTHER_STATE[state]
+                    next_costs[other] = min(next_costs[other], cost + shuffle_cost)
+            costs = next_costs
+        return min(costs.values())
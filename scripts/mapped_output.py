@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# Output for a memory mapped input. Input lines which pass through unchanged are not written one by one,
+# instead the byte ranges between inserted or rewritten lines are copied in one go.
+# MappedEdits only records the inserted text and dropped lines by input offset, for writing the output later.
+
+class MappedOutput:
+    def __init__(self, mapped, output):
+        """mapped: memory mapped input, output: file opened in binary mode"""
+        self.mapped = mapped
+        self.output = output
+        self.copied_up_to: int = 0    # input bytes before this position are written already
+        self.copy_to: int = 0         # input bytes before this position have to be written before any new text
+        self.current = None           # input line in process
+        self.passed: bool = False     # current input line passes through unchanged
+        self.bytes_copied: int = 0
+
+    def _copy_input(self, end: int):
+        if end > self.copied_up_to:
+            self.output.write(self.mapped[self.copied_up_to:end])
+            self.bytes_copied += end - self.copied_up_to
+            self.copied_up_to = end
+
+    def _finish_line(self):
+        if self.current is not None and not self.passed:
+            # line got rewritten or dropped, skip its original bytes
+            self._copy_input(self.current.span[0])
+            self.copied_up_to = self.current.span[1]
+        self.current = None
+
+    def begin_line(self, line):
+        """Start processing of an input line with a span, everything in front of it passes through"""
+        self._finish_line()
+        self.current = line
+        self.passed = False
+        self.copy_to = line.span[0]
+
+    def pass_line(self):
+        """The input line in process passes through unchanged"""
+        self.passed = True
+        self.copy_to = self.current.span[1]
+
+    def write(self, text: str):
+        """Write inserted or rewritten text at the current position"""
+        self._copy_input(self.copy_to)
+        self.output.write(text.encode('utf-8', 'surrogateescape'))
+
+    def close(self):
+        """Copy all remaining input"""
+        self._finish_line()
+        self._copy_input(len(self.mapped))
+
+
+class MappedEdits(MappedOutput):
+    def __init__(self, mapped):
+        """Records the changes to the memory mapped input instead of writing them, see edits"""
+        super().__init__(mapped, None)
+        # (offset, skip_to, text): text is inserted at input offset and the input from there up to skip_to dropped
+        self.edits: list = []
+
+    def _copy_input(self, end: int):
+        self.copied_up_to = max(self.copied_up_to, end)
+
+    def _finish_line(self):
+        if self.current is not None and not self.passed:
+            self.edits.append((self.current.span[0], self.current.span[1], b''))
+        super()._finish_line()
+
+    def write(self, text: str):
+        self._copy_input(self.copy_to)
+        self.edits.append((self.copied_up_to, self.copied_up_to, text.encode('utf-8', 'surrogateescape')))
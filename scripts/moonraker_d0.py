@@ -0,0 +1,75 @@
+# Moonraker component post processing G-code files uploaded to the printer, by the daemon d0_daemon.py.
+# Uploads which are already processed are processed again without change, so files from a slicer calling
+# d0_client.py are fine as well. The rewrite of a file by the daemon is not processed again.
+#
+# Installation:
+#   ln -s ~/D0_config_and_scripts/scripts/moonraker_d0.py ~/moonraker/moonraker/components/moonraker_d0.py
+#   run ./d0_daemon.py as a service, i.e. next to klipper
+# and in moonraker.conf:
+#   [moonraker_d0]
+#   socket: /run/user/1000/d0_postprocessing.sock
+#       optional, the default of d0_client.py: in $XDG_RUNTIME_DIR, else in /tmp/d0_postprocessing-<uid>
+#   args: --park dynamic
+#       arguments for duelingzero_postprocessing.py, optional
+
+import asyncio
+import json
+import logging
+import os
+import shlex
+import tempfile
+
+# as in d0_client.py, which is not importable by Moonraker
+DEFAULT_SOCKET = os.path.join(os.environ.get('XDG_RUNTIME_DIR') or
+                              os.path.join(tempfile.gettempdir(), "d0_postprocessing-%d" % os.getuid()),
+                              "d0_postprocessing.sock")
+
+
+class MoonrakerD0:
+    def __init__(self, config):
+        self.server = config.get_server()
+        self.socket_path = config.get('socket', DEFAULT_SOCKET)
+        self.args = shlex.split(config.get('args', ""))
+        self.processed = {}   # path -> (mtime, size) of the output written by the daemon
+        self.running = set()
+        self.server.register_event_handler("file_manager:filelist_changed", self._handle_filelist_changed)
+
+    async def _handle_filelist_changed(self, response):
+        item = response.get('item', {})
+        if response.get('action') not in ('create_file', 'modify_file') or item.get('root') != 'gcodes':
+            return
+        file_manager = self.server.lookup_component('file_manager')
+        path = os.path.join(file_manager.get_directory('gcodes'), item['path'])
+        if not path.endswith('.gcode') or path in self.running or not os.path.exists(path):
+            return
+        stat = os.stat(path)
+        if self.processed.get(path) == (stat.st_mtime_ns, stat.st_size):
+            return
+        self.running.add(path)
+        try:
+            result = await self.send_job(self.args + [path])
+            stat = os.stat(path)
+            self.processed[path] = (stat.st_mtime_ns, stat.st_size)
+            logging.info("D0 post processing %s: %s %s" % (path, result['message'], result['metrics']))
+            if result['exit_code'] != 0:
+                self.server.add_warning("D0 post processing of %s failed: %s" % (item['path'], result['message']))
+        except OSError as e:
+            self.server.add_warning("D0 post processing daemon not reachable at %s: %s" % (self.socket_path, e))
+        finally:
+            self.running.discard(path)
+
+    async def send_job(self, args: list) -> dict:
+        reader, writer = await asyncio.open_unix_connection(self.socket_path)
+        try:
+            writer.write(json.dumps({'args': args, 'cwd': "/"}).encode() + b"\n")
+            await writer.drain()
+            line = await reader.readline()
+        finally:
+            writer.close()
+        if not line:
+            raise ConnectionError("Connection closed by the daemon")
+        return json.loads(line)
+
+
+def load_component(config):
+    return MoonrakerD0(config)
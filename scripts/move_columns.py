@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# Compact columnar representation of the moves of a block of G-code lines.
+# One typed array per value instead of a line object with a params dict per move: the line index in the block,
+# command (0..3 for G0..G3), active tool (0 / 1), start and end XY of the active toolhead, Z, E and F as given
+# (NaN if not), and the position of the inactive toolhead. The arrays expose the buffer protocol, NumPy reads
+# them without a copy.
+# Positions follow the toolheads through the tool changes as DuelRunner does: the outgoing toolhead is parked,
+# unless the tool change was inserted by post processing.
+
+from array import array
+
+from gcodeparser.commands import Commands
+
+from gcode_tokenizer import PP_comment
+from toolhead import LEFT_PARK_POS, RIGHT_PARK_POS
+
+NAN = float('nan')
+FLOAT_COLUMNS = ('x0', 'y0', 'x', 'y', 'z', 'e', 'f', 'inactive_x', 'inactive_y')
+TOOLS = {'left': 0, 'right': 1}
+
+
+def get_float_param(line, param: str) -> float:
+    value = line.get_param(param)
+    return NAN if value is None else float(value)
+
+
+class MoveColumns:
+    __slots__ = ('index', 'command', 'tool') + FLOAT_COLUMNS
+
+    def __init__(self):
+        self.index = array('i')
+        self.command = array('b')
+        self.tool = array('b')
+        for name in FLOAT_COLUMNS:
+            setattr(self, name, array('d'))
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def get_nbytes(self) -> int:
+        """Bytes used by the values of all columns"""
+        return sum(len(column) * column.itemsize for column in (getattr(self, name) for name in self.__slots__))
+
+    @classmethod
+    def from_lines(cls, lines, active_instance: str, left_pos, right_pos, park_positions=None):
+        """Columns of the moves in lines, with the toolheads at left_pos / right_pos before the first line.
+        park_positions are the (x, y) of the parking tool changes in lines, by default the fixed park positions."""
+        columns = cls()
+        index, command, tool = columns.index, columns.command, columns.tool
+        x0, y0, x1, y1 = columns.x0, columns.y0, columns.x, columns.y
+        z, e, f, inactive_x, inactive_y = columns.z, columns.e, columns.f, columns.inactive_x, columns.inactive_y
+        positions = {'left': (left_pos.x, left_pos.y), 'right': (right_pos.x, right_pos.y)}
+        other = {'left': 'right', 'right': 'left'}
+        park = {'left': (LEFT_PARK_POS.x, LEFT_PARK_POS.y), 'right': (RIGHT_PARK_POS.x, RIGHT_PARK_POS.y)}
+        parks = iter(park_positions) if park_positions is not None else iter(())
+        active = active_instance
+        x, y = positions[active]
+        i_x, i_y = positions[other[active]]
+        for i, line in enumerate(lines):
+            line_type = line.type
+            if line_type == Commands.MOVE:
+                new_x = line.get_param('X')
+                new_y = line.get_param('Y')
+                new_x = x if new_x is None else float(new_x)
+                new_y = y if new_y is None else float(new_y)
+                index.append(i)
+                command.append(line.command[1])
+                tool.append(TOOLS[active])
+                x0.append(x)
+                y0.append(y)
+                x1.append(new_x)
+                y1.append(new_y)
+                z.append(get_float_param(line, 'Z'))
+                e.append(get_float_param(line, 'E'))
+                f.append(get_float_param(line, 'F'))
+                inactive_x.append(i_x)
+                inactive_y.append(i_y)
+                x, y = new_x, new_y
+            elif line_type == Commands.TOOLCHANGE:
+                target = 'left' if line.command[1] == 0 else 'right'
+                if target != active:
+                    # a tool change of the post processing just swaps the active head, the other one stays
+                    positions[active] = (x, y) if PP_comment in line.comment else next(parks, park[active])
+                    active = target
+                    x, y = positions[active]
+                    i_x, i_y = positions[other[active]]
+        return columns
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# Batched prescreen of moves for collision candidates.
+# Most moves of a print can never touch the inactive toolhead. Instead of the detailed check per move, the XY
+# endpoints of a block of moves are collected into the typed columns of move_columns.py and compared as NumPy
+# arrays against the area the inactive toolhead can occupy in its tool segment, all in one computation. Only the
+# flagged moves need the detailed check and the shuffle logic.
+#
+# The prescreen is conservative: the inactive toolhead keeps its X during a tool segment and is only shuffled
+# between Y_LOW and Y_HIGH, so its possible area is a column covering its current Y and both shuffle positions.
+# The swept area of a move lies within the bounding box of its start and end toolhead rectangles. Arcs (G2/G3)
+# do not, they are always flagged.
+
+from itertools import islice
+
+try:
+    import numpy as np
+except ImportError:  # prescreen is skipped without numpy
+    np = None
+
+from move_columns import MoveColumns
+from toolhead import get_sweep_extents, TOOLHEAD_X_WIDTH, TOOLHEAD_Y_HEIGHT, Y_LOW, Y_HIGH
+
+PRESCREEN_BLOCK_SIZE = 4096
+
+
+def prescreen_available() -> bool:
+    return np is not None
+
+
+def iter_blocks(lines, size: int):
+    """Generator of lists of up to size lines"""
+    iterator = iter(lines)
+    while True:
+        block = list(islice(iterator, size))
+        if not block:
+            return
+        yield block
+
+
+def prescreen_moves(lines, active_instance: str, left_pos, right_pos, park_positions=None) -> list:
+    """Return a list with a flag for each line, False if the line is a move which can not collide
+    with the inactive toolhead. Positions are the state before the first line."""
+    columns = MoveColumns.from_lines(lines, active_instance, left_pos, right_pos, park_positions)
+    candidates = [True] * len(lines)
+    if not len(columns):
+        return candidates
+    x0, y0, x1, y1 = (np.frombuffer(column) for column in (columns.x0, columns.y0, columns.x, columns.y))
+    inactive_x, inactive_y = np.frombuffer(columns.inactive_x), np.frombuffer(columns.inactive_y)
+    # bounding box of the swept area of the active toolhead, grown by the sweep margins
+    extent_x, extent_y = get_sweep_extents()
+    half_x = extent_x - TOOLHEAD_X_WIDTH / 2
+    half_y = extent_y - TOOLHEAD_Y_HEIGHT / 2
+    min_x = np.minimum(x0, x1) - half_x
+    max_x = np.maximum(x0, x1) + half_x
+    min_y = np.minimum(y0, y1) - half_y
+    max_y = np.maximum(y0, y1) + half_y
+    # area the inactive toolhead may occupy during the tool segment
+    column_min_x = inactive_x - TOOLHEAD_X_WIDTH / 2
+    column_max_x = inactive_x + TOOLHEAD_X_WIDTH / 2
+    column_min_y = np.minimum(inactive_y, Y_LOW) - TOOLHEAD_Y_HEIGHT / 2
+    column_max_y = np.maximum(inactive_y, Y_HIGH) + TOOLHEAD_Y_HEIGHT / 2
+    flagged = (min_x <= column_max_x) & (column_min_x <= max_x) & (min_y <= column_max_y) & (column_min_y <= max_y)
+    # arcs may leave the bounding box of their ends, they always get the detailed check
+    flagged |= np.frombuffer(columns.command, dtype=np.int8) > 1
+    for i, flag in zip(columns.index, flagged.tolist()):
+        candidates[i] = flag
+    return candidates
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# Dynamic park positions for the outgoing toolhead of a tool change (--park dynamic).
+# By default the outgoing toolhead always goes to its fixed corner, LEFT_PARK_POS / RIGHT_PARK_POS. Instead the
+# lines of the upcoming tool segment are read ahead (up to the next tool change, at most --park-window lines):
+#  - if the segment is read completely and never comes near the outgoing toolhead, it stays where it is
+#  - otherwise it parks in its column (X of its park position, as the shuffle and backoff rules of DuelRunner
+#    expect) at Y_LOW or Y_HIGH, whichever the segment runs into later, on a tie the nearer one.
+# A toolhead left in place must not be in the way of the park moves of the other toolhead at the end of the
+# segment, so this is checked as well. Segments with arcs (G2/G3) are taken by the ends of their moves, the
+# outgoing toolhead always parks then. Should a move run into a toolhead left in place anyway, DuelRunner parks it
+# in its column before the move, it can not be shuffled out of it.
+# plan_parks passes the lines through and queues one park position per parking tool change in
+# DuelRunner.park_plans, a park position equal to the current position means parking is skipped.
+
+from collections import deque
+
+from gcodeparser.commands import Commands
+
+from gcode_tokenizer import PP_comment
+from toolhead import check_for_overlap, check_for_overlap_sweep, get_sweep_extents
+from toolhead import Y_LOW, Y_HIGH, LEFT_PARK_POS, RIGHT_PARK_POS
+from point import Point
+
+PARK_MODES = ['fixed', 'dynamic']
+DEFAULT_PARK_WINDOW = 5000   # lines read ahead at a tool change
+
+PARK_POS = {'left': LEFT_PARK_POS, 'right': RIGHT_PARK_POS}
+OTHER = {'left': 'right', 'right': 'left'}
+
+
+def get_park_path(pos: Point, park: Point) -> list:
+    """Moves of a park from pos, X first, then Y, like t0_park / t1_park"""
+    return [(pos.x, pos.y, park.x, pos.y), (park.x, pos.y, park.x, park.y)]
+
+
+def runs_into(moves: list, pos: Point) -> int:
+    """Index of the first of moves, (x0, y0, x1, y1) tuples, running into a toolhead at pos. len(moves) if none does."""
+    # bounding boxes of the swept areas rule out most moves, with the safety margins of the sweep checks
+    extent_x, extent_y = get_sweep_extents()
+    min_x = pos.x - extent_x
+    max_x = pos.x + extent_x
+    min_y = pos.y - extent_y
+    max_y = pos.y + extent_y
+    for i, (x0, y0, x1, y1) in enumerate(moves):
+        if (x0 < min_x and x1 < min_x) or (x0 > max_x and x1 > max_x) or \
+                (y0 < min_y and y1 < min_y) or (y0 > max_y and y1 > max_y):
+            continue
+        end = Point(x1, y1)
+        if check_for_overlap(pos, end) or check_for_overlap_sweep(Point(x0, y0), end, pos):
+            return i
+    return len(moves)
+
+
+def get_column_parks(instance: str) -> list:
+    x = PARK_POS[instance].x
+    return [Point(x, Y_LOW), Point(x, Y_HIGH)]
+
+
+def choose_park_pos(outgoing: str, outgoing_pos: Point, incoming_pos: Point, moves: list, complete: bool,
+                    next_park: bool) -> Point:
+    """Park position for the outgoing toolhead at outgoing_pos. moves are the (x0, y0, x1, y1) of the incoming
+    toolhead in the upcoming segment, complete if the segment was read up to its end. next_park tells if a tool
+    change parking the incoming toolhead ends the segment."""
+    incoming = OTHER[outgoing]
+    segment = list(moves)
+    if moves and incoming_pos.x == PARK_POS[incoming].x:
+        # a toolhead in its column may have been shuffled to the other Y meanwhile
+        x1, y1 = moves[0][2:]
+        segment += [(park.x, park.y, x1, y1) for park in get_column_parks(incoming)]
+    if complete and runs_into(segment, outgoing_pos) == len(segment):
+        # the last move of the segment is where the incoming toolhead starts its park moves
+        last_pos = Point(*moves[-1][2:]) if moves else incoming_pos
+        if not next_park or any(runs_into(get_park_path(last_pos, park), outgoing_pos) == 2
+                                for park in get_column_parks(incoming)):
+            return outgoing_pos
+    best = None
+    best_score = None
+    for park in get_column_parks(outgoing):
+        if runs_into(get_park_path(outgoing_pos, park), incoming_pos) < 2:
+            continue
+        score = (runs_into(segment, park), -abs(outgoing_pos.y - park.y))
+        if best_score is None or score > best_score:
+            best, best_score = park, score
+    return best if best is not None else PARK_POS[outgoing]
+
+
+def get_tool(line):
+    """'left' / 'right' for T0 / T1, None for other tool numbers"""
+    return {0: 'left', 1: 'right'}.get(line.command[1])
+
+
+def ends_segment(line, tool: str) -> bool:
+    """True if line is a tool change away from tool"""
+    return line.type == Commands.TOOLCHANGE and get_tool(line) != tool
+
+
+def read_segment(iterator, ahead: deque, window: int, tool: str) -> bool:
+    """Read lines into ahead until it holds the end of the segment of tool or window lines.
+    True if the end of the input is reached."""
+    if any(ends_segment(line, tool) for line in ahead):
+        return False
+    while len(ahead) < window:
+        line = next(iterator, None)
+        if line is None:
+            return True
+        ahead.append(line)
+        if ends_segment(line, tool):
+            return False
+    return False
+
+
+def get_segment_moves(ahead: deque, pos: Point, tool: str):
+    """Moves (x0, y0, x1, y1) of the toolhead of tool at pos through ahead, up to the end of its segment.
+    Returns the moves, the tool change ending the segment (None if there is none in ahead) and whether the
+    segment has arcs, given by their ends only."""
+    moves = []
+    x, y = pos.x, pos.y
+    has_arcs = False
+    for line in ahead:
+        line_type = line.type
+        if line_type == Commands.MOVE:
+            new_x = line.get_param('X')
+            new_y = line.get_param('Y')
+            new_x = x if new_x is None else float(new_x)
+            new_y = y if new_y is None else float(new_y)
+            moves.append((x, y, new_x, new_y))
+            has_arcs = has_arcs or line.command[1] > 1
+            x, y = new_x, new_y
+        elif ends_segment(line, tool):
+            return moves, line, has_arcs
+    return moves, None, has_arcs
+
+
+def plan_parks(lines, dr, window: int = DEFAULT_PARK_WINDOW):
+    """Generator passing through lines. For every tool change parking the outgoing toolhead, the park position
+    is chosen from the lines read ahead and queued in dr.park_plans before the tool change is passed on."""
+    iterator = iter(lines)
+    ahead = deque()
+    active = dr.active_instance
+    positions = {'left': dr.left_toolhead_pos.copy(), 'right': dr.right_toolhead_pos.copy()}
+    while True:
+        if ahead:
+            line = ahead.popleft()
+        else:
+            line = next(iterator, None)
+            if line is None:
+                return
+        if line.type == Commands.MOVE:
+            new_x = line.get_param('X')
+            new_y = line.get_param('Y')
+            if new_x is not None or new_y is not None:
+                pos = positions[active]
+                positions[active] = Point(pos.x if new_x is None else float(new_x),
+                                          pos.y if new_y is None else float(new_y))
+        elif line.type == Commands.TOOLCHANGE:
+            target = get_tool(line)
+            if target is not None and target != active:
+                if PP_comment not in line.comment:
+                    at_end = read_segment(iterator, ahead, window, target)
+                    moves, next_toolchange, has_arcs = get_segment_moves(ahead, positions[target], target)
+                    # the outgoing toolhead is only left in place if the whole segment is known
+                    complete = (at_end or (next_toolchange is not None and PP_comment not in next_toolchange.comment)) \
+                        and not has_arcs
+                    park = choose_park_pos(active, positions[active], positions[target], moves, complete,
+                                           next_toolchange is not None)
+                    dr.park_plans.append((park.x, park.y))
+                    positions[active] = park
+                active = target
+        yield line
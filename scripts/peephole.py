@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# Peephole optimiser for the output G-code (--peephole).
+# Inserted sequences next to each other often produce redundant lines. The writer holds back a small window of
+# output lines and before writing the oldest one applies these rules to it:
+#  - a Z lift cancelled by the next Z lift (z_down followed by z_up or vice versa) is removed, when nothing but
+#    comments, tool selections, feed rates, M-codes and G92 without Z lie in between
+#  - a tool activation inserted by post processing (T0 ; PPfD0 ...) selecting the tool already selected is removed
+#  - a restored feed rate is removed when the next G0/G1 sets its own feed rate
+#  - consecutive G0 moves along the same single axis are merged into one, which covers the same path
+# Every rule only cuts redundant lines, the machine moves the same way. A Z lift is never folded into the next move,
+# Klipper spreads the Z change over the whole move, so the nozzle would only reach the lift height at its end.
+# The state needed for the rules (selected tool, absolute Z, positioning mode) is taken from the written lines,
+# it is unknown until set by the G-code and rules depending on it are skipped meanwhile.
+
+from collections import deque
+
+from gcode_tokenizer import PP_comment
+
+PEEPHOLE_WINDOW = 16   # lines held back
+RESTORED_FEED_RATE = "restored feed_rate"
+MOTION_CODES = ('G0', 'G1', 'G2', 'G3')
+
+
+def split_line(line: str):
+    """Return (code, params, comment) of an output line: 'G0 X1 F100 ; c' -> ('G0', {'X': '1', 'F': '100'}, 'c').
+    code is '' for comment or empty lines."""
+    text, _, comment = line.partition(';')
+    words = text.split()
+    if not words:
+        return '', {}, comment.strip()
+    params = {}
+    for word in words[1:]:
+        params[word[0].upper()] = word[1:]
+    return words[0].upper(), params, comment.strip()
+
+
+def format_number(value: float) -> str:
+    return ("%.4f" % value).rstrip('0').rstrip('.')
+
+
+def is_tool(code: str) -> bool:
+    return code[:1] == 'T' and code[1:].isdigit()
+
+
+def is_m_code(code: str) -> bool:
+    return code[:1] == 'M' and code[1:].isdigit()
+
+
+def is_inserted_tool(code: str, comment: str) -> bool:
+    """Tool selection inserted by post processing, not a tool change of the input"""
+    return is_tool(code) and comment.startswith(PP_comment)
+
+
+class PeepholeWriter:
+    def __init__(self, output, window: int = PEEPHOLE_WINDOW):
+        """Writer for text file output, holding back up to window lines. finish writes the rest."""
+        self.output = output
+        self.window: int = max(8, window)
+        self.lines: deque = deque()
+        # state after the written lines, None if unknown
+        self.tool = None
+        self.z = None
+        self.relative = None
+        self.counts = {'z_lifts': 0, 'tools': 0, 'feed_rates': 0, 'merged_moves': 0}
+
+    def write(self, text: str):
+        self.lines.extend(text.splitlines())
+        while len(self.lines) > self.window:
+            self.write_next()
+
+    def finish(self):
+        """Write all held back lines"""
+        while self.lines:
+            self.write_next()
+
+    def write_next(self):
+        while self.lines and self.optimize():
+            pass
+        if self.lines:
+            line = self.lines.popleft()
+            self.track(line)
+            self.output.write(line + "\n")
+
+    def track(self, line: str):
+        code, params, _ = split_line(line)
+        if not code:
+            return
+        if is_tool(code):
+            self.tool = code
+        elif code == 'G90':
+            self.relative = False
+        elif code == 'G91':
+            self.relative = True
+        elif code in MOTION_CODES:
+            if 'Z' in params:
+                if self.relative is False:
+                    self.z = float(params['Z'])
+                elif self.relative is True and self.z is not None:
+                    self.z += float(params['Z'])
+                else:
+                    self.z = None
+        elif code == 'G92':
+            if 'Z' in params or not params:
+                self.z = float(params.get('Z', 0.0))
+        elif not is_m_code(code) and code != 'G4':
+            self.z = None   # homing, macros, ...
+
+    def optimize(self) -> bool:
+        """Apply the first matching rule to the oldest held back line. True if the window changed."""
+        code, params, comment = split_line(self.lines[0])
+        if code == 'G91':
+            return self.cancel_z_lifts()
+        if is_tool(code):
+            return self.drop_tool(code, comment)
+        if code == 'G1' and list(params) == ['F'] and RESTORED_FEED_RATE in comment:
+            return self.drop_feed_rate()
+        if code == 'G0':
+            return self.merge_moves(params, comment)
+        return False
+
+    def find_lines(self, count: int, start: int, neutral) -> list:
+        """Indices of the next count lines from start, which are not neutral(code, params, comment).
+        Shorter if the window ends before."""
+        found = []
+        for i in range(start, len(self.lines)):
+            if len(found) == count:
+                break
+            if not neutral(*split_line(self.lines[i])):
+                found.append(i)
+        return found
+
+    def get_relative_z(self, i: int):
+        """Z of a Z-only relative lift 'G91' / 'G0 Z..' / 'G90' starting at index i, None if there is none"""
+        if i + 2 >= len(self.lines):
+            return None
+        code, params, _ = split_line(self.lines[i + 1])
+        if split_line(self.lines[i])[0] != 'G91' or code != 'G0' or list(params) != ['Z'] or \
+                split_line(self.lines[i + 2])[0] != 'G90':
+            return None
+        return float(params['Z'])
+
+    def cancel_z_lifts(self) -> bool:
+        lift = self.get_relative_z(0)
+        if lift is None:
+            return False
+
+        def neutral(code, params, comment):
+            return not code or is_tool(code) or is_m_code(code) or (code == 'G92' and params and 'Z' not in params) or \
+                (code in ('G0', 'G1') and list(params) == ['F'])
+        found = self.find_lines(1, 3, neutral)
+        if not found:
+            return False
+        second = self.get_relative_z(found[0])
+        if second is None or second != -lift:
+            return False
+        for i in (found[0] + 2, found[0] + 1, found[0], 2, 1, 0):
+            del self.lines[i]
+        self.counts['z_lifts'] += 1
+        return True
+
+    def drop_tool(self, code: str, comment: str) -> bool:
+        if not is_inserted_tool(code, comment) or code != self.tool:
+            return False
+        del self.lines[0]
+        self.counts['tools'] += 1
+        return True
+
+    def drop_feed_rate(self) -> bool:
+        def neutral(code, params, comment):
+            return not code or is_tool(code) or is_m_code(code) or code in ('G90', 'G91', 'G92')
+        found = self.find_lines(1, 1, neutral)
+        if not found:
+            return False
+        code, params, _ = split_line(self.lines[found[0]])
+        if code not in ('G0', 'G1') or 'F' not in params:
+            return False
+        del self.lines[0]
+        self.counts['feed_rates'] += 1
+        return True
+
+    def merge_moves(self, params: dict, comment: str) -> bool:
+        if self.relative is not False or len(self.lines) < 2:
+            return False
+        axes = [axis for axis in params if axis != 'F']
+        if len(axes) != 1 or axes[0] not in ('X', 'Y', 'Z'):
+            return False
+        next_code, next_params, next_comment = split_line(self.lines[1])
+        next_axes = [axis for axis in next_params if axis != 'F']
+        if next_code != 'G0' or next_axes != axes:
+            return False
+        axis = axes[0]
+        words = ['G0', axis + next_params[axis]]
+        feed_rate = next_params.get('F', params.get('F'))
+        if feed_rate is not None:
+            words.append('F' + feed_rate)
+        self.lines[1] = ' '.join(words) + (' ; ' + next_comment if next_comment else '')
+        del self.lines[0]
+        self.counts['merged_moves'] += 1
+        return True
@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+# Placement advisor: shuffles and time overhead of the post processing for a grid of XY offsets of the whole print.
+# Where the parts sit on the bed decides how often the active toolhead runs into the parked one. The advisor
+# evaluates the print moved by every offset of a grid which keeps it on the bed and recommends the one with the
+# least estimated time overhead, then the fewest shuffles. The bed is the range of X and Y of printer.cfg, not the
+# park positions, prints reach beyond these. Where the print as sliced leaves the bed, the grid still covers (0, 0)
+# and the offsets moving it back towards the bed.
+#
+# The file is tokenized once. Its moves are held in NumPy columns, each coordinate flagged whether it was given by
+# the print or still is the park position of its toolhead, as only the former move with the offset. The inactive
+# toolhead stays at its fixed park X, at Y_LOW or Y_HIGH, so the moves which may run into it at an offset are found
+# in one computation: the moves touching either of its two possible places, by the exact swept area check, and
+# arcs. DuelRunner then runs on a reduced stream only: these moves, the move in front of each of them and of each
+# tool change, for the position, and the tool changes. Its shuffle counts are the ones of the full post processing.
+# The time overhead is estimated with print_time.py for every inserted sequence against the input line it replaces,
+# each from a stop to a stop. The default post processing is evaluated, fixed parking and the greedy planner.
+# The print as sliced is evaluated as well, for comparison, even if it does not fit on the bed. Offsets where the
+# post processing fails are listed and never recommended.
+# Files already post processed and files with relative XY moves or G92 XY are rejected.
+#
+# Sample invocations:
+#   ./placement_advisor.py sample.gcode
+#       evaluates offsets in steps of 5 mm and lists the best ones
+#   ./placement_advisor.py --step 2 --max-offset 20 --top 10 sample.gcode
+
+import argparse
+import io
+import math
+import sys
+import time
+from contextlib import redirect_stdout
+
+try:
+    import numpy as np
+except ImportError:  # every move is a candidate without numpy
+    np = None
+
+from gcodeparser.commands import Commands
+
+from duelingzero_postprocessing import DuelRunner, get_arg_parser
+from gcode_tokenizer import FastGcodeLine, tokenize_gcode_stream, tokenize_line, PP_comment
+from peephole import split_line
+from print_time import PrintTimeEstimator, PRINTER_CFG, read_bed_limits, read_printer_limits
+from toolhead import LEFT_PARK_POS, RIGHT_PARK_POS, Y_LOW, Y_HIGH, TOOLHEAD_X_WIDTH, TOOLHEAD_Y_HEIGHT
+from toolhead import get_sweep_extents
+from toolhead import set_collision_backend, set_sweep_margins
+
+PARK_POSITIONS = {0: (LEFT_PARK_POS.x, LEFT_PARK_POS.y), 1: (RIGHT_PARK_POS.x, RIGHT_PARK_POS.y)}
+DEFAULT_STEP = 5.0
+DEFAULT_TOP = 5
+ARC_PARAMS = ('I', 'J', 'R')
+TOLERANCE = 1e-6   # grows the boxes, rounding never drops a move the exact check would flag
+
+
+class PlacementRunner(DuelRunner):
+    """DuelRunner collecting the output lines of the current input line instead of writing them"""
+    def __init__(self):
+        super().__init__(get_arg_parser().parse_args([]))
+        self.written = []
+
+    def write_gcode_to_file(self, gcode_line: str):
+        self.written.append(gcode_line)
+
+
+class PrintMoves:
+    def __init__(self, text_lines, bed: dict = None):
+        """Moves and tool changes of a sliced file, for evaluating it at any offset on the bed of read_bed_limits"""
+        bed = bed or read_bed_limits()
+        command, tool, x0, y0, x1, y1 = [], [], [], [], [], []
+        anchored = ([], [], [], [])   # x0, y0, x, y given by the print, not a park position
+        self.z = []                   # Z / F in effect, None before the first one
+        self.f = []
+        self.arcs = {}                # move index -> I / J / R params
+        self.tool_changes = []        # (moves before, tool)
+        active = 0
+        positions = {t: [p[0], p[1], False, False] for t, p in PARK_POSITIONS.items()}
+        z = f = None
+        for line in tokenize_gcode_stream(text_lines):
+            if PP_comment in line.gcode_str:
+                raise ValueError("file is post processed already")
+            if line.type == Commands.TOOLCHANGE:
+                target = line.command[1]
+                if target not in PARK_POSITIONS:
+                    raise ValueError("unknown tool: %s" % line.gcode_str.strip())
+                self.tool_changes.append((len(command), target))
+                if target != active:
+                    positions[active] = [PARK_POSITIONS[active][0], PARK_POSITIONS[active][1], False, False]
+                    active = target
+            elif line.type == Commands.MOVE:
+                position = positions[active]
+                command.append(line.command[1])
+                tool.append(active)
+                x0.append(position[0])
+                y0.append(position[1])
+                anchored[0].append(position[2])
+                anchored[1].append(position[3])
+                if line.get_param('X') is not None:
+                    position[0], position[2] = float(line.get_param('X')), True
+                if line.get_param('Y') is not None:
+                    position[1], position[3] = float(line.get_param('Y')), True
+                x1.append(position[0])
+                y1.append(position[1])
+                anchored[2].append(position[2])
+                anchored[3].append(position[3])
+                z = line.get_param('Z', float, z)
+                f = line.get_param('F', float, f)
+                self.z.append(z)
+                self.f.append(f)
+                if line.command[1] > 1:
+                    self.arcs[len(command) - 1] = {p: float(line.get_param(p)) for p in ARC_PARAMS
+                                                   if line.get_param(p) is not None}
+            elif line.gcode_str.lstrip()[:3].upper() in ('G91', 'G92'):
+                code, params, _ = split_line(line.gcode_str)
+                if code == 'G91' or (code == 'G92' and ('X' in params or 'Y' in params)):
+                    raise ValueError("relative XY moves are not supported: %s" % line.gcode_str.strip())
+        self.count = len(command)
+        self.command, self.tool = command, tool
+        self.x0, self.y0, self.x1, self.y1 = x0, y0, x1, y1
+        self.anchored = anchored
+        self.inactive_x = [PARK_POSITIONS[1 - t][0] for t in tool]
+        xs = [x for x, given in zip(x1, anchored[2]) if given]
+        ys = [y for y, given in zip(y1, anchored[3]) if given]
+        # offsets keeping every given position on the bed
+        self.x_range = (bed['x'][0] - min(xs), bed['x'][1] - max(xs)) if xs else (0.0, 0.0)
+        self.y_range = (bed['y'][0] - min(ys), bed['y'][1] - max(ys)) if ys else (0.0, 0.0)
+        if np is not None:
+            self.command = np.array(command, dtype=np.int8)
+            self.x0, self.y0, self.x1, self.y1 = (np.array(c, dtype=float) for c in (x0, y0, x1, y1))
+            self.anchored = tuple(np.array(c, dtype=bool) for c in anchored)
+            self.inactive_x = np.array(self.inactive_x)
+
+    def get_kept_moves(self, dx: float, dy: float) -> list:
+        """Indices of the moves DuelRunner has to see at offset dx, dy"""
+        if np is None or not self.count:
+            return list(range(self.count))
+        x0 = self.x0 + dx * self.anchored[0]
+        y0 = self.y0 + dy * self.anchored[1]
+        x1 = self.x1 + dx * self.anchored[2]
+        y1 = self.y1 + dy * self.anchored[3]
+        extent_x, extent_y = get_sweep_extents()
+        keep = self.command > 1   # arcs are checked along the arc
+        # the inactive toolhead stays at its park X, at Y_LOW or Y_HIGH
+        for inactive_y in (Y_LOW, Y_HIGH):
+            keep |= segments_touch_boxes(x0, y0, x1, y1, self.inactive_x, inactive_y, extent_x, extent_y)
+            keep |= ((np.abs(x1 - self.inactive_x) <= TOOLHEAD_X_WIDTH + TOLERANCE) &
+                     (np.abs(y1 - inactive_y) <= TOOLHEAD_Y_HEIGHT + TOLERANCE))
+        keep[:-1] |= keep[1:].copy()   # the move in front of a candidate sets its start position
+        for moves_before, _ in self.tool_changes:
+            if moves_before:
+                keep[moves_before - 1] = True
+        return np.flatnonzero(keep).tolist()
+
+    def get_move_line(self, i: int, dx: float, dy: float, with_z: bool, with_f: bool) -> FastGcodeLine:
+        params = {'X': float(self.x1[i] + dx if self.anchored[2][i] else self.x1[i]),
+                  'Y': float(self.y1[i] + dy if self.anchored[3][i] else self.y1[i])}
+        if with_z and self.z[i] is not None:
+            params['Z'] = self.z[i]
+        if with_f and self.f[i] is not None:
+            params['F'] = self.f[i]
+        params.update(self.arcs.get(i, ()))
+        command = int(self.command[i])
+        text = "G%d %s" % (command, " ".join("%s%r" % item for item in params.items()))
+        return FastGcodeLine(('G', command), params, Commands.MOVE, text, '')
+
+    def get_reduced_lines(self, dx: float, dy: float):
+        """Generator of the lines of the reduced stream at offset dx, dy"""
+        changes = iter(self.tool_changes)
+        change = next(changes, None)
+        last_z = last_f = None
+        for i in self.get_kept_moves(dx, dy):
+            while change is not None and change[0] <= i:
+                yield get_tool_line(change[1])
+                change = next(changes, None)
+            # Z and F only where they change, as the input does
+            yield self.get_move_line(i, dx, dy, self.z[i] != last_z, self.f[i] != last_f)
+            last_z, last_f = self.z[i], self.f[i]
+        while change is not None:
+            yield get_tool_line(change[1])
+            change = next(changes, None)
+
+
+def segments_touch_boxes(x0, y0, x1, y1, center_x, center_y, extent_x: float, extent_y: float):
+    """Vectorised check_segment_box of toolhead.py for the boxes reaching extent_x / extent_y from their centers:
+    the bounding boxes overlap and the corners of the box are not all on one side of the segment"""
+    min_x, max_x = center_x - extent_x - TOLERANCE, center_x + extent_x + TOLERANCE
+    min_y, max_y = center_y - extent_y - TOLERANCE, center_y + extent_y + TOLERANCE
+    touch = ((np.minimum(x0, x1) <= max_x) & (min_x <= np.maximum(x0, x1)) &
+             (np.minimum(y0, y1) <= max_y) & (min_y <= np.maximum(y0, y1)))
+    dx, dy = x1 - x0, y1 - y0
+    sides = [dx * (corner_y - y0) - dy * (corner_x - x0) for corner_x in (min_x, max_x) for corner_y in (min_y, max_y)]
+    return touch & (np.minimum.reduce(sides) <= 0) & (np.maximum.reduce(sides) >= 0)
+
+
+def get_tool_line(tool: int) -> FastGcodeLine:
+    return FastGcodeLine(('T', tool), {}, Commands.TOOLCHANGE, "T%d" % tool, '')
+
+
+def estimate_lines(texts: list, state: dict, z: float, limits: dict) -> float:
+    """Estimated time of the G-code texts, from a stop in the DuelRunner state to a stop"""
+    estimator = PrintTimeEstimator(limits)
+    estimator.positions = {0: list(state['left_toolhead_pos']), 1: list(state['right_toolhead_pos'])}
+    estimator.tool = 0 if state['active_instance'] == 'left' else 1
+    estimator.z = z
+    if state['last_feed_rate']:
+        estimator.feed_rate = float(state['last_feed_rate'])
+    for text in texts:
+        estimator.play_line(tokenize_line(text.strip()))
+    estimator.flush()
+    return estimator.total_time
+
+
+def evaluate_offset(moves: PrintMoves, dx: float, dy: float, limits: dict) -> dict:
+    """Metrics of the post processing of the print moved by dx, dy, with the estimated time overhead.
+    None if the post processing fails there."""
+    runner = PlacementRunner()
+    overhead = 0.0
+    lines = 0
+    z = 0.0
+    with redirect_stdout(io.StringIO()):
+        for line in moves.get_reduced_lines(dx, dy):
+            lines += 1
+            runner.written = []
+            state = runner.get_state()
+            try:
+                runner.play_gcode_line(line)
+            except ZeroDivisionError:
+                return None
+            if len(runner.written) > 1:
+                # inserted sequences, timed against the input line alone
+                overhead += estimate_lines(runner.written, state, z, limits)
+                overhead -= estimate_lines([line.gcode_str], state, z, limits)
+            z = line.params.get('Z', z)
+    result = {'dx': dx, 'dy': dy, 'lines': lines}
+    result.update(runner.get_metrics())
+    result['shuffles'] = sum(value for key, value in result.items() if 'shuffles' in key)
+    result['overhead'] = overhead
+    return result
+
+
+def get_offsets(moves: PrintMoves, step: float, max_offset: float = None) -> list:
+    """Grid of the offsets in steps of step keeping the print on the bed, (0, 0) included. Off the bed as sliced,
+    the offsets towards the bed up to (0, 0)."""
+    def axis(low, high):
+        low, high = min(low, 0.0), max(high, 0.0)
+        if max_offset is not None:
+            low, high = max(low, -max_offset), min(high, max_offset)
+        return [k * step for k in range(math.ceil(low / step - 1e-9), math.floor(high / step + 1e-9) + 1)]
+    return [(dx, dy) for dx in axis(*moves.x_range) for dy in axis(*moves.y_range)]
+
+
+def get_sort_key(result: dict) -> tuple:
+    return round(result['overhead'], 1), result['shuffles'], math.hypot(result['dx'], result['dy'])
+
+
+def advise_placement(text_lines, step: float = DEFAULT_STEP, max_offset: float = None, limits: dict = None,
+                     bed: dict = None) -> tuple:
+    """Return the results of the offsets of the grid, the recommended placement first, the offsets where the post
+    processing fails and the result of the print as sliced, None if it fails"""
+    moves = PrintMoves(text_lines, bed)
+    limits = limits or read_printer_limits()
+    results, failed = [], []
+    for dx, dy in get_offsets(moves, step, max_offset):
+        result = evaluate_offset(moves, dx, dy, limits)
+        if result is None:
+            failed.append((dx, dy))
+        else:
+            results.append(result)
+    as_sliced = next((result for result in results if result['dx'] == 0 and result['dy'] == 0), None)
+    if as_sliced is None and (0.0, 0.0) not in failed:
+        as_sliced = evaluate_offset(moves, 0.0, 0.0, limits)
+    return sorted(results, key=get_sort_key), failed, as_sliced
+
+
+def format_result(result: dict) -> str:
+    return "%+7.1f %+7.1f %8d %7d %7d %9d %6d %9.1f" % (
+        result['dx'], result['dy'], result['shuffles'],
+        result['simple_shuffles_t0'] + result['simple_shuffles_t1'],
+        result['backup_shuffles_t0'] + result['backup_shuffles_t1'],
+        result['segmented_shuffles_t0'] + result['segmented_shuffles_t1'],
+        result['park_moves_t0'] + result['park_moves_t1'], result['overhead'])
+
+
+def print_placement_report(gcode_file: str, results: list, failed: list, as_sliced: dict, top: int, elapsed: float):
+    print("%s: %d offsets evaluated in %.1f s" % (gcode_file, len(results) + len(failed), elapsed))
+    if failed:
+        print("post processing fails at %d offsets: %s" % (
+            len(failed), ", ".join("X%+.1f Y%+.1f" % offset for offset in failed[:top]) +
+            (", ..." if len(failed) > top else "")))
+    print("%7s %7s %8s %7s %7s %9s %6s %9s" % ("dx", "dy", "shuffles", "simple", "backup", "segmented", "parks",
+                                               "overhead"))
+    for result in results[:top]:
+        print(format_result(result))
+    if as_sliced is not None and as_sliced not in results[:top]:
+        print(format_result(as_sliced) + "  as sliced")
+    if not results:
+        print("the post processing fails at every offset")
+        return
+    best = results[0]
+    print("recommended: move the print by X%+.1f Y%+.1f, %d shuffles" % (best['dx'], best['dy'], best['shuffles']),
+          end='')
+    if as_sliced is not None:
+        print(" instead of %d, %.1f s less overhead" % (as_sliced['shuffles'],
+                                                        as_sliced['overhead'] - best['overhead']), end='')
+    print()
+
+
+def get_placement_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Recommend where to place the print on the bed, by the shuffles "
+                                                 "and time overhead of the post processing.")
+    parser.add_argument('--step', help="Grid step of the offsets in mm, default: %s" % DEFAULT_STEP,
+                        type=float, default=DEFAULT_STEP)
+    parser.add_argument('--max-offset', help="Largest offset in X and Y to evaluate in mm, default: as far as the "
+                                             "print stays on the bed", type=float, default=None)
+    parser.add_argument('--top', help="Number of placements to list, default: %s" % DEFAULT_TOP,
+                        type=int, default=DEFAULT_TOP)
+    parser.add_argument('--printer-cfg', help="Klipper config with the [printer] limits and the X and Y ranges of "
+                                              "the bed", default=PRINTER_CFG)
+    parser.add_argument('--sweep-margin-x', help="Margin in X for the collision checks of moves",
+                        type=float, default=0.0)
+    parser.add_argument('--sweep-margin-y', help="Margin in Y for the collision checks of moves",
+                        type=float, default=0.0)
+    parser.add_argument('gcodefile', help="Sliced G-code file, not post processed")
+    return parser
+
+
+def main(passed_args) -> int:
+    if passed_args.step <= 0:
+        print("--step must be positive")
+        return 1
+    set_collision_backend('analytic')
+    set_sweep_margins(passed_args.sweep_margin_x, passed_args.sweep_margin_y)
+    start = time.perf_counter()
+    try:
+        with open(passed_args.gcodefile, 'r') as f_in:
+            results, failed, as_sliced = advise_placement(f_in, passed_args.step, passed_args.max_offset,
+                                                          read_printer_limits(passed_args.printer_cfg),
+                                                          read_bed_limits(passed_args.printer_cfg))
+    except ValueError as e:
+        print("%s: %s" % (passed_args.gcodefile, e))
+        return 1
+    print_placement_report(passed_args.gcodefile, results, failed, as_sliced, passed_args.top,
+                           time.perf_counter() - start)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(get_placement_arg_parser().parse_args()))
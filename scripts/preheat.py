@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# Preheat ahead of tool changes (--preheat).
+# PRINT_START heats both toolheads and leaves them hot. With --preheat the outgoing toolhead of a tool change is set
+# to an idle temperature (M104 after the tool change) and heated back to its print temperature ahead of the next
+# tool change to it, where the estimated print time left before that tool change matches the warm-up time of the
+# heater. Tool changes do not wait for heating then.
+#
+# The writer holds back the output lines of the last warm-up time, the heat-up M104 is inserted among them once the
+# tool change shows up. Tool changes of the input are the tool selections not inserted by the post processing.
+# Move times are estimated at their feed rate, limited by max_velocity / max_z_velocity of printer.cfg, without
+# acceleration and arcs by their chord: the time left is underestimated, the heater starts early rather than late.
+# A tool is idled only once its print temperature is known, from M104 / M109 or EXT_TEMP of PRINT_START. If it is
+# needed again within the warm-up time, its idle M104 is dropped instead. A temperature set by the input for an idle
+# tool takes over, the tool is not heated back then.
+# Lines inserted by an earlier run are dropped and inserted again, reprocessing does not change the output.
+
+import math
+from collections import deque
+
+from gcode_tokenizer import PP_comment
+from peephole import split_line, is_tool, is_inserted_tool, format_number
+from print_time import read_printer_limits
+from toolhead import LEFT_PARK_POS, RIGHT_PARK_POS, IDLE_TEMP, HEATER_WARMUP_TIME
+
+IDLE_COMMENT = PP_comment + " idle"
+PREHEAT_COMMENT = PP_comment + " preheat"
+TEMPERATURE_CODES = ('M104', 'M109')
+MOTION_CODES = ('G0', 'G1', 'G2', 'G3')
+START_MACROS = ('PRINT_START', 'START_PRINT')
+START_TEMP_PARAM = 'EXT_TEMP='
+
+
+class PreheatWriter:
+    def __init__(self, output, idle_temp: float = IDLE_TEMP, warmup_time: float = HEATER_WARMUP_TIME,
+                 limits: dict = None):
+        """Writer for text file output, holding back the lines of the last warmup_time seconds. finish writes the
+        rest."""
+        self.output = output
+        self.idle_temp: float = idle_temp
+        self.warmup_time: float = warmup_time
+        limits = limits or read_printer_limits()
+        self.max_velocity: float = limits['max_velocity']
+        self.max_z_velocity: float = limits['max_z_velocity']
+        self.lines: deque = deque()   # [estimated time at the start of the line, line, tool idled by the line]
+        self.time: float = 0.0
+        # state after the held back lines
+        self.positions = {0: [LEFT_PARK_POS.x, LEFT_PARK_POS.y], 1: [RIGHT_PARK_POS.x, RIGHT_PARK_POS.y]}
+        self.z: float = 0.0
+        self.e: float = 0.0
+        self.feed_rate: float = 1500.0   # mm/min
+        self.relative: bool = False
+        self.relative_e: bool = False
+        self.tool: int = 0         # selected toolhead, inserted activations included
+        self.print_tool: int = 0   # tool of the last tool change of the input
+        self.print_temps = {}      # tool -> print temperature
+        self.idle = {}             # idle tool -> its held back idle line, None once written
+        self.counts = {'idle': 0, 'preheat': 0, 'dropped_idle': 0}
+
+    def write(self, text: str):
+        for line in text.splitlines():
+            self.add_line(line)
+
+    def finish(self):
+        """Write all held back lines"""
+        while self.lines:
+            self.write_next()
+
+    def write_next(self):
+        entry = self.lines.popleft()
+        if entry[2] is not None and self.idle.get(entry[2]) is entry:
+            self.idle[entry[2]] = None
+        self.output.write(entry[1] + "\n")
+
+    def hold(self, line: str, idled_tool: int = None) -> list:
+        entry = [self.time, line, idled_tool]
+        self.lines.append(entry)
+        return entry
+
+    def add_line(self, line: str):
+        code, params, comment = split_line(line)
+        if code in TEMPERATURE_CODES and comment.startswith((IDLE_COMMENT, PREHEAT_COMMENT)):
+            return   # inserted by an earlier run, inserted again below
+        start_time = self.time
+        if is_tool(code):
+            tool = int(code[1:])
+            if not is_inserted_tool(code, comment) and tool != self.print_tool and tool in self.positions:
+                self.change_tool(tool, line)
+                return
+            self.tool = tool if tool in self.positions else self.tool
+        elif code in TEMPERATURE_CODES:
+            self.track_temperature(params)
+        elif code in START_MACROS:
+            for word in line.split(';', 1)[0].split():
+                if word.upper().startswith(START_TEMP_PARAM):
+                    self.print_temps = {tool: float(word[len(START_TEMP_PARAM):]) for tool in self.positions}
+        elif code in MOTION_CODES:
+            self.time += self.get_move_time(params)
+        elif code == 'G4':
+            self.time += float(params.get('P', 0)) / 1000.0 + float(params.get('S', 0))
+        elif code in ('G90', 'G91'):
+            self.relative = code == 'G91'
+        elif code in ('M82', 'M83'):
+            self.relative_e = code == 'M83'
+        elif code == 'G92':
+            self.set_position(params)
+        self.lines.append([start_time, line, None])
+        while len(self.lines) > 1 and self.lines[1][0] <= self.time - self.warmup_time:
+            self.write_next()
+
+    def change_tool(self, tool: int, line: str):
+        """Tool change of the input: heat the incoming tool back, write everything held back and idle the outgoing
+        tool"""
+        if tool in self.idle:
+            entry = self.idle.pop(tool)
+            if entry is not None:
+                # needed again within the warm-up time, it is not idled at all
+                self.lines.remove(entry)
+                self.counts['idle'] -= 1
+                self.counts['dropped_idle'] += 1
+            else:
+                # in front of the last line starting the warm-up time or more before now, the first one if none does
+                i = 0
+                while i + 1 < len(self.lines) and self.lines[i + 1][0] <= self.time - self.warmup_time:
+                    i += 1
+                preheat = "M104 S%s T%d ; %s" % (format_number(self.print_temps[tool]), tool, PREHEAT_COMMENT)
+                self.lines.insert(i, [self.lines[i][0] if i < len(self.lines) else self.time, preheat, None])
+                self.counts['preheat'] += 1
+        outgoing = self.print_tool
+        self.print_tool = self.tool = tool
+        while self.lines:
+            self.write_next()
+        self.output.write(line + "\n")
+        temp = self.print_temps.get(outgoing)
+        if temp is not None and self.idle_temp < temp:
+            idle = "M104 S%s T%d ; %s" % (format_number(self.idle_temp), outgoing, IDLE_COMMENT)
+            self.idle[outgoing] = self.hold(idle, outgoing)
+            self.counts['idle'] += 1
+
+    def track_temperature(self, params: dict):
+        if 'S' not in params:
+            return
+        tool = int(params['T']) if params.get('T', '').isdigit() else self.print_tool
+        if tool not in self.idle:
+            self.print_temps[tool] = float(params['S'])
+            return
+        # the input takes care of the idle tool
+        entry = self.idle.pop(tool)
+        if entry is not None:
+            self.lines.remove(entry)
+            self.counts['idle'] -= 1
+
+    def get_move_time(self, params: dict) -> float:
+        position = self.positions[self.tool]
+        if 'F' in params:
+            self.feed_rate = float(params['F'])
+        offset = 1.0 if self.relative else 0.0
+        new_x = float(params['X']) + position[0] * offset if 'X' in params else position[0]
+        new_y = float(params['Y']) + position[1] * offset if 'Y' in params else position[1]
+        new_z = float(params['Z']) + self.z * offset if 'Z' in params else self.z
+        de = 0.0
+        if 'E' in params:
+            de = float(params['E']) if self.relative_e or self.relative else float(params['E']) - self.e
+            self.e += de
+        dx, dy, dz = new_x - position[0], new_y - position[1], new_z - self.z
+        position[0], position[1], self.z = new_x, new_y, new_z
+        distance = math.sqrt(dx * dx + dy * dy + dz * dz) or abs(de)
+        velocity = min(self.feed_rate / 60.0, self.max_velocity)
+        if dz:
+            velocity = min(velocity, self.max_z_velocity * distance / abs(dz))
+        return distance / velocity if velocity > 0 else 0.0
+
+    def set_position(self, params: dict):
+        position = self.positions[self.tool]
+        if 'X' in params:
+            position[0] = float(params['X'])
+        if 'Y' in params:
+            position[1] = float(params['Y'])
+        if 'Z' in params:
+            self.z = float(params['Z'])
+        if 'E' in params:
+            self.e = float(params['E'])
@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+# Print time estimator, to tell what the inserted parks, shuffles, backoffs, Z-lifts and split moves cost.
+# The input and the post processed output are estimated with the same trapezoidal motion model, the difference
+# is the time overhead of the post processing, also per layer (split at ;LAYER_CHANGE).
+#
+# The motion model follows Klipper: every move accelerates and decelerates with max_accel (or M204) up to its
+# feed rate limited by max_velocity, moves with Z are limited by max_z_velocity/max_z_accel, and the speed at the
+# junction of two moves is limited by square_corner_velocity. Arcs (G2/G3) are timed by their length. Tool changes,
+# extrude only moves and the end of the file are full stops. Limits are read from the [printer] section of
+# printer.cfg, its [include] files followed.
+# Both toolheads are followed separately, every tool starts at its park position from toolhead.py.
+# Heating, dwell and macro times are not included.
+#
+# Sample invocations:
+#   ./print_time.py sample.gcode
+#       estimates sample.gcode and the output of post processing it
+#   ./print_time.py --output sample_d0_ready.gcode --worst 10 sample.gcode
+
+import argparse
+import glob
+import io
+import math
+import os
+import sys
+import tempfile
+from contextlib import redirect_stdout
+
+from gcodeparser.commands import Commands
+
+from arc import get_arc
+from gcode_tokenizer import tokenize_gcode_stream
+from point import Point
+from toolhead import LEFT_PARK_POS, RIGHT_PARK_POS, X_WIDTH, Y_HEIGHT
+
+PRINTER_CFG = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "config_USB", "config", "printer.cfg")
+# Klipper defaults, used for limits missing in printer.cfg
+DEFAULT_LIMITS = {'max_velocity': 300.0, 'max_accel': 3000.0, 'max_z_velocity': 5.0, 'max_z_accel': 100.0,
+                  'square_corner_velocity': 5.0}
+# bed size of toolhead.py, used for axis ranges missing in printer.cfg
+DEFAULT_BED = {'x': (0.0, X_WIDTH), 'y': (0.0, Y_HEIGHT)}
+DEFAULT_WORST_LAYERS = 5
+
+
+def iter_config_options(path: str):
+    """Generator of (section, key, value) of the options of a Klipper config, [include] files read in place,
+    relative to the including file"""
+    section = None
+    with open(path, 'r') as f:
+        for text_line in f:
+            text = text_line.split('#', 1)[0].strip()
+            if text.startswith('[') and text.endswith(']'):
+                section = text[1:-1].strip()
+                if section.startswith('include '):
+                    pattern = os.path.join(os.path.dirname(path), section[len('include '):].strip())
+                    for include_path in sorted(glob.glob(pattern)):
+                        yield from iter_config_options(include_path)
+                    section = None
+            elif section is not None and ':' in text and not text_line[0].isspace():
+                key, _, value = text.partition(':')
+                yield section, key.strip(), value.strip()
+
+
+def read_printer_limits(path: str = PRINTER_CFG) -> dict:
+    """Read the motion limits of the [printer] section of a Klipper config, defaults for missing ones"""
+    limits = dict(DEFAULT_LIMITS)
+    if not os.path.exists(path):
+        return limits
+    for section, key, value in iter_config_options(path):
+        if section == 'printer' and key in limits:
+            limits[key] = float(value)
+    return limits
+
+
+def read_bed_limits(path: str = PRINTER_CFG) -> dict:
+    """Read the ranges of X and Y, position_min / position_max of [stepper_x] and [stepper_y] of a Klipper config,
+    {'x': (min, max), 'y': (min, max)}, defaults for missing ones"""
+    bed = {axis: list(limits) for axis, limits in DEFAULT_BED.items()}
+    if not os.path.exists(path):
+        return DEFAULT_BED
+    for section, key, value in iter_config_options(path):
+        if section in ('stepper_x', 'stepper_y') and key in ('position_min', 'position_max'):
+            bed[section[-1]][key == 'position_max'] = float(value)
+    return {axis: tuple(limits) for axis, limits in bed.items()}
+
+
+def _split_words(text: str) -> dict:
+    """Parameters of a command line like 'G92 E0' or 'M204 S2000' as floats"""
+    params = {}
+    for word in text.split(';', 1)[0].split()[1:]:
+        try:
+            params[word[0].upper()] = float(word[1:])
+        except ValueError:
+            pass
+    return params
+
+
+class Move:
+    __slots__ = ('distance', 'accel', 'max_cruise_v2', 'max_start_v2', 'junction_deviation', 'unit', 'layer')
+
+    def __init__(self, distance, accel, max_cruise_v2, junction_deviation, unit, layer):
+        self.distance = distance
+        self.accel = accel
+        self.max_cruise_v2 = max_cruise_v2
+        self.max_start_v2 = 0.0
+        self.junction_deviation = junction_deviation
+        self.unit = unit
+        self.layer = layer
+
+    def calc_junction(self, prev):
+        """Limit the start speed by the junction with the previous move, as Klipper does"""
+        cos_theta = -(self.unit[0] * prev.unit[0] + self.unit[1] * prev.unit[1] + self.unit[2] * prev.unit[2])
+        if cos_theta > 0.999999:
+            return  # reversal, full stop
+        cos_theta = max(cos_theta, -0.999999)
+        sin_theta_d2 = math.sqrt(0.5 * (1.0 - cos_theta))
+        r_jd = sin_theta_d2 / (1.0 - sin_theta_d2)
+        tan_theta_d2 = sin_theta_d2 / math.sqrt(0.5 * (1.0 + cos_theta))
+        self.max_start_v2 = min(r_jd * self.junction_deviation * self.accel,
+                                r_jd * prev.junction_deviation * prev.accel,
+                                0.5 * self.distance * tan_theta_d2 * self.accel,
+                                0.5 * prev.distance * tan_theta_d2 * prev.accel,
+                                self.max_cruise_v2, prev.max_cruise_v2,
+                                prev.max_start_v2 + 2.0 * prev.accel * prev.distance)
+
+
+def trapezoid_time(distance: float, accel: float, start_v2: float, cruise_v2: float, end_v2: float) -> float:
+    """Time of a move accelerating from start to at most cruise speed and decelerating to end speed"""
+    peak_v2 = min(cruise_v2, (start_v2 + end_v2) / 2.0 + accel * distance)
+    accel_d = (peak_v2 - start_v2) / (2.0 * accel)
+    decel_d = (peak_v2 - end_v2) / (2.0 * accel)
+    cruise_d = max(0.0, distance - accel_d - decel_d)
+    peak_v = math.sqrt(peak_v2)
+    return ((peak_v - math.sqrt(start_v2)) + (peak_v - math.sqrt(end_v2))) / accel + cruise_d / peak_v
+
+
+class PrintTimeEstimator:
+    def __init__(self, limits: dict = None):
+        self.limits = limits or read_printer_limits()
+        self.max_velocity = self.limits['max_velocity']
+        self.accel = self.limits['max_accel']
+        self.max_z_velocity = self.limits['max_z_velocity']
+        self.max_z_accel = self.limits['max_z_accel']
+        self.square_corner_velocity = self.limits['square_corner_velocity']
+        self.positions = {0: [LEFT_PARK_POS.x, LEFT_PARK_POS.y], 1: [RIGHT_PARK_POS.x, RIGHT_PARK_POS.y]}
+        self.extruders = {0: 0.0, 1: 0.0}
+        self.tool = 0
+        self.z = 0.0
+        self.feed_rate = 1500.0   # mm/min
+        self.relative = False
+        self.relative_e = False
+        self.layer = 0
+        self.layer_times = [0.0]
+        self.pending = []   # moves waiting for the lookahead, between full stops
+
+    @property
+    def total_time(self) -> float:
+        return sum(self.layer_times)
+
+    def flush(self):
+        """Full stop: plan and time the pending moves"""
+        moves = self.pending
+        if not moves:
+            return
+        # backward pass, the speed at the end of the last move is zero
+        next_start_v2 = 0.0
+        start_v2 = [0.0] * len(moves)
+        for i in range(len(moves) - 1, -1, -1):
+            move = moves[i]
+            start_v2[i] = min(move.max_start_v2, next_start_v2 + 2.0 * move.accel * move.distance)
+            next_start_v2 = start_v2[i]
+        # forward pass
+        reachable_v2 = 0.0
+        for i, move in enumerate(moves):
+            v2 = min(start_v2[i], reachable_v2)
+            start_v2[i] = v2
+            reachable_v2 = v2 + 2.0 * move.accel * move.distance
+        for i, move in enumerate(moves):
+            end_v2 = min(start_v2[i + 1], move.max_cruise_v2) if i + 1 < len(moves) else 0.0
+            move_time = trapezoid_time(move.distance, move.accel, start_v2[i], move.max_cruise_v2, end_v2)
+            self.layer_times[move.layer] += move_time
+        self.pending = []
+
+    def add_move(self, dx: float, dy: float, dz: float, de: float, full_stop: bool, xy_length: float = None):
+        """xy_length is the length of an arc in XY, its chord dx/dy gives the direction at the junctions"""
+        if xy_length is None:
+            distance = math.sqrt(dx * dx + dy * dy + dz * dz)
+        else:
+            distance = math.sqrt(xy_length * xy_length + dz * dz)
+        if distance < 1e-9:
+            distance = abs(de)   # extrude only move
+            if distance < 1e-9:
+                return
+            unit = (0.0, 0.0, 0.0)
+            full_stop = True
+        else:
+            unit = (dx / distance, dy / distance, dz / distance)
+        velocity = min(self.feed_rate / 60.0, self.max_velocity)
+        accel = self.accel
+        if dz:
+            z_ratio = distance / abs(dz)
+            velocity = min(velocity, self.max_z_velocity * z_ratio)
+            accel = min(accel, self.max_z_accel * z_ratio)
+        junction_deviation = self.square_corner_velocity ** 2 * (math.sqrt(2.0) - 1.0) / accel
+        move = Move(distance, accel, velocity * velocity, junction_deviation, unit, self.layer)
+        if full_stop:
+            self.flush()
+        elif self.pending:
+            move.calc_junction(self.pending[-1])
+        self.pending.append(move)
+        if full_stop:
+            self.flush()
+
+    def play_move(self, line):
+        position = self.positions[self.tool]
+        x = line.get_param('X')
+        y = line.get_param('Y')
+        z = line.get_param('Z')
+        e = line.get_param('E')
+        f = line.get_param('F')
+        if f is not None and f is not True:
+            self.feed_rate = float(f)
+        new_x, new_y, new_z = position[0], position[1], self.z
+        if self.relative:
+            new_x += float(x) if x is not None else 0.0
+            new_y += float(y) if y is not None else 0.0
+            new_z += float(z) if z is not None else 0.0
+        else:
+            new_x = float(x) if x is not None else new_x
+            new_y = float(y) if y is not None else new_y
+            new_z = float(z) if z is not None else new_z
+        de = 0.0
+        if e is not None:
+            de = float(e) if self.relative_e or self.relative else float(e) - self.extruders[self.tool]
+            self.extruders[self.tool] += de
+        xy_length = None
+        if line.command[1] in (2, 3):
+            arc = get_arc(Point(position[0], position[1]), Point(new_x, new_y), line)
+            xy_length = arc.length if arc is not None else None
+        self.add_move(new_x - position[0], new_y - position[1], new_z - self.z, de, False, xy_length)
+        position[0], position[1], self.z = new_x, new_y, new_z
+
+    def play_other(self, line):
+        text = line.gcode_str.lstrip()
+        command = line.command
+        if command is None and text[:1] in ('M', 'm'):
+            words = text.split(';', 1)[0].split()
+            command = ('M', words[0][1:]) if words else None
+        if command == ('G', 90):
+            self.relative = False
+        elif command == ('G', 91):
+            self.relative = True
+        elif command == ('G', 92):
+            params = _split_words(text)
+            position = self.positions[self.tool]
+            position[0] = params.get('X', position[0])
+            position[1] = params.get('Y', position[1])
+            self.z = params.get('Z', self.z)
+            self.extruders[self.tool] = params.get('E', self.extruders[self.tool])
+        elif command == ('M', '82'):
+            self.relative_e = False
+        elif command == ('M', '83'):
+            self.relative_e = True
+        elif command == ('M', '204'):
+            params = _split_words(text)
+            accel = params.get('S', params.get('P'))
+            if accel:
+                self.flush()
+                self.accel = accel
+
+    def play_line(self, line):
+        line_type = line.type
+        if line_type == Commands.MOVE:
+            self.play_move(line)
+        elif line_type == Commands.TOOLCHANGE:
+            self.flush()
+            if line.command[1] in self.positions:
+                self.tool = line.command[1]
+        elif line_type == Commands.COMMENT:
+            if line.gcode_str.startswith(';LAYER_CHANGE'):
+                self.layer += 1
+                self.layer_times.append(0.0)
+        else:
+            self.play_other(line)
+
+    def play_lines(self, lines):
+        for line in lines:
+            self.play_line(line)
+        self.flush()
+
+
+def estimate_file(gcode_file: str, limits: dict = None) -> PrintTimeEstimator:
+    estimator = PrintTimeEstimator(limits)
+    with open(gcode_file, 'r') as f:
+        estimator.play_lines(tokenize_gcode_stream(f))
+    return estimator
+
+
+def get_overhead_report(input_estimate: PrintTimeEstimator, output_estimate: PrintTimeEstimator,
+                        worst: int = DEFAULT_WORST_LAYERS) -> dict:
+    """Compare the estimates of the input and the post processed output"""
+    input_time = input_estimate.total_time
+    output_time = output_estimate.total_time
+    layers = []
+    for layer, (t_in, t_out) in enumerate(zip(input_estimate.layer_times, output_estimate.layer_times)):
+        layers.append({'layer': layer, 'input_time': t_in, 'output_time': t_out, 'overhead': t_out - t_in})
+    worst_layers = sorted(layers, key=lambda l: l['overhead'], reverse=True)[:worst]
+    return {'input_time': input_time, 'output_time': output_time, 'overhead': output_time - input_time,
+            'overhead_percent': (output_time - input_time) / input_time * 100 if input_time else 0.0,
+            'layers_matched': len(input_estimate.layer_times) == len(output_estimate.layer_times),
+            'worst_layers': worst_layers}
+
+
+def format_duration(seconds: float) -> str:
+    hours, rest = divmod(int(round(seconds)), 3600)
+    minutes, secs = divmod(rest, 60)
+    return "%d:%02d:%02d" % (hours, minutes, secs)
+
+
+def print_report(report: dict):
+    print("Estimated print time input:  %s (%.1fs)" % (format_duration(report['input_time']), report['input_time']))
+    print("Estimated print time output: %s (%.1fs)" % (format_duration(report['output_time']), report['output_time']))
+    print("Post processing overhead:    %.1fs (%+.2f%%)" % (report['overhead'], report['overhead_percent']))
+    if not report['layers_matched']:
+        print("Warning: layer counts of input and output differ, per layer overhead is not reliable")
+    print("%-8s %10s %10s %10s" % ("layer", "input/s", "output/s", "overhead/s"))
+    for layer in report['worst_layers']:
+        print("%-8d %10.1f %10.1f %10.1f" % (layer['layer'], layer['input_time'], layer['output_time'],
+                                             layer['overhead']))
+
+
+def estimate_post_processed(gcode_file: str, limits: dict = None) -> PrintTimeEstimator:
+    """Post process gcode_file into a temporary file and estimate that"""
+    from duelingzero_postprocessing import DuelRunner, get_arg_parser
+    fd, tmp_path = tempfile.mkstemp(suffix=".gcode")
+    os.close(fd)
+    try:
+        dr = DuelRunner(get_arg_parser().parse_args([]))
+        with redirect_stdout(io.StringIO()):
+            dr.play_file(gcode_file, tmp_path)
+        return estimate_file(tmp_path, limits)
+    finally:
+        os.unlink(tmp_path)
+
+
+def get_print_time_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Estimate the print time overhead of the post processing.")
+    parser.add_argument('--output', help="Post processed output of the input, default: post process the input now")
+    parser.add_argument('--printer-cfg', help="Klipper config with the [printer] limits", default=PRINTER_CFG)
+    parser.add_argument('--worst', help="Number of worst layers to list", type=int, default=DEFAULT_WORST_LAYERS)
+    parser.add_argument('gcodefile', help="Input gcode file, as given to the post processing")
+    return parser
+
+
+if __name__ == "__main__":
+    args = get_print_time_arg_parser().parse_args()
+    printer_limits = read_printer_limits(args.printer_cfg)
+    input_estimator = estimate_file(args.gcodefile, printer_limits)
+    if args.output:
+        output_estimator = estimate_file(args.output, printer_limits)
+    else:
+        output_estimator = estimate_post_processed(args.gcodefile, printer_limits)
+    print_report(get_overhead_report(input_estimator, output_estimator, args.worst))
+    sys.exit(0)
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# Leveled, structured log of a post processing run (--log, --log-level) and the flight recorder.
+# Every event is one JSON object per line: seconds since the start, level, event name, the file being processed
+# and the fields of the event. Positions are written as [x, y]. Levels are error, warning, info (start and end of
+# a file, summaries), debug (inserted sequences, parks, overlaps, --verbose) and trace (the toolhead positions at
+# every input line). DuelRunner checks the level once per line, tracing costs nothing while it is disabled.
+#
+# The flight recorder keeps the toolhead positions at the last input lines in a ring buffer, whatever the level.
+# It is written only if processing stops at an unsafe line or on an error, to the log or to stderr without one.
+
+import json
+import sys
+import time
+from collections import deque
+
+LEVELS = {'error': 40, 'warning': 30, 'info': 20, 'debug': 10, 'trace': 5}
+DEFAULT_LEVEL = 'info'
+DEFAULT_RECORDER_SIZE = 64
+
+
+def to_json(value):
+    """Positions as [x, y], everything else unknown to json as text"""
+    if hasattr(value, 'x') and hasattr(value, 'y'):
+        return [value.x, value.y]
+    return str(value)
+
+
+class RunLog:
+    def __init__(self, output=None, level: str = DEFAULT_LEVEL, recorder_size: int = DEFAULT_RECORDER_SIZE):
+        """Log writing to the open text file output, nothing is logged without. recorder_size 0 disables the flight
+        recorder."""
+        self.output = output
+        self.console: bool = False   # output is stdout for --verbose
+        self.level: int = LEVELS[level]
+        self.requested: str = level  # level without --verbose
+        self.verbose: bool = False
+        self.tracing: bool = False
+        self.debugging: bool = False
+        self.set_level(level)
+        # (line number, line, left toolhead position, right toolhead position, active instance)
+        self.recorder = deque(maxlen=recorder_size) if recorder_size > 0 else None
+        self.context: dict = {}      # fields added to every event, i.e. the file being processed
+        self.start: float = time.perf_counter()
+
+    @classmethod
+    def open(cls, path: str, level: str = DEFAULT_LEVEL, recorder_size: int = DEFAULT_RECORDER_SIZE):
+        """Log appending to path, line buffered: lines of worker processes sharing the file are not mixed up"""
+        return cls(open(path, 'a', buffering=1), level, recorder_size)
+
+    def set_level(self, level: str):
+        self.requested = level
+        self.update_level()
+
+    def set_verbose(self, verbose: bool):
+        """--verbose: at least debug events, to stdout if there is no log file"""
+        self.verbose = verbose
+        if verbose and self.output is None:
+            self.output = sys.stdout
+            self.console = True
+        elif not verbose and self.console:
+            self.output = None
+            self.console = False
+        self.update_level()
+
+    def update_level(self):
+        self.level = LEVELS[self.requested]
+        if self.verbose:
+            self.level = min(self.level, LEVELS['debug'])
+        self.tracing = self.output is not None and self.level <= LEVELS['trace']
+        self.debugging = self.output is not None and self.level <= LEVELS['debug']
+
+    def get_level(self) -> str:
+        return next(name for name, value in LEVELS.items() if value == self.level)
+
+    def is_enabled(self, level: str) -> bool:
+        return self.output is not None and LEVELS[level] >= self.level
+
+    def write(self, level: str, event: str, fields: dict, output=None):
+        record = {'time': round(time.perf_counter() - self.start, 6), 'level': level, 'event': event}
+        record.update(self.context)
+        record.update(fields)
+        (output or self.output).write(json.dumps(record, default=to_json) + "\n")
+
+    def log(self, level: str, event: str, **fields):
+        if self.is_enabled(level):
+            self.write(level, event, fields)
+
+    def error(self, event: str, **fields):
+        self.log('error', event, **fields)
+
+    def warning(self, event: str, **fields):
+        self.log('warning', event, **fields)
+
+    def info(self, event: str, **fields):
+        self.log('info', event, **fields)
+
+    def debug(self, event: str, **fields):
+        self.log('debug', event, **fields)
+
+    def trace(self, event: str, **fields):
+        self.log('trace', event, **fields)
+
+    def dump(self, event: str, **fields):
+        """Write the flight recorder, oldest line first, and clear it"""
+        if self.recorder is None:
+            return
+        output = self.output if self.output is not None else sys.stderr
+        self.write('error', event, fields, output)
+        for line_no, line, left_pos, right_pos, active_instance in self.recorder:
+            self.write('error', 'flight_recorder', {'line_no': line_no, 'line': line.gcode_str.strip(),
+                                                    't0': left_pos, 't1': right_pos, 'active': active_instance},
+                       output)
+        output.flush()
+        self.recorder.clear()
+
+    def close(self):
+        if self.output is not None and not self.console:
+            self.output.close()
+        self.output = None
+        self.console = False
+        self.update_level()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# Statistics of a post processing run, written as JSON report by --stats.
+# The DuelRunner counters are broken down per layer (split at ;LAYER_CHANGE), and the wall time of the run is
+# split into phases: parse is the time spent getting the next tokenized line (including reading the input),
+# emit the time spent formatting and writing output lines, collision all the rest (collision checks, shuffle
+# decisions and bookkeeping).
+# With --zero-copy only moves, tool changes and layer changes are tokenized, so only these count as processed lines.
+
+import json
+import os
+import time
+
+LINE_COUNT_CHUNK = 1 << 20
+
+
+def count_lines(path: str) -> int:
+    """Number of lines of a file, a last line without line ending counts as well"""
+    count = 0
+    last = b'\n'
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(LINE_COUNT_CHUNK)
+            if not chunk:
+                break
+            count += chunk.count(b'\n')
+            last = chunk[-1:]
+    return count if last == b'\n' else count + 1
+
+
+class RunStats:
+    def __init__(self):
+        self.lines: int = 0          # lines processed, counted by DuelRunner
+        self.parse_time: float = 0.0
+        self.emit_time: float = 0.0
+        self.wall_time: float = 0.0
+        self.emitting: bool = False  # inside a timed emit call, nested calls are not timed again
+        self.layers: list = []
+        self.layer_start_lines: int = 0
+        self.layer_start_metrics: dict = {}
+        self.files: dict = {}
+        self.totals: dict = {}
+        self.start: float = 0.0
+
+    def attach(self, dr):
+        """Time the output methods of DuelRunner dr as emit phase"""
+        dr.write_gcode_to_file = self.timed_emit(dr.write_gcode_to_file)
+        dr.write_line = self.timed_emit(dr.write_line)
+
+    def timed_emit(self, func):
+        def timed(*args):
+            if self.emitting:
+                return func(*args)
+            self.emitting = True
+            start = time.perf_counter()
+            try:
+                return func(*args)
+            finally:
+                self.emit_time += time.perf_counter() - start
+                self.emitting = False
+        return timed
+
+    def timed_lines(self, lines):
+        """Generator passing through lines, timing how long getting each one takes"""
+        iterator = iter(lines)
+        perf_counter = time.perf_counter
+        while True:
+            start = perf_counter()
+            try:
+                line = next(iterator)
+            except StopIteration:
+                self.parse_time += perf_counter() - start
+                return
+            self.parse_time += perf_counter() - start
+            yield line
+
+    def start_run(self, f_input: str, metrics: dict):
+        """Start of processing f_input, before anything is written"""
+        self.files = {'input': f_input, 'lines_in': count_lines(f_input), 'bytes_in': os.path.getsize(f_input)}
+        self.layer_start_metrics = dict(metrics)
+        self.start = time.perf_counter()
+
+    def start_layer(self, metrics: dict):
+        """A ;LAYER_CHANGE line is processed, metrics are the counters so far"""
+        self.finish_layer(metrics)
+        self.layer_start_lines = self.lines
+        self.layer_start_metrics = dict(metrics)
+
+    def finish_layer(self, metrics: dict):
+        layer = {'layer': len(self.layers), 'lines': self.lines - self.layer_start_lines}
+        for key, value in metrics.items():
+            layer[key] = value - self.layer_start_metrics.get(key, 0)
+        self.layers.append(layer)
+
+    def finish_run(self, f_output: str, metrics: dict):
+        """End of processing, f_output is written"""
+        self.wall_time = time.perf_counter() - self.start
+        self.finish_layer(metrics)
+        self.files['output'] = f_output
+        self.files['lines_out'] = count_lines(f_output)
+        self.files['bytes_out'] = os.path.getsize(f_output)
+        self.totals = dict(metrics)
+
+    def get_report(self) -> dict:
+        collision_time = max(0.0, self.wall_time - self.parse_time - self.emit_time)
+        report = dict(self.files)
+        report['lines_processed'] = self.lines
+        report['inserted_lines'] = self.files.get('lines_out', 0) - self.files.get('lines_in', 0)
+        report['wall_time'] = self.wall_time
+        report['phases'] = {'parse': self.parse_time, 'collision': collision_time, 'emit': self.emit_time}
+        report['totals'] = self.totals
+        report['layers'] = self.layers
+        return report
+
+    def write_report(self, path: str):
+        with open(path, 'w') as f:
+            json.dump(self.get_report(), f, indent=2)
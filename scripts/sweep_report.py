@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# Shuffles inserted with the exact swept area of moves compared with the former quad approximation.
+# The exact check is the Minkowski sum of the toolhead and the move, grown by the sweep margins. The quad misses the
+# part of the start position outside of it, everything else of the swept area is covered by the quad and the check
+# of the end position. Shuffles saved are the ones of the quad minus the ones of the exact check.
+#
+# Sample invocations:
+#   ./sweep_report.py
+#       reports the sample files in gcode/
+#   ./sweep_report.py --sweep-margin-x -0.25 --sweep-margin-y -0.25 sample.gcode
+
+import argparse
+import glob
+import io
+import os
+import sys
+from contextlib import redirect_stdout
+
+from duelingzero_postprocessing import DuelRunner, get_arg_parser
+from toolhead import set_collision_backend, set_sweep_margins
+
+SAMPLE_GLOB = os.path.join(os.path.dirname(os.path.abspath(__file__)), "gcode", "*.gcode")
+
+
+def count_shuffles(gcode_file: str, backend: str, margin_x: float = 0.0, margin_y: float = 0.0) -> int:
+    """Shuffles, backups and segmented moves inserted by post processing gcode_file"""
+    set_collision_backend(backend)
+    set_sweep_margins(margin_x, margin_y)
+    try:
+        dr = DuelRunner(get_arg_parser().parse_args([]))
+        with open(gcode_file, 'r') as f_in, redirect_stdout(io.StringIO()):
+            dr.play_gcodes_stream_to(f_in, io.StringIO())
+    finally:
+        set_collision_backend('analytic')
+        set_sweep_margins(0.0, 0.0)
+    return sum(value for key, value in dr.get_metrics().items() if 'shuffles' in key)
+
+
+def get_sweep_report(gcode_files: list, margin_x: float, margin_y: float) -> list:
+    rows = []
+    for gcode_file in gcode_files:
+        quad = count_shuffles(gcode_file, 'quad')
+        exact = count_shuffles(gcode_file, 'analytic', margin_x, margin_y)
+        rows.append({'file': gcode_file, 'quad': quad, 'exact': exact, 'saved': quad - exact})
+    return rows
+
+
+def print_sweep_report(rows: list):
+    print("%-55s %8s %8s %8s" % ("file", "quad", "exact", "saved"))
+    for row in rows:
+        print("%-55s %8d %8d %8d" % (os.path.relpath(row['file']), row['quad'], row['exact'], row['saved']))
+    print("%-55s %8d %8d %8d" % ("total", sum(row['quad'] for row in rows), sum(row['exact'] for row in rows),
+                                 sum(row['saved'] for row in rows)))
+
+
+def get_sweep_report_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Compare the shuffles of the exact swept area check with the "
+                                                 "former quad approximation.")
+    parser.add_argument('--sweep-margin-x', help="Margin in X for the exact check", type=float, default=0.0)
+    parser.add_argument('--sweep-margin-y', help="Margin in Y for the exact check", type=float, default=0.0)
+    parser.add_argument('gcodefiles', nargs='*', help="Files to compare, default: the samples in gcode/")
+    return parser
+
+
+def main(passed_args) -> int:
+    gcode_files = passed_args.gcodefiles or sorted(glob.glob(SAMPLE_GLOB))
+    print_sweep_report(get_sweep_report(gcode_files, passed_args.sweep_margin_x, passed_args.sweep_margin_y))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(get_sweep_report_arg_parser().parse_args()))
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# To run tests:
+#   pip3 install nose
+#   python3 -m nose test_arc.py
+
+import io
+import math
+import random
+
+from arc import get_arc, check_for_overlap_arc
+from duelingzero_postprocessing import DuelRunner, get_arg_parser, SPLIT_CLEARANCE
+from gcode_generator import generate_gcode
+from gcode_tokenizer import tokenize_line
+from point import Point
+from toolhead import check_for_overlap, check_for_overlap_sweep, set_sweep_margins, Y_HIGH, Y_LOW, TOOLHEAD_Y_HEIGHT
+
+test_data = [
+    # start, arc line, expected center and sweep in degrees, None if no arc
+    (Point(100, 20), "G3 X100 Y40 I13.333 J10", (113.333, 30, 286.26)),
+    (Point(100, 20), "G3 X100 Y40 R-16.667", (113.333, 30, 286.26)),
+    (Point(100, 20), "G3 X100 Y40 R16.667", (86.667, 30, 73.74)),
+    (Point(100, 20), "G2 X100 Y40 R16.667", (113.333, 30, -73.74)),
+    (Point(100, 20), "G2 X100 Y40 R-16.667", (86.667, 30, -286.26)),
+    # radius too small, half circle
+    (Point(0, 0), "G2 X10 Y0 R1", (5, 0, -180)),
+    (Point(0, 0), "G2 X0 Y0 I10 J0", (10, 0, -360)),
+    (Point(0, 0), "G3 X0 Y0 J-5", (0, -5, 360)),
+    (Point(0, 0), "G2 X10 Y0", None),
+    (Point(0, 0), "G2 X0 Y0 R5", None),
+]
+
+bounds_test_data = [
+    # start, arc line, expected bounds
+    (Point(100, 20), "G3 X100 Y40 I13.333 J10", (100, 13.333, 130, 46.667)),
+    (Point(100, 20), "G2 X100 Y40 I13.333 J10", (96.667, 20, 100, 40)),
+    (Point(0, 0), "G2 X0 Y0 I10 J0", (0, -10, 20, 10)),
+]
+
+move_test_data = [
+    # moves, expected shuffles
+    # the chord of the arc is clear of T1, the arc is not
+    (["G1 X100 Y20 F3000", "G3 X100 Y40 I13.333 J10 E1"], 1),
+    (["G1 X100 Y20 F3000", "G1 X100 Y40 E1"], 0),
+    (["G1 X100 Y20 F3000", "G2 X100 Y40 I13.333 J10 E1"], 0),
+    (["G1 X100 Y20 F3000", "G3 X100 Y40 R-16.667 E1"], 1),
+    # full circle, no move at all for a straight check
+    (["G1 X100 Y20 F3000", "G3 X100 Y20 I13.333 J10 E1"], 1),
+]
+
+margin_test_data = [
+    # generator arguments for segmented sequences, played with 2 mm sweep margins
+    # split points within the margins of the shuffled toolhead, horizontal moves not crossing the clearance line
+    ['--layers', '2', '--target', 'segmented'],
+    ['--layers', '2', '--changes-per-layer', '1', '--target', 'segmented', '--object', '45,20,35,40',
+     '--object', '85,90,35,40'],
+    ['--layers', '2', '--changes-per-layer', '2', '--target', 'segmented', '--object', '100,10,60,140'],
+]
+
+
+def check_arc_case(start, text, expected):
+    line = tokenize_line(text)
+    params = line.params
+    end = Point(float(params.get('X', start.x)), float(params.get('Y', start.y)))
+    arc = get_arc(start, end, line)
+    if expected is None:
+        assert arc is None, "%s: %s" % (text, arc)
+        return
+    center_x, center_y, sweep = expected
+    result = (arc.center_x, arc.center_y, math.degrees(arc.sweep))
+    assert all(abs(a - b) < 0.01 for a, b in zip(result, expected)), "%s: %s, expected %s" % (text, result, expected)
+
+
+def check_bounds_case(start, text, expected):
+    line = tokenize_line(text)
+    end = Point(float(line.params['X']), float(line.params['Y']))
+    bounds = get_arc(start, end, line).get_bounds()
+    assert all(abs(a - b) < 0.01 for a, b in zip(bounds, expected)), "%s: %s, expected %s" % (text, bounds, expected)
+
+
+def check_sampled_overlap(seed):
+    # the exact check agrees with the toolhead moved along many short chords of the arc
+    rng = random.Random(seed)
+    for _ in range(50):
+        start = Point(rng.uniform(0, 165), rng.uniform(0, 160))
+        end = Point(rng.uniform(0, 165), rng.uniform(0, 160))
+        text = "G%d X%f Y%f R%f" % (rng.choice([2, 3]), end.x, end.y, rng.choice([-1, 1]) * rng.uniform(5, 120))
+        arc = get_arc(start, end, tokenize_line(text))
+        inactive = Point(rng.choice([1.0, 164.0]), rng.choice([1.0, 159.0]))
+        points = [arc.point_at(i / 2000) for i in range(2001)]
+        sampled = check_for_overlap(points[0], inactive) or \
+            any(check_for_overlap_sweep(a, b, inactive) for a, b in zip(points, points[1:]))
+        assert check_for_overlap_arc(arc, inactive) == sampled, "%s from %s, inactive %s" % (text, start, inactive)
+
+
+def play(moves) -> tuple:
+    output = io.StringIO()
+    dr = DuelRunner(get_arg_parser().parse_args([]))
+    dr.output = output
+    dr.play_gcodes("\n".join(moves) + "\n")
+    return dr, output.getvalue().splitlines()
+
+
+def check_move_case(moves, expected):
+    dr, _ = play(moves)
+    shuffles = sum(value for key, value in dr.get_metrics().items() if 'shuffles' in key)
+    assert shuffles == expected, "%s: %d shuffles, expected %d" % (moves, shuffles, expected)
+
+
+def check_split_arc():
+    # segmented sequence of T0 in the front of the end zone, T1 shuffled to Y_HIGH before
+    moves = ["G1 X100 Y20 F3000", "G1 X130 Y20 E1", "G3 X130 Y140 I-30 J60 E10"]
+    dr, output = play(moves)
+    assert dr.segmented_shuffles_t1 == 1
+    arcs = [tokenize_line(text) for text in output if text.startswith("G3")]
+    assert len(arcs) == 2, output
+    first, second = arcs
+    mid = Point(first.params['X'], first.params['Y'])
+    assert mid.y == Y_LOW + TOOLHEAD_Y_HEIGHT + SPLIT_CLEARANCE
+    # both parts are on the original circle around (100, 80)
+    assert abs(130 + first.params['I'] - 100) < 1e-5 and abs(20 + first.params['J'] - 80) < 1e-5
+    assert abs(mid.x + second.params['I'] - 100) < 1e-5 and abs(mid.y + second.params['J'] - 80) < 1e-5
+    assert abs(math.hypot(mid.x - 100, mid.y - 80) - math.hypot(30, 60)) < 1e-5
+    assert (second.params['X'], second.params['Y']) == (130, 140)
+    # extrusion split by the length of the parts
+    first_arc = get_arc(Point(130, 20), mid, first)
+    second_arc = get_arc(mid, Point(130, 140), second)
+    assert abs(first.params['E'] + second.params['E'] - 10) < 1e-5
+    assert abs(first.params['E'] / 10 - first_arc.length / (first_arc.length + second_arc.length)) < 1e-5
+
+
+def check_split_arc_twice():
+    # T0 in the rear of the end zone, the arc dips into the front past T1 and comes back into the rear: T1 is shuffled
+    # to the rear at the first crossing of the clearance line, and back to the front at the last one
+    clearance_y = Y_HIGH - TOOLHEAD_Y_HEIGHT - SPLIT_CLEARANCE
+    moves = ["G1 X130 Y120 F3000", "G2 X129 Y119.987 I0 J-40 E10"]
+    dr, output = play(moves)
+    assert dr.segmented_shuffles_t1 == 2 and dr.backup_shuffles_t1 == 0
+    assert [text for text in output if text.startswith("G0 Y")] == ["G0 Y159.0 F15000", "G0 Y1.0 F15000"], output
+    parts = [tokenize_line(text) for text in output if text.startswith("G2")]
+    assert len(parts) == 3, output
+    arcs = []
+    start = Point(130, 120)
+    for part in parts:
+        end = Point(part.params['X'], part.params['Y'])
+        arcs.append(get_arc(start, end, part))
+        # all parts are on the original circle around (130, 80)
+        assert abs(start.x + part.params['I'] - 130) < 1e-5 and abs(start.y + part.params['J'] - 80) < 1e-5
+        start = end
+    assert (start.x, start.y) == (129, 119.987)
+    assert abs(sum(part.params['E'] for part in parts) - 10) < 1e-5
+    # the first and last parts stay in the rear, clear of T1 in the front, the middle part in the front
+    assert arcs[0].get_bounds()[1] >= clearance_y - 1e-5 and arcs[2].get_bounds()[1] >= clearance_y - 1e-5
+    assert arcs[1].get_bounds()[3] <= clearance_y + 1e-5
+    assert not check_for_overlap_arc(arcs[0], Point(164, 1)) and not check_for_overlap_arc(arcs[2], Point(164, 1))
+    assert dr.right_toolhead_pos.y == 1
+
+
+def check_segmented_margins(generator_args):
+    # the sequences keep the margins, the output passes --check with them
+    dr_args = ['--sweep-margin-x', '2', '--sweep-margin-y', '2']
+    output = io.StringIO()
+    try:
+        dr = DuelRunner(get_arg_parser().parse_args(dr_args))
+        dr.play_gcodes_stream_to(io.StringIO(generate_gcode(generator_args)), output)
+        error = DuelRunner(get_arg_parser().parse_args(dr_args + ['--check'])).check_buffer(output.getvalue().encode())
+        assert error is None, "%s: %s" % (generator_args, error)
+    finally:
+        set_sweep_margins(0.0, 0.0)
+
+
+def test_get_arc():
+    for start, text, expected in test_data:
+        yield check_arc_case, start, text, expected
+
+
+def test_bounds():
+    for start, text, expected in bounds_test_data:
+        yield check_bounds_case, start, text, expected
+
+
+def test_overlap():
+    for seed in range(4):
+        yield check_sampled_overlap, seed
+
+
+def test_moves():
+    for moves, expected in move_test_data:
+        yield check_move_case, moves, expected
+    yield check_split_arc,
+    yield check_split_arc_twice,
+    for generator_args in margin_test_data:
+        yield check_segmented_margins, generator_args
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+# To run tests:
+#   pip3 install nose
+#   python3 -m nose test_batch.py
+
+import json
+import os
+import shutil
+import tempfile
+
+from batch import run_batch, collect_batch_files
+from duelingzero_postprocessing import DuelRunner, get_arg_parser
+
+gcode_files = [
+    "examples/large_square_counter_clockwise.gcode",
+    "gcode/square_2_layer.gcode",
+    "gcode/square_2_layer_alternating_4_layers_total.gcode",
+]
+
+
+def check_batch(output_dir):
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        for gcode_file in gcode_files:
+            shutil.copy(gcode_file, tmp_dir)
+        summary = os.path.join(tmp_dir, "summary.json")
+        arguments = ['--batch', tmp_dir, '--jobs', '2', '--summary', summary]
+        if output_dir:
+            arguments += ['--output-dir', os.path.join(tmp_dir, output_dir)]
+        assert run_batch(get_arg_parser().parse_args(arguments)) == 0
+        with open(summary, 'r') as f:
+            results = {os.path.basename(r['input']): r for r in json.load(f)['files']}
+        for gcode_file in gcode_files:
+            dr = DuelRunner(None)
+            dr.verbose = False
+            with open(gcode_file, 'r') as f:
+                dr.play_gcodes_stream(f)
+            result = results[os.path.basename(gcode_file)]
+            for key, value in dr.get_metrics().items():
+                assert result[key] == value, "%s: %s is %s, expected %s" % (gcode_file, key, result[key], value)
+            assert os.path.exists(result['output']), "%s: no output" % gcode_file
+        # outputs written next to the inputs are not taken as inputs of the next batch
+        assert len(collect_batch_files(tmp_dir)) == len(gcode_files)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_rejected_options():
+    assert run_batch(get_arg_parser().parse_args(['--batch', 'gcode', '--stats', 'stats.json'])) == 1
+    assert not os.path.exists('stats.json')
+
+
+def test_batch():
+    for output_dir in (None, "out"):
+        yield check_batch, output_dir
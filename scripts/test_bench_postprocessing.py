@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+# To run tests:
+#   pip3 install nose
+#   python3 -m nose test_bench_postprocessing.py
+
+from bench_postprocessing import find_regressions, get_totals
+
+test_data = [
+    # baseline lines/sec, current lines/sec, lines, threshold, expected flagged files
+    ({"a.gcode": 1000.0, "b.gcode": 1000.0}, {"a.gcode": 950.0, "b.gcode": 1000.0}, 1000, 10.0, []),
+    ({"a.gcode": 1000.0, "b.gcode": 1000.0}, {"a.gcode": 800.0, "b.gcode": 1000.0}, 1000, 10.0, ["a.gcode", "total"]),
+    ({"a.gcode": 1000.0, "b.gcode": 1000.0}, {"a.gcode": 800.0, "b.gcode": 1000.0}, 1000, 25.0, []),
+    ({"a.gcode": 1000.0, "b.gcode": 1000.0}, {"a.gcode": 500.0, "b.gcode": 500.0}, 1000, 10.0,
+     ["a.gcode", "b.gcode", "total"]),
+    # faster is never a regression
+    ({"a.gcode": 1000.0}, {"a.gcode": 2000.0}, 1000, 10.0, []),
+    # files only in one of the results are not compared
+    ({"a.gcode": 1000.0}, {"a.gcode": 1000.0, "new.gcode": 10.0}, 1000, 10.0, []),
+    # tiny files are too noisy to compare, the totals still are
+    ({"a.gcode": 1000.0}, {"a.gcode": 500.0}, 10, 10.0, ["total"]),
+]
+
+
+def make_bench_result(rates: dict, lines: int) -> dict:
+    files = [{'file': name, 'lines': lines, 'total_time': lines / rate, 'phase_time': lines / rate, 'parse_time': 0.0,
+              'collision_time': 0.0, 'output_time': 0.0, 'lines_per_sec': rate, 'peak_rss_kb': 0}
+             for name, rate in rates.items()]
+    return {'files': files, 'totals': get_totals(files)}
+
+
+def check_regression_case(baseline_rates, current_rates, lines, threshold, expected):
+    baseline = make_bench_result(baseline_rates, lines)
+    current = make_bench_result(current_rates, lines)
+    flagged = sorted(name for name, _, _, _ in find_regressions(baseline, current, threshold))
+    assert flagged == expected, "flagged %s, expected %s" % (flagged, expected)
+
+
+def test_regressions():
+    for baseline_rates, current_rates, lines, threshold, expected in test_data:
+        yield check_regression_case, baseline_rates, current_rates, lines, threshold, expected
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# To run tests:
+#   pip3 install nose
+#   python3 -m nose test_chunk_cache.py
+
+import os
+import shutil
+import tempfile
+
+import toolhead
+from chunk_cache import ChunkCache, get_cache_options, play_file_cached, CACHE_SUFFIX
+from duelingzero_postprocessing import DuelRunner, get_arg_parser
+from gcode_generator import generate_gcode
+from toolhead import set_sweep_margins
+
+test_data = [
+    # generator arguments, DuelRunner arguments
+    (['--layers', '6', '--changes-per-layer', '1', '--target', 'segmented'], []),
+    (['--layers', '6', '--tool-period', '2', '--target', 'backup'], ['--parser', 'gcodeparser']),
+    (['--layers', '4', '--object', '10,20,90,50', '--object', '60,100,90,40'], []),
+]
+
+
+def generate(generator_args) -> str:
+    return generate_gcode(generator_args + ['--thumbnail-lines', '2'])
+
+
+def change_layer(gcode: str, layer: int) -> str:
+    """Change the extrusion of the first extruding move of the layer"""
+    lines = gcode.splitlines(keepends=True)
+    layer_no = -1
+    for i, line in enumerate(lines):
+        if line.startswith(";LAYER_CHANGE"):
+            layer_no += 1
+        elif layer_no == layer and line.startswith("G1 X") and " E" in line:
+            lines[i] = line.replace(" E", " E1", 1)
+            break
+    return "".join(lines)
+
+
+class CacheRun:
+    def __init__(self, dr_args):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.tmp_dir, "cache")
+        self.dr_args = dr_args
+
+    def play(self, gcode: str, max_bytes: int = 1 << 30) -> tuple:
+        """Returns the cached output, the serial output, the cache and both DuelRunners"""
+        f_input = os.path.join(self.tmp_dir, "input.gcode")
+        with open(f_input, 'w') as f:
+            f.write(gcode)
+        cache = ChunkCache(self.cache_dir, max_bytes, get_cache_options(get_arg_parser().parse_args(self.dr_args)))
+        dr = DuelRunner(get_arg_parser().parse_args(self.dr_args))
+        play_file_cached(dr, cache, f_input, os.path.join(self.tmp_dir, "cached.gcode"))
+        dr_serial = DuelRunner(get_arg_parser().parse_args(self.dr_args))
+        dr_serial.play_file(f_input, os.path.join(self.tmp_dir, "serial.gcode"))
+        with open(os.path.join(self.tmp_dir, "cached.gcode")) as f_cached, \
+                open(os.path.join(self.tmp_dir, "serial.gcode")) as f_serial:
+            return f_cached.read(), f_serial.read(), cache, dr, dr_serial
+
+    def entries(self) -> list:
+        return sorted(name for name in os.listdir(self.cache_dir) if name.endswith(CACHE_SUFFIX))
+
+    def close(self):
+        shutil.rmtree(self.tmp_dir)
+
+
+def check_cache_case(generator_args, dr_args):
+    gcode = generate(generator_args)
+    run = CacheRun(dr_args)
+    try:
+        chunk_count = gcode.count(";LAYER_CHANGE") + 1
+        for expected_hits in (0, chunk_count):
+            cached, serial, cache, dr, dr_serial = run.play(gcode)
+            assert cached == serial, "%s: cached output differs from serial output" % generator_args
+            assert dr.get_metrics() == dr_serial.get_metrics(), (dr.get_metrics(), dr_serial.get_metrics())
+            assert (cache.hits, cache.misses) == (expected_hits, chunk_count - expected_hits), \
+                (cache.hits, cache.misses)
+        # only the changed layer is played again, the state after it is the same
+        cached, serial, cache, dr, dr_serial = run.play(change_layer(gcode, 2))
+        assert cached == serial, "%s: cached output of the changed file differs" % generator_args
+        assert dr.get_metrics() == dr_serial.get_metrics(), (dr.get_metrics(), dr_serial.get_metrics())
+        assert cache.misses == 1, (cache.hits, cache.misses)
+    finally:
+        run.close()
+
+
+def check_geometry_change():
+    gcode = generate(['--layers', '3'])
+    run = CacheRun([])
+    saved = toolhead.EXTRA_TOOLHEAD_CLEARANCE
+    try:
+        run.play(gcode)
+        assert len(run.entries()) == 4
+        toolhead.EXTRA_TOOLHEAD_CLEARANCE = saved + 1
+        _, _, cache, _, _ = run.play(gcode)
+        assert (cache.hits, cache.misses) == (0, 4)
+        assert len(run.entries()) == 4, "entries of the old geometry left behind"
+    finally:
+        toolhead.EXTRA_TOOLHEAD_CLEARANCE = saved
+        run.close()
+
+
+def check_option_change():
+    gcode = generate(['--layers', '3'])
+    run = CacheRun([])
+    try:
+        run.play(gcode)
+        # other margins and backend miss, without clearing the cache
+        for dr_args, margin in ((['--sweep-margin-x', '2', '--sweep-margin-y', '2'], 2.0),
+                                (['--collision-backend', 'quad'], 0.0)):
+            run.dr_args = dr_args
+            set_sweep_margins(margin, margin)
+            _, _, cache, _, _ = run.play(gcode)
+            assert (cache.hits, cache.misses) == (0, 4)
+        set_sweep_margins(0.0, 0.0)
+        run.dr_args = []
+        _, _, cache, _, _ = run.play(gcode)
+        assert (cache.hits, cache.misses) == (4, 0) and len(run.entries()) == 12
+    finally:
+        set_sweep_margins(0.0, 0.0)
+        run.close()
+
+
+def check_eviction():
+    run = CacheRun([])
+    other = CacheRun([])
+    gcode = generate(['--layers', '3', '--object', '20,30,40,40'])
+    try:
+        run.play(generate(['--layers', '3']))
+        first = run.entries()
+        for name in first:   # used long ago
+            os.utime(os.path.join(run.cache_dir, name), (0, 0))
+        other.play(gcode)
+        size = sum(os.path.getsize(os.path.join(other.cache_dir, name)) for name in other.entries())
+        # just enough room for the chunks of the second file, some may be shared with the first one
+        run.play(gcode, size)
+        assert run.entries() == other.entries(), "least recently used entries kept"
+        assert set(first) - set(run.entries()), "nothing evicted"
+    finally:
+        run.close()
+        other.close()
+
+
+def test_cache():
+    for generator_args, dr_args in test_data:
+        yield check_cache_case, generator_args, dr_args
+    yield check_geometry_change,
+    yield check_option_change,
+    yield check_eviction,
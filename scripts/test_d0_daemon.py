@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# To run tests:
+#   pip3 install nose
+#   python3 -m nose test_d0_daemon.py
+
+import filecmp
+import io
+import os
+import shutil
+import socket
+import stat
+import tempfile
+import threading
+
+from d0_client import send_job
+from d0_daemon import create_server, make_private_dir
+from duelingzero_postprocessing import DuelRunner, get_arg_parser
+
+test_data = [
+    # gcode file, DuelRunner arguments
+    ("gcode/square_2_layer_alternating_4_layers_total.gcode", []),
+    ("examples/large_triangles.gcode", ['--park', 'dynamic']),
+    ("examples/squares.gcode", ['--planner', 'lookahead', '--peephole']),
+    ("gcode/square_2_layer.gcode", ['--parser', 'gcodeparser', '--zero-copy']),
+]
+
+error_test_data = [
+    # arguments, expected exit code
+    (['--batch', 'gcode'], 2),
+    (['--zero-copy', '--peephole', 'gcode/square_2_layer.gcode'], 2),
+    (['--reorder', '--zero-copy', 'gcode/square_2_layer.gcode'], 2),
+    (['--preheat', '--zero-copy', 'gcode/square_2_layer.gcode'], 2),
+    (['--planner', 'none', 'gcode/square_2_layer.gcode'], 2),
+    (['--input', 'missing.gcode', '--output', 'out.gcode'], 2),
+    (['--check', 'examples/bad.gcode'], 1),
+    (['--check', 'examples/single_move.gcode'], 0),
+]
+
+
+class DaemonRun:
+    def __init__(self, port: int = None):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.tmp_dir, "run", "d0.sock")
+        self.token_file = os.path.join(self.tmp_dir, "d0.token")
+        self.server = create_server(self.socket_path, port, self.token_file)
+        self.port = None if port is None else self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def send(self, args, gcode=None) -> tuple:
+        return send_job(args, gcode, self.socket_path, self.port, self.token_file)
+
+    def stop(self):
+        self.server.shutdown()
+        self.thread.join()
+        self.server.server_close()
+
+    def close(self):
+        if self.thread.is_alive():
+            self.stop()
+        shutil.rmtree(self.tmp_dir)
+
+
+def play_serial(gcode_file, dr_args, f_output) -> dict:
+    dr = DuelRunner(get_arg_parser().parse_args(dr_args))
+    dr.play_file(gcode_file, f_output)
+    return dr.get_metrics()
+
+
+def check_file_job(gcode_file, dr_args):
+    run = DaemonRun()
+    try:
+        serial_output = os.path.join(run.tmp_dir, "serial.gcode")
+        metrics = play_serial(gcode_file, dr_args, serial_output)
+        # the same runner is used again, without positions or metrics of the job before
+        for i in range(2):
+            daemon_output = os.path.join(run.tmp_dir, "daemon%d.gcode" % i)
+            response, output = run.send(dr_args + ['--input', gcode_file, '--output', daemon_output])
+            assert response['exit_code'] == 0, response
+            assert output is None
+            assert response['metrics'] == metrics, (response['metrics'], metrics)
+            assert filecmp.cmp(serial_output, daemon_output, shallow=False), "%s: output differs" % gcode_file
+        assert len(run.server.postprocessing.runners) == 1
+        # raw gcode, except for zero-copy which needs a file
+        if '--zero-copy' not in dr_args:
+            with open(gcode_file, 'rb') as f:
+                response, output = run.send(dr_args, f.read())
+            with open(serial_output, 'rb') as f:
+                assert output == f.read(), "%s: output of raw gcode differs" % gcode_file
+            assert response['metrics'] == metrics, (response['metrics'], metrics)
+    finally:
+        run.close()
+
+
+def check_error_job(args, expected):
+    run = DaemonRun()
+    try:
+        response, _ = run.send(args)
+        assert response['exit_code'] == expected, response
+        # still serving
+        response, output = run.send(['--check'], b"G1 X10 Y10\n")
+        assert response['exit_code'] == 0 and output is None, response
+    finally:
+        run.close()
+
+
+def test_failed_job():
+    # DuelRunner exits on the unknown tool, the runner is used again for the next jobs
+    run = DaemonRun()
+    gcode = "G1 X10 Y10 F3000\nG1 X20 Y20 E1\nG1 X30 Y20 E2\n"
+    try:
+        response, output = run.send([], b"G1 X10 Y10\nT2\n")
+        assert response['exit_code'] == 1 and output is None, response
+        serial = DuelRunner(get_arg_parser().parse_args([]))
+        serial_output = io.StringIO()
+        serial.play_gcodes_stream_to(io.StringIO(gcode), serial_output)
+        response, output = run.send([], gcode.encode())
+        assert response['exit_code'] == 0 and response['metrics'] == serial.get_metrics(), response
+        assert output == serial_output.getvalue().encode()
+        # the flight recorder holds the lines of the last job only
+        response, _ = run.send([], b"G1 X10 Y10 F3000\nG1 X20 Y20 E1\n")
+        assert response['exit_code'] == 0, response
+        dr = run.server.postprocessing.runners.popitem()[1]
+        assert [entry[0] for entry in dr.recorder] == [1, 2], list(dr.recorder)
+    finally:
+        run.close()
+
+
+def get_mode(path: str) -> int:
+    return stat.S_IMODE(os.stat(path).st_mode)
+
+
+def test_socket_access():
+    run = DaemonRun()
+    try:
+        assert get_mode(run.socket_path) == 0o600 and get_mode(os.path.dirname(run.socket_path)) == 0o700
+        response, _ = run.send(['--check'], b"G1 X10 Y10\n")
+        assert response['exit_code'] == 0, response
+    finally:
+        run.close()
+    # a socket left behind is replaced, anything else is left alone
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp_dir, "d0.sock")
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as stale:
+            stale.bind(path)
+        create_server(path).server_close()
+        assert not os.path.exists(path)
+        open(path, 'w').close()
+        try:
+            create_server(path)
+        except FileExistsError:
+            pass
+        else:
+            assert False, "file removed"
+        assert os.path.isfile(path)
+        # the runtime directory is not created by the daemon, it has to be private
+        os.chmod(tmp_dir, 0o755)
+        runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+        os.environ['XDG_RUNTIME_DIR'] = tmp_dir
+        try:
+            make_private_dir(os.path.join(tmp_dir, "d0.sock"))
+        except PermissionError:
+            pass
+        else:
+            assert False, "runtime directory accessible by others"
+        finally:
+            if runtime_dir is None:
+                del os.environ['XDG_RUNTIME_DIR']
+            else:
+                os.environ['XDG_RUNTIME_DIR'] = runtime_dir
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_tcp_token():
+    run = DaemonRun(0)
+    try:
+        assert get_mode(run.token_file) == 0o600
+        response, _ = run.send(['--check'], b"G1 X10 Y10\n")
+        assert response['exit_code'] == 0, response
+        wrong_token_file = os.path.join(run.tmp_dir, "wrong.token")
+        with open(wrong_token_file, 'w') as f:
+            f.write("0" * 32)
+        response, output = send_job(['--check'], b"G1 X10 Y10\n", port=run.port, token_file=wrong_token_file)
+        assert response['exit_code'] == 2 and response['message'] == "Invalid token" and output is None, response
+        run.stop()
+        assert not os.path.exists(run.token_file)
+    finally:
+        run.close()
+
+
+def test_file_jobs():
+    for gcode_file, dr_args in test_data:
+        yield check_file_job, gcode_file, dr_args
+
+
+def test_error_jobs():
+    for args, expected in error_test_data:
+        yield check_error_job, args, expected
@@ -3,7 +3,12 @@
 #   pip3 install nose
 #   python3 -m nose test_gcode_file.py
 
-from duelingzero_postprocessing import DuelRunner
+import io
+import os
+import tempfile
+from contextlib import redirect_stdout
+
+from duelingzero_postprocessing import DuelRunner, get_arg_parser, main
 
 # List of tuples: totals for each type:
 # simple_shuffles
@@ -58,3 +63,70 @@ def test_motion_case():
         simple, backup, segmented, gcode_file = test_input
         if not GCODE_FILE_FILTER or (GCODE_FILE_FILTER in gcode_file):
             yield check_motion_case, simple, backup, segmented, gcode_file
+
+
+def check_stream_case(gcode_file):
+    dr_full = DuelRunner(None)
+    dr_full.output = io.StringIO()
+    with open(gcode_file, 'r') as f:
+        dr_full.play_gcodes(f.read())
+    dr_stream = DuelRunner(None)
+    dr_stream.output = io.StringIO()
+    with open(gcode_file, 'r') as f:
+        dr_stream.play_gcodes_stream(f)
+    assert dr_full.output.getvalue() == dr_stream.output.getvalue(), "%s: streamed output differs" % gcode_file
+
+
+def test_stream_case():
+    for test_input in test_data:
+        gcode_file = test_input[3]
+        if not GCODE_FILE_FILTER or (GCODE_FILE_FILTER in gcode_file):
+            yield check_stream_case, gcode_file
+
+
+check_test_data = [
+    # gcode file, post processed before the check, expected (line, reason) of the first unsafe line or None if safe
+    ("examples/single_move.gcode", False, None),
+    ("examples/squares.gcode", False, (8, "tool change without park")),
+    ("gcode/square_2_layer.gcode", False, (427, "move collides")),
+    ("examples/squares.gcode", True, None),
+    ("examples/large_triangles.gcode", True, None),
+    ("examples/bad.gcode", True, None),
+]
+
+
+def check_safety_case(gcode_file, processed, expected):
+    tmp_dir = tempfile.mkdtemp()
+    checked_file = os.path.join(tmp_dir, "checked.gcode")
+    try:
+        if processed:
+            DuelRunner(get_arg_parser().parse_args([])).play_file(gcode_file, checked_file)
+        else:
+            with open(gcode_file, 'rb') as f_in, open(checked_file, 'wb') as f_out:
+                f_out.write(f_in.read())
+        with open(checked_file, 'rb') as f:
+            content = f.read()
+        error = DuelRunner(get_arg_parser().parse_args(['--check'])).check_file(checked_file)
+        result = None if error is None else (error.line_no, error.reason)
+        assert result == expected, "%s: %s, expected %s" % (gcode_file, error, expected)
+        with redirect_stdout(io.StringIO()):
+            exit_code = main(get_arg_parser().parse_args(['--check', checked_file]))
+        assert exit_code == (0 if expected is None else 1)
+        with open(checked_file, 'rb') as f:
+            assert f.read() == content, "%s: checked file changed" % gcode_file
+        assert os.listdir(tmp_dir) == ["checked.gcode"]
+    finally:
+        for name in os.listdir(tmp_dir):
+            os.remove(os.path.join(tmp_dir, name))
+        os.rmdir(tmp_dir)
+
+
+def check_missing_input():
+    with redirect_stdout(io.StringIO()):
+        assert main(get_arg_parser().parse_args(['--check', "examples/missing.gcode"])) == 2
+
+
+def test_safety_check():
+    for gcode_file, processed, expected in check_test_data:
+        yield check_safety_case, gcode_file, processed, expected
+    yield check_missing_input,
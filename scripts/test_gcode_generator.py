@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# To run tests:
+#   pip3 install nose
+#   python3 -m nose test_gcode_generator.py
+
+import argparse
+
+from duelingzero_postprocessing import DuelRunner
+from gcode_generator import generate_gcode, parse_object
+
+test_data = [
+    # generator arguments, expected non zero DuelRunner metrics
+    (['--layers', '4', '--tool-period', '0'], {}),
+    (['--layers', '4'], {'park_moves_t0': 2, 'park_moves_t1': 1}),
+    (['--layers', '4', '--tool-period', '2'], {'park_moves_t0': 1}),
+    (['--layers', '2', '--changes-per-layer', '2'], {'park_moves_t0': 3, 'park_moves_t1': 2}),
+    (['--layers', '4', '--tool-period', '0', '--target', 'simple'], {'simple_shuffles_t1': 4}),
+    (['--layers', '4', '--tool-period', '0', '--target', 'backup', '--target-count', '3'], {'backup_shuffles_t1': 12}),
+    (['--layers', '4', '--tool-period', '0', '--target', 'segmented'], {'segmented_shuffles_t1': 4}),
+    (['--layers', '4', '--target', 'simple'],
+     {'simple_shuffles_t0': 2, 'simple_shuffles_t1': 2, 'park_moves_t0': 2, 'park_moves_t1': 1}),
+    (['--layers', '4', '--target', 'backup', '--target-count', '2'],
+     {'backup_shuffles_t0': 4, 'backup_shuffles_t1': 4, 'park_moves_t0': 2, 'park_moves_t1': 1}),
+    (['--layers', '2', '--changes-per-layer', '1', '--target', 'segmented', '--object', '45,20,35,40',
+      '--object', '85,90,35,40'],
+     {'segmented_shuffles_t0': 2, 'segmented_shuffles_t1': 2, 'park_moves_t0': 1, 'park_moves_t1': 1}),
+]
+
+object_test_data = [
+    # object argument, valid
+    ("42.5,40,80,80", True),
+    ("0,0,165,160", True),
+    ("100,40,80,80", False),
+    ("-1,40,80,80", False),
+    ("10,10,80", False),
+]
+
+
+def check_generator_case(generator_args, expected):
+    dr = DuelRunner(None)
+    dr.verbose = False
+    dr.verboseGcode = False
+    dr.play_gcodes(generate_gcode(generator_args))
+    metrics = {key: value for key, value in dr.get_metrics().items() if value}
+    assert metrics == expected, "%s: %s, expected %s" % (generator_args, metrics, expected)
+
+
+def check_object_case(text, valid):
+    try:
+        parse_object(text)
+        assert valid, "%s accepted" % text
+    except argparse.ArgumentTypeError:
+        assert not valid, "%s rejected" % text
+
+
+def test_generator():
+    for generator_args, expected in test_data:
+        yield check_generator_case, generator_args, expected
+
+
+def test_objects():
+    for text, valid in object_test_data:
+        yield check_object_case, text, valid
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# To run tests:
+#   pip3 install nose
+#   python3 -m nose test_gcode_tokenizer.py
+
+import glob
+
+from gcodeparser import GcodeParser
+from gcodeparser.commands import Commands
+
+from gcode_tokenizer import tokenize_line
+
+# List of tuples: line, type, command, params, comment
+test_data = [
+    ("G1 X10 Y2.5 E.4 F1200", Commands.MOVE, ('G', 1), {'X': 10, 'Y': 2.5, 'E': 0.4, 'F': 1200}, ""),
+    ("G0 X1.0 Y159.0 F15000 ; PPfD0 t0_go_to", Commands.MOVE, ('G', 0), {'X': 1.0, 'Y': 159.0, 'F': 15000},
+     "PPfD0 t0_go_to"),
+    ("G1X10Y5", Commands.MOVE, ('G', 1), {'X': 10, 'Y': 5}, ""),
+    ("  g01 x-3.5", Commands.MOVE, ('G', 1), {'X': -3.5}, ""),
+    # exponents are part of the value, not an E parameter
+    ("G1 X1e-3 Y5", Commands.MOVE, ('G', 1), {'X': 0.001, 'Y': 5}, ""),
+    ("G1 X1.5e+1 Y2 E0.4", Commands.MOVE, ('G', 1), {'X': 15.0, 'Y': 2, 'E': 0.4}, ""),
+    ("G1X1e-3Y5E-2", Commands.MOVE, ('G', 1), {'X': 0.001, 'Y': 5, 'E': -2}, ""),
+    # upper case E always starts the E parameter
+    ("G1X10E5", Commands.MOVE, ('G', 1), {'X': 10, 'E': 5}, ""),
+    ("G1 X10E-5", Commands.MOVE, ('G', 1), {'X': 10, 'E': -5}, ""),
+    ("G2 X10 Y10 I5 J0", Commands.MOVE, ('G', 2), {'X': 10, 'Y': 10, 'I': 5, 'J': 0}, ""),
+    ("T1 ; PPfD0 t1_park", Commands.TOOLCHANGE, ('T', 1), {}, "PPfD0 t1_park"),
+    ("t0", Commands.TOOLCHANGE, ('T', 0), {}, ""),
+    ("G28", Commands.OTHER, ('G', 28), {}, ""),
+    ("G92 E0", Commands.OTHER, ('G', 92), {}, ""),
+    ("TURN_OFF_HEATERS", Commands.OTHER, None, {}, ""),
+    ("print_start EXT_TEMP=245 BED_TEMP=110", Commands.OTHER, None, {}, ""),
+    ("; thumbnail begin 32x32 1524", Commands.COMMENT, (';', None), {}, "thumbnail begin 32x32 1524"),
+    ("", Commands.OTHER, None, {}, ""),
+]
+
+
+def check_tokenize_line(line, line_type, command, params, comment):
+    token = tokenize_line(line)
+    assert token.type == line_type, "%s: type %s" % (line, token.type)
+    assert token.command == command, "%s: command %s" % (line, token.command)
+    assert token.params == params, "%s: params %s" % (line, token.params)
+    assert token.comment == comment, "%s: comment %s" % (line, token.comment)
+    assert token.gcode_str == line, "%s: not passed through untouched" % line
+
+
+def test_tokenize_line():
+    for test_input in test_data:
+        yield (check_tokenize_line,) + test_input
+
+
+def check_same_as_gcodeparser(gcode_file):
+    with open(gcode_file, 'r') as f:
+        for line in f:
+            line = line.rstrip('\n')
+            token = tokenize_line(line)
+            for parsed in GcodeParser(line, include_comments=True).lines:
+                if parsed.type in (Commands.MOVE, Commands.TOOLCHANGE):
+                    assert (token.type, token.command, token.params, token.comment) == \
+                           (parsed.type, parsed.command, parsed.params, parsed.comment), \
+                           "%s: %s differs from gcodeparser" % (gcode_file, line)
+
+
+def test_same_as_gcodeparser():
+    for gcode_file in sorted(glob.glob("gcode/*.gcode") + glob.glob("examples/*.gcode")):
+        yield check_same_as_gcodeparser, gcode_file
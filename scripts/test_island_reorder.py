@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# To run tests:
+#   pip3 install nose
+#   python3 -m nose test_island_reorder.py
+
+
+from gcode_generator import generate_gcode
+from island_reorder import IslandReorder, MachineState, play_lines, count_tool_changes, get_postprocessing_counts
+
+HEADER = ["M82", "G90"]
+LAYER = [";LAYER_CHANGE", ";Z:0.2", "G1 Z0.2 F600", "G1 X10 Y10 F3000", "G1 X20 Y10 E1 F1200",
+         "T1", "G92 E0", "G1 X150 Y20 F3000", "G1 X150 Y30 E0.5 F1200",
+         "T0", "G1 X30 Y10 F3000", "G1 X40 Y10 E1.5 F1200",
+         "T1", "G1 X140 Y20 F3000", "G1 X140 Y30 E1 F1200"]
+
+test_data = [
+    # lines of the input, expected lines of the layer, None if the layer is kept as it is
+    # the T0 island moves in front, E of the moved islands is restored
+    (HEADER + LAYER,
+     [";LAYER_CHANGE", ";Z:0.2", "G1 Z0.2 F600", "G1 X10 Y10 F3000", "G1 X20 Y10 E1 F1200",
+      "; T0 removed by island reordering, tool already active", "G92 E0.5 ; restored by island reordering",
+      "G1 X30 Y10 F3000", "G1 X40 Y10 E1.5 F1200",
+      "T1", "G92 E1 ; restored by island reordering", "G92 E0", "G1 X150 Y20 F3000", "G1 X150 Y30 E0.5 F1200",
+      "; T1 removed by island reordering, tool already active", "G92 E1.5 ; restored by island reordering",
+      "G1 X140 Y20 F3000", "G1 X140 Y30 E1 F1200"]),
+    # an island starting with an extrusion gets the travel to where its toolhead was and the feed rate, after a tool
+    # change this is the park position
+    (["M83", ";LAYER_CHANGE", "G1 Z0.2", "G1 X10 Y10 E1 F1200", "T1", "G1 X150 Y30 E1 F900", "T0",
+      "G1 X20 Y10 E1", "T1", "G1 X140 Y30 E1"],
+     [";LAYER_CHANGE", "G1 Z0.2", "G1 X10 Y10 E1 F1200",
+      "; T0 removed by island reordering, tool already active", "G1 F900 ; restored by island reordering",
+      "G1 X1.0 Y159.0 ; restored by island reordering", "G1 X20 Y10 E1",
+      "T1", "G1 F1200 ; restored by island reordering", "G1 X150 Y30 E1 F900",
+      "; T1 removed by island reordering, tool already active", "G1 X164.0 Y1.0 ; restored by island reordering",
+      "G1 X140 Y30 E1"]),
+    # a standby temperature would be set for the active tool
+    (HEADER + ["M104 S245 T0", "M104 S245 T1"] + LAYER[:9] + ["M104 S180 T1"] + LAYER[9:], None),
+    # the same temperature again is fine
+    (HEADER + ["M104 S245 T0", "M104 S245 T1"] + LAYER[:9] + ["M104 S245 T0"] + LAYER[9:], 'reordered'),
+    # relative moves
+    (HEADER + LAYER[:3] + ["G91"] + LAYER[3:], None),
+    # already post processed
+    (HEADER + LAYER[:5] + ["T1 ; PPfD0 t1_shuffle"] + LAYER[5:], None),
+    # a single tool change, nothing to reorder
+    (HEADER + LAYER[:9], None),
+]
+
+file_test_data = [
+    # generator arguments, expected tool changes before, after. The first layer is kept, T1 gets its temperature there
+    (['--layers', '4', '--changes-per-layer', '3'], 12, 6),
+    (['--layers', '3', '--changes-per-layer', '4', '--target', 'simple', '--target-count', '2'], 14, 6),
+]
+
+gcode_files = [
+    # one tool per layer, nothing to reorder
+    "gcode/square_2_layer_alternating_4_layers_total.gcode",
+    "examples/large_triangles.gcode",
+]
+
+
+def reorder(lines: list) -> tuple:
+    island_reorder = IslandReorder()
+    output = [line.rstrip("\n") for line in island_reorder.reorder_lines(line + "\n" for line in lines)]
+    return output, island_reorder
+
+
+def check_extrusions(lines: list, output: list):
+    assert play_lines(output, MachineState()) == play_lines(lines, MachineState())
+
+
+def check_reorder_case(lines, expected):
+    output, island_reorder = reorder(lines)
+    check_extrusions(lines, output)
+    if expected is None:
+        assert output == lines, output
+        assert island_reorder.reordered_layers == 0
+    elif expected == 'reordered':
+        assert island_reorder.reordered_layers == 1
+    else:
+        assert output[output.index(";LAYER_CHANGE"):] == expected, output
+
+
+def check_generated_case(generator_args, tool_changes, tool_changes_reordered):
+    lines = generate_gcode(generator_args).splitlines()
+    output, _ = reorder(lines)
+    check_extrusions(lines, output)
+    assert count_tool_changes(lines) == tool_changes
+    assert count_tool_changes(output) == tool_changes_reordered, count_tool_changes(output)
+    before, after = get_postprocessing_counts(lines), get_postprocessing_counts(output)
+    assert after['parks'] < before['parks'] and after['shuffles'] <= before['shuffles'], (before, after)
+
+
+def check_file_case(gcode_file):
+    with open(gcode_file) as f:
+        lines = f.read().splitlines()
+    output, island_reorder = reorder(lines)
+    assert output == lines
+    assert island_reorder.reordered_layers == 0
+
+
+def test_reorder():
+    for lines, expected in test_data:
+        yield check_reorder_case, lines, expected
+    for generator_args, tool_changes, tool_changes_reordered in file_test_data:
+        yield check_generated_case, generator_args, tool_changes, tool_changes_reordered
+    for gcode_file in gcode_files:
+        yield check_file_case, gcode_file
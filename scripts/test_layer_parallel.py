@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# To run tests:
+#   pip3 install nose
+#   python3 -m nose test_layer_parallel.py
+
+import filecmp
+import os
+import tempfile
+
+from duelingzero_postprocessing import DuelRunner, get_arg_parser
+from layer_parallel import play_file_parallel, run_parallel
+
+test_data = [
+    # gcode file, chunk_lines (None: split at layer changes)
+    ("gcode/square_2_layer_alternating_4_layers_total.gcode", None),
+    ("gcode/square_2_layer_alternating_4_layers_total.gcode", 50),
+    ("gcode/square_2_layer.gcode", None),
+    ("gcode/cylinder_1_layer_filled_10_perim.gcode", 50),
+    ("examples/large_square_counter_clockwise.gcode", 50),
+]
+
+
+def check_parallel_case(gcode_file, chunk_lines):
+    passed_args = get_arg_parser().parse_args([])
+    tmp_dir = tempfile.mkdtemp()
+    serial_output = os.path.join(tmp_dir, "serial.gcode")
+    parallel_output = os.path.join(tmp_dir, "parallel.gcode")
+    try:
+        dr = DuelRunner(passed_args)
+        dr.play_file(gcode_file, serial_output)
+        dr_parallel = play_file_parallel(passed_args, gcode_file, parallel_output, 2, chunk_lines)
+        assert filecmp.cmp(serial_output, parallel_output, shallow=False), \
+            "%s: parallel output differs from serial output" % gcode_file
+        assert dr_parallel.get_metrics() == dr.get_metrics(), \
+            "%s: %s != %s" % (gcode_file, dr_parallel.get_metrics(), dr.get_metrics())
+        assert sorted(os.listdir(tmp_dir)) == ["parallel.gcode", "serial.gcode"], "temporary parts left behind"
+    finally:
+        for name in os.listdir(tmp_dir):
+            os.remove(os.path.join(tmp_dir, name))
+        os.rmdir(tmp_dir)
+
+
+def test_rejected_options():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        output = os.path.join(tmp_dir, "parallel.gcode")
+        passed_args = get_arg_parser().parse_args(['--parallel', '--input', test_data[0][0], '--output', output,
+                                                   '--stats', os.path.join(tmp_dir, "stats.json")])
+        assert run_parallel(passed_args) == 1
+        assert os.listdir(tmp_dir) == []
+    finally:
+        os.rmdir(tmp_dir)
+
+
+def test_parallel():
+    for gcode_file, chunk_lines in test_data:
+        yield check_parallel_case, gcode_file, chunk_lines
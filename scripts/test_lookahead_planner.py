@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# To run tests:
+#   pip3 install nose
+#   python3 -m nose test_lookahead_planner.py
+
+import filecmp
+import os
+import tempfile
+
+from duelingzero_postprocessing import DuelRunner, get_arg_parser
+from gcode_generator import generate_gcode
+from lookahead_planner import LookaheadPlanner
+from print_time import DEFAULT_LIMITS, estimate_file, read_printer_limits
+from toolhead import Z_LIFT
+
+test_data = [
+    # gcode file, expected non zero shuffle metrics with --planner lookahead, output reprocessable
+    ("gcode/cylinder_1_layer_filled_1_perim.gcode", {'simple_shuffles_t1': 4, 'segmented_shuffles_t1': 1}, True),
+    ("gcode/cylinder_1_layer_filled_10_perim.gcode",
+     {'simple_shuffles_t1': 13, 'backup_shuffles_t1': 2, 'segmented_shuffles_t1': 8}, True),
+    ("gcode/square_2_layer_alternating_4_layers_total.gcode",
+     {'simple_shuffles_t0': 2, 'simple_shuffles_t1': 2, 'segmented_shuffles_t0': 2, 'segmented_shuffles_t1': 2}, True),
+    ("gcode/square_1_layer_filled_10_perim.gcode", {'simple_shuffles_t1': 12, 'segmented_shuffles_t1': 10}, True),
+]
+
+generator_test_data = [
+    # generator arguments, expected non zero shuffle metrics with --planner lookahead
+    (['--layers', '4', '--tool-period', '0', '--target', 'simple'], {'simple_shuffles_t1': 4}),
+    (['--layers', '4', '--target', 'backup', '--target-count', '2'], {'simple_shuffles_t0': 4, 'simple_shuffles_t1': 4}),
+    (['--layers', '4', '--tool-period', '0', '--target', 'segmented'], {'segmented_shuffles_t1': 4}),
+]
+
+
+def get_shuffles(dr) -> dict:
+    return {key: value for key, value in dr.get_metrics().items() if value and not key.startswith('park')}
+
+
+def play(gcode_file, output, planner):
+    dr = DuelRunner(get_arg_parser().parse_args(['--planner', planner]))
+    dr.play_file(gcode_file, output)
+    return dr
+
+
+def check_planner_case(gcode_file, expected, reprocessable):
+    tmp_dir = tempfile.mkdtemp()
+    greedy_output = os.path.join(tmp_dir, "greedy.gcode")
+    lookahead_output = os.path.join(tmp_dir, "lookahead.gcode")
+    reprocessed_output = os.path.join(tmp_dir, "reprocessed.gcode")
+    try:
+        greedy = play(gcode_file, greedy_output, 'greedy')
+        lookahead = play(gcode_file, lookahead_output, 'lookahead')
+        assert get_shuffles(lookahead) == expected, "%s: %s, expected %s" % (gcode_file, get_shuffles(lookahead), expected)
+        assert sum(get_shuffles(lookahead).values()) <= sum(get_shuffles(greedy).values())
+        assert estimate_file(lookahead_output).total_time <= estimate_file(greedy_output).total_time + 1e-6
+        if reprocessable:
+            # a safe output needs no more insertions
+            play(lookahead_output, reprocessed_output, 'greedy')
+            assert filecmp.cmp(lookahead_output, reprocessed_output, shallow=False), "%s: output not safe" % gcode_file
+    finally:
+        for name in os.listdir(tmp_dir):
+            os.remove(os.path.join(tmp_dir, name))
+        os.rmdir(tmp_dir)
+
+
+def check_generator_case(generator_args, expected):
+    dr = DuelRunner(get_arg_parser().parse_args(['--planner', 'lookahead']))
+    dr.play_gcodes(generate_gcode(generator_args))
+    assert get_shuffles(dr) == expected, "%s: %s, expected %s" % (generator_args, get_shuffles(dr), expected)
+
+
+def check_window_case(window):
+    # no early shuffle pays off in this file, the output is the greedy one whatever the window
+    gcode_file = "gcode/square_2_layer_alternating_4_layers_total.gcode"
+    tmp_dir = tempfile.mkdtemp()
+    greedy_output = os.path.join(tmp_dir, "greedy.gcode")
+    lookahead_output = os.path.join(tmp_dir, "lookahead.gcode")
+    try:
+        play(gcode_file, greedy_output, 'greedy')
+        passed_args = get_arg_parser().parse_args(['--planner', 'lookahead', '--lookahead-window', str(window)])
+        DuelRunner(passed_args).play_file(gcode_file, lookahead_output)
+        assert filecmp.cmp(greedy_output, lookahead_output, shallow=False), "window %d changed the output" % window
+    finally:
+        for name in os.listdir(tmp_dir):
+            os.remove(os.path.join(tmp_dir, name))
+        os.rmdir(tmp_dir)
+
+
+def test_planner():
+    for gcode_file, expected, reprocessable in test_data:
+        yield check_planner_case, gcode_file, expected, reprocessable
+
+
+def test_planner_generated():
+    for generator_args, expected in generator_test_data:
+        yield check_generator_case, generator_args, expected
+
+
+def test_window():
+    for window in [1, 10, 5000]:
+        yield check_window_case, window
+
+
+def test_z_limits():
+    dr = DuelRunner(get_arg_parser().parse_args([]))
+    expected = 2 * Z_LIFT / read_printer_limits()['max_z_velocity']
+    assert abs(LookaheadPlanner(dr).z_lift_time - expected) < 1e-9
+    limits = dict(DEFAULT_LIMITS, max_z_velocity=2.0)
+    assert abs(LookaheadPlanner(dr, limits=limits).z_lift_time - Z_LIFT) < 1e-9
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# To run tests:
+#   pip3 install nose
+#   python3 -m nose test_mapped_output.py
+
+import os
+import shutil
+import tempfile
+
+from duelingzero_postprocessing import DuelRunner
+
+gcode_files = [
+    "examples/single_move.gcode",
+    "examples/large_square_counter_clockwise.gcode",
+    "examples/bad.gcode",
+    "gcode/square_2_layer.gcode",
+    "gcode/square_2_layer_alternating_4_layers_total.gcode",
+    "gcode/square_1_layer_filled_fill_angle_90.gcode",
+    "gcode/cylinder_1_layer_filled_10_perim.gcode",
+]
+
+
+def normalized_lines(path):
+    """Lines with double spaces stripped, as written for not mapped input"""
+    with open(path, 'r') as f:
+        return [' '.join(line.split()) for line in f.read().splitlines()]
+
+
+def check_same_as_streamed(gcode_file, verbose_gcode):
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        streamed = os.path.join(tmp_dir, "streamed.gcode")
+        mapped = os.path.join(tmp_dir, "mapped.gcode")
+        for path, play in ((streamed, DuelRunner.play_gcodes_file_sep), (mapped, DuelRunner.play_gcodes_file_mapped)):
+            dr = DuelRunner(None)
+            dr.verbose = False
+            dr.verboseGcode = verbose_gcode
+            play(dr, gcode_file, path)
+        assert normalized_lines(streamed) == normalized_lines(mapped), "%s: mapped output differs" % gcode_file
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_same_as_streamed():
+    for gcode_file in gcode_files:
+        for verbose_gcode in (False, True):
+            yield check_same_as_streamed, gcode_file, verbose_gcode
+
+
+# List of tuples: input gcode lines, name. Lines are written as they are, including double spaces and CRLF.
+test_data = [
+    (["T0", "G1 X10  Y10 F15000", ";  comment  with  spaces", "G1 X150 Y30 F10000", "G1 X10 Y10 F15000"],
+     "simple shuffle"),
+    (["; thumbnail  begin", ";  iVBORw0KGgo", "; thumbnail end", "", "G1  X10 Y10\r", "M104  S200\r", "G1 X20 Y10"],
+     "no insertion"),
+]
+
+
+def check_unchanged_lines_untouched(gcode, name):
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp_dir, "mapped.gcode")
+        with open(path, 'wb') as f:
+            f.write("\n".join(gcode).encode())
+        dr = DuelRunner(None)
+        dr.verbose = False
+        dr.play_gcodes_file_mapped(path, path)
+        with open(path, 'rb') as f:
+            output_lines = f.read().split(b"\n")
+        # all input lines except the tool change appear byte by byte and in order
+        remaining = iter(output_lines)
+        for line in gcode:
+            if not line.startswith("T"):
+                assert line.encode() in remaining, "%s: %s not found unchanged" % (name, line)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_unchanged_lines_untouched():
+    for test_input in test_data:
+        yield (check_unchanged_lines_untouched,) + test_input
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# To run tests:
+#   pip3 install nose
+#   python3 -m nose test_move_columns.py
+
+import math
+
+from gcodeparser.commands import Commands
+
+from gcode_tokenizer import tokenize_gcode, tokenize_gcode_stream
+from move_columns import MoveColumns
+from toolhead import LEFT_PARK_POS, RIGHT_PARK_POS
+
+NAN = float('nan')
+
+test_data = [
+    # gcode, expected rows (index, command, tool, x0, y0, x, y, z, e, f, inactive x, inactive y)
+    (["G1 X10 Y20 Z0.2 F3000", "G1 X30 E1.5", "M104 S200", "G2 X40 Y30 I5 J5 E.4"],
+     [(0, 1, 0, 1, 159, 10, 20, 0.2, NAN, 3000, 164, 1), (1, 1, 0, 10, 20, 30, 20, NAN, 1.5, NAN, 164, 1),
+      (3, 2, 0, 30, 20, 40, 30, NAN, 0.4, NAN, 164, 1)]),
+    # each tool change parks the outgoing toolhead
+    (["G0 X60 Y80", "T1", "G0 X100 Y80", "T0", "G0 Y70"],
+     [(0, 0, 0, 1, 159, 60, 80, NAN, NAN, NAN, 164, 1), (2, 0, 1, 164, 1, 100, 80, NAN, NAN, NAN, 1, 159),
+      (4, 0, 0, 1, 159, 1, 70, NAN, NAN, NAN, 164, 1)]),
+    # inserted tool change, T0 stays where it was
+    (["G0 X60 Y80", "T1 ; PPfD0 t1_shuffle", "G0 X100 Y80"],
+     [(0, 0, 0, 1, 159, 60, 80, NAN, NAN, NAN, 164, 1), (2, 0, 1, 164, 1, 100, 80, NAN, NAN, NAN, 60, 80)]),
+]
+
+gcode_files = [
+    "gcode/square_2_layer_alternating_4_layers_total.gcode",
+    "gcode/cylinder_1_layer_filled_10_perim.gcode",
+]
+
+COLUMNS = ('index', 'command', 'tool', 'x0', 'y0', 'x', 'y', 'z', 'e', 'f', 'inactive_x', 'inactive_y')
+
+
+def same(a, b) -> bool:
+    return (math.isnan(a) and math.isnan(b)) or a == b
+
+
+def check_columns_case(gcode, expected):
+    columns = MoveColumns.from_lines(tokenize_gcode("\n".join(gcode)), 'left', LEFT_PARK_POS, RIGHT_PARK_POS)
+    rows = list(zip(*(getattr(columns, name) for name in COLUMNS)))
+    assert len(rows) == len(expected), rows
+    for row, expected_row in zip(rows, expected):
+        assert all(same(a, b) for a, b in zip(row, expected_row)), "%s, expected %s" % (row, expected_row)
+
+
+def check_file_case(gcode_file):
+    with open(gcode_file) as f:
+        lines = list(tokenize_gcode_stream(f))
+    columns = MoveColumns.from_lines(lines, 'left', LEFT_PARK_POS, RIGHT_PARK_POS)
+    moves = [line for line in lines if line.type == Commands.MOVE]
+    assert len(columns) == len(moves)
+    assert columns.get_nbytes() == len(moves) * (4 + 1 + 1 + 9 * 8)
+    # every move starts where the one before of the same tool ended, as long as no tool change is in between
+    for i in range(1, len(columns)):
+        if columns.tool[i] == columns.tool[i - 1]:
+            assert (columns.x0[i], columns.y0[i]) == (columns.x[i - 1], columns.y[i - 1])
+
+
+def test_columns():
+    for gcode, expected in test_data:
+        yield check_columns_case, gcode, expected
+    for gcode_file in gcode_files:
+        yield check_file_case, gcode_file
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# To run tests:
+#   pip3 install nose numpy
+#   python3 -m nose test_move_prescreen.py
+
+import io
+
+from duelingzero_postprocessing import DuelRunner
+from gcode_tokenizer import tokenize_gcode
+from move_prescreen import prescreen_moves
+from point import Point
+from toolhead import LEFT_PARK_POS, RIGHT_PARK_POS
+
+# List of tuples: lines which must be flagged, lines which must not be flagged, gcode
+test_data = [
+    # T0 far away from the parked T1, then into T1's column
+    ([2], [1], ["T0", "G0 X10 Y10", "G0 X160 Y10"], "T0 into T1 column"),
+    # T1 after parking T0 at the left
+    ([3], [2], ["T1", "G0 X150 Y80", "G0 X100 Y80", "G0 X5 Y80"], "T1 into T0 column"),
+    # Tool change inserted by post processing leaves T0 where it was, a regular one parks it
+    ([2], [], ["G0 X60 Y80", "T1 ; PPfD0 t1_shuffle", "G0 X100 Y80"], "inserted tool change"),
+    ([], [2], ["G0 X60 Y80", "T1", "G0 X100 Y80"], "regular tool change"),
+]
+
+gcode_files = [
+    "examples/large_square_counter_clockwise.gcode",
+    "gcode/square_2_layer.gcode",
+    "gcode/square_2_layer_alternating_4_layers_total.gcode",
+    "gcode/square_1_layer_filled_fill_angle_90.gcode",
+    "gcode/cylinder_1_layer_filled_10_perim.gcode",
+]
+
+
+def check_prescreen_case(flagged, not_flagged, gcode, name):
+    candidates = prescreen_moves(tokenize_gcode("\n".join(gcode)), 'left', LEFT_PARK_POS, RIGHT_PARK_POS)
+    for i in flagged:
+        assert candidates[i], "%s: line %d not flagged" % (name, i)
+    for i in not_flagged:
+        assert not candidates[i], "%s: line %d flagged" % (name, i)
+
+
+def test_prescreen_case():
+    for test_input in test_data:
+        yield (check_prescreen_case,) + test_input
+
+
+def run_file(gcode_file, prescreen):
+    dr = DuelRunner(None)
+    dr.verbose = False
+    dr.prescreen = prescreen
+    dr.output = io.StringIO()
+    with open(gcode_file, 'r') as f:
+        dr.play_gcodes_stream(f)
+    return dr
+
+
+def check_same_result(gcode_file):
+    dr_checked = run_file(gcode_file, False)
+    dr_prescreened = run_file(gcode_file, True)
+    assert dr_checked.output.getvalue() == dr_prescreened.output.getvalue(), "%s: output differs" % gcode_file
+
+
+def test_stray_park():
+    # T0 left at (80, 80) by --park dynamic is parked at (X_LOW, Y_LOW) by the first move. The last move, clear of
+    # its column at X 80 the prescreen saw, runs into it there.
+    state = {'left_toolhead_pos': (80.0, 80.0), 'right_toolhead_pos': (20.0, 150.0), 'active_instance': 'right',
+             'last_feed_rate': 3000.0, 'need_to_restore_feed_rate': False, 'z_lifted': False}
+    gcode = "G1 X60 Y120 E1\nG1 X20 Y120 E2\nG1 X20 Y40 E3\n"
+    for planner in ('greedy', 'lookahead'):
+        outputs = []
+        for prescreen in (False, True):
+            dr = DuelRunner(None)
+            dr.verbose = False
+            dr.prescreen = prescreen
+            dr.planner = planner
+            dr.output = io.StringIO()
+            dr.set_state(state)
+            dr.continue_gcode_lines(tokenize_gcode(gcode))
+            assert dr.park_moves_t0 == 1
+            outputs.append(dr.output.getvalue())
+        assert outputs[0] == outputs[1], "%s: %s" % (planner, outputs)
+
+
+def test_same_result():
+    for gcode_file in gcode_files:
+        yield check_same_result, gcode_file
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# To run tests:
+#   pip3 install nose
+#   python3 -m nose test_park_planner.py
+
+import io
+from collections import deque
+
+from duelingzero_postprocessing import DuelRunner, get_arg_parser
+from gcode_generator import generate_gcode
+from park_planner import choose_park_pos
+from point import Point
+from toolhead import X_LOW, X_HIGH, Y_LOW, Y_HIGH, set_sweep_margins
+
+test_data = [
+    # outgoing, outgoing pos, incoming pos, moves of the incoming toolhead, complete, next park, expected park
+    # far away from the segment: stays
+    ('left', Point(30, 30), Point(X_HIGH, Y_LOW), [((150, 140), (140, 140))], True, True, Point(30, 30)),
+    # segment not read completely: parks, Y_LOW is the nearer corner
+    ('left', Point(30, 30), Point(X_HIGH, Y_LOW), [((150, 140), (140, 140))], False, True, Point(X_LOW, Y_LOW)),
+    # segment runs over the outgoing toolhead: parks
+    ('left', Point(80, 80), Point(X_HIGH, Y_LOW), [((150, 140), (80, 140))], True, True, Point(X_LOW, Y_LOW)),
+    # segment runs into Y_LOW in the column: parks at Y_HIGH, though farther away
+    ('left', Point(80, 40), Point(X_HIGH, Y_LOW), [((120, 10), (10, 10))], True, True, Point(X_LOW, Y_HIGH)),
+    ('right', Point(80, 130), Point(X_LOW, Y_HIGH), [((40, 150), (155, 150))], True, True, Point(X_HIGH, Y_LOW)),
+    # left in place the incoming toolhead could not park at the end of the segment
+    ('left', Point(120, 90), Point(X_HIGH, Y_LOW), [((X_HIGH, Y_LOW), (X_HIGH, 150)), ((X_HIGH, 150), (60, 150)),
+                                                   ((60, 150), (60, 100))], True, True, Point(X_LOW, Y_HIGH)),
+    # same, but no park at the end of the segment
+    ('left', Point(120, 90), Point(X_HIGH, Y_LOW), [((X_HIGH, Y_LOW), (X_HIGH, 150)), ((X_HIGH, 150), (60, 150)),
+                                                   ((60, 150), (60, 100))], True, False, Point(120, 90)),
+]
+
+margin_test_data = [
+    # sweep margin X, outgoing pos, moves of the incoming toolhead, expected park
+    # the segment ends 45 mm from the outgoing toolhead, within the margin only with 5 mm
+    (0.0, Point(80, 80), [((X_HIGH, Y_LOW), (X_HIGH, 100)), ((X_HIGH, 100), (125, 100))], Point(80, 80)),
+    (5.0, Point(80, 80), [((X_HIGH, Y_LOW), (X_HIGH, 100)), ((X_HIGH, 100), (125, 100))], Point(X_LOW, Y_LOW)),
+]
+
+STRAY_GCODE = "G1 X80 Y80 F3000\nT1\nG1 X164 Y100\nG1 X125 Y100\n"
+
+generator_test_data = [
+    # generator arguments, expected park moves with --park dynamic
+    (['--layers', '4'], {'park_moves_t0': 2, 'park_moves_t1': 1}),
+    (['--layers', '6', '--changes-per-layer', '2', '--object', '10,20,40,40', '--object', '110,90,40,40'],
+     {'park_moves_t0': 3, 'park_moves_t1': 2}),
+]
+
+
+def check_choose_case(outgoing, outgoing_pos, incoming_pos, moves, complete, next_park, expected):
+    moves = [start + end for start, end in moves]
+    park = choose_park_pos(outgoing, outgoing_pos, incoming_pos, moves, complete, next_park)
+    assert (park.x, park.y) == (expected.x, expected.y), "%s, expected %s" % (park, expected)
+
+
+def check_margin_case(margin_x, outgoing_pos, moves, expected):
+    set_sweep_margins(margin_x, 0.0)
+    try:
+        check_choose_case('left', outgoing_pos, Point(X_HIGH, Y_LOW), moves, True, False, expected)
+    finally:
+        set_sweep_margins(0.0, 0.0)
+
+
+def test_stray_inactive():
+    # T0 left in place by a park plan made without the margin: parked before T1 runs into it. The plan is given
+    # directly, without --park dynamic the prescreen would not know it.
+    set_sweep_margins(5.0, 0.0)
+    try:
+        dr = DuelRunner(get_arg_parser().parse_args(['--sweep-margin-x', '5', '--no-prescreen']))
+        dr.park_plans = deque([(80.0, 80.0)])
+        output = io.StringIO()
+        dr.play_gcodes_stream_to(io.StringIO(STRAY_GCODE), output)
+        assert dr.get_metrics()['park_moves_t0'] == 1 and not dr.park_plans
+        assert (dr.left_toolhead_pos.x, dr.left_toolhead_pos.y) == (X_LOW, Y_LOW)
+        assert "T1 ; PPfD0 t1_activate\nG1 F3000" in output.getvalue(), output.getvalue()
+        assert DuelRunner(get_arg_parser().parse_args(['--check'])).check_buffer(output.getvalue().encode()) is None
+    finally:
+        set_sweep_margins(0.0, 0.0)
+
+
+def play_gcode(gcode, passed_args):
+    output = io.StringIO()
+    dr = DuelRunner(passed_args)
+    dr.output = output
+    dr.play_gcodes(gcode)
+    return dr, output.getvalue()
+
+
+def check_generator_case(generator_args, expected):
+    dr, output = play_gcode(generate_gcode(generator_args), get_arg_parser().parse_args(['--park', 'dynamic']))
+    parks = {key: value for key, value in dr.get_metrics().items() if value and key.startswith('park')}
+    assert parks == expected, "%s: %s, expected %s" % (generator_args, parks, expected)
+    assert not dr.park_plans, "park positions left over"
+    # the output is safe, reprocessing inserts nothing
+    dr_again, output_again = play_gcode(output, get_arg_parser().parse_args([]))
+    assert output_again == output, "%s: %s" % (generator_args, dr_again.get_metrics())
+
+
+def test_choose_park_pos():
+    for case in test_data:
+        yield (check_choose_case,) + case
+    for case in margin_test_data:
+        yield (check_margin_case,) + case
+
+
+def test_dynamic_park():
+    for generator_args, expected in generator_test_data:
+        yield check_generator_case, generator_args, expected
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# To run tests:
+#   pip3 install nose
+#   python3 -m nose test_peephole.py
+
+import io
+
+from duelingzero_postprocessing import DuelRunner, get_arg_parser
+from peephole import PeepholeWriter, split_line
+
+test_data = [
+    # output lines, expected optimised lines
+    # z_down followed by z_up, with a restored feed rate and a tool change in between
+    (["G90", "G1 Z0.2", "G91", "G0 Z-0.4", "G90", "G1 F1200 ; restored feed_rate by PPfD0", "T1 ; handled by PPfD0",
+      "G91", "G0 Z0.4", "G90", "G1 X5 E1"],
+     ["G90", "G1 Z0.2", "G1 F1200 ; restored feed_rate by PPfD0", "T1 ; handled by PPfD0", "G1 X5 E1"]),
+    # a move in between keeps both
+    (["G91", "G0 Z-0.4", "G90", "G1 X5 E1", "G91", "G0 Z0.4", "G90"],
+     ["G91", "G0 Z-0.4", "G90", "G1 X5 E1", "G91", "G0 Z0.4", "G90"]),
+    # repeated inserted activation, tool changes of the input stay
+    (["T0", "T0 ; PPfD0 t0_park", "G0 X1", "T0 ; handled by PPfD0", "T1 ; PPfD0 t1_shuffle", "T1 ; PPfD0 t1_go_to"],
+     ["T0", "G0 X1", "T0 ; handled by PPfD0", "T1 ; PPfD0 t1_shuffle"]),
+    # restored feed rate set again by the next move
+    (["G1 F1200 ; restored feed_rate by PPfD0", "G92 E0", "G1 X5 E1 F2400"], ["G92 E0", "G1 X5 E1 F2400"]),
+    (["G1 F1200 ; restored feed_rate by PPfD0", "G1 X5 E1"], ["G1 F1200 ; restored feed_rate by PPfD0", "G1 X5 E1"]),
+    (["G1 F1200 ; restored feed_rate by PPfD0", "G91", "G0 Z0.4", "G90", "G0 X5 F9000"],
+     ["G1 F1200 ; restored feed_rate by PPfD0", "G91", "G0 Z0.4", "G90", "G0 X5 F9000"]),
+    # moves along the same axis, only in absolute mode
+    (["G90", "G0 Y10 F9000", "G0 Y20", "G0 Y5 F3000", "G0 X1"], ["G90", "G0 Y5 F3000", "G0 X1"]),
+    (["G91", "G0 Y10", "G0 Y20"], ["G91", "G0 Y10", "G0 Y20"]),
+    (["G90", "G0 X10 Y5", "G0 X20"], ["G90", "G0 X10 Y5", "G0 X20"]),
+    # a lift stays a move of its own in front of a shuffle, folded into it Z would only be reached at its end
+    (["G90", "G1 Z0.2", "G91", "G0 Z0.4", "G90", "T1 ; PPfD0 t1_shuffle", "G0 Y159.0 F15000"],
+     ["G90", "G1 Z0.2", "G91", "G0 Z0.4", "G90", "T1 ; PPfD0 t1_shuffle", "G0 Y159.0 F15000"]),
+    # and in front of the backoff
+    (["G90", "G1 Z0.2", "G91", "G0 Z0.4", "G90", "; PPfD0 t0_backoff", "G0 X119.5 F15000"],
+     ["G90", "G1 Z0.2", "G91", "G0 Z0.4", "G90", "; PPfD0 t0_backoff", "G0 X119.5 F15000"]),
+]
+
+file_test_data = [
+    # gcode file, DuelRunner arguments, lines removed
+    ("gcode/square_2_layer_alternating_4_layers_total.gcode", [], True),
+    ("gcode/square_1_layer_filled_10_perim.gcode", [], False),
+    ("examples/large_triangles.gcode", [], True),
+    ("examples/squares.gcode", ['--park', 'dynamic'], True),
+    ("gcode/cylinder_1_layer_filled_10_perim.gcode", ['--planner', 'lookahead'], False),
+]
+
+
+def simulate(lines) -> tuple:
+    """Run G-code lines on a simple machine model: XY per tool, shared Z, feed rate, tool and positioning mode.
+    Returns the final state and the extruding moves (tool, x, y, z, e) in order."""
+    state = {'tool': 'T0', 'T0': [1.0, 159.0], 'T1': [164.0, 1.0], 'Z': 0.0, 'F': None, 'relative': False}
+    extrusions = []
+    for line in lines:
+        code, params, _ = split_line(line)
+        if code in ('T0', 'T1'):
+            state['tool'] = code
+        elif code in ('G90', 'G91'):
+            state['relative'] = code == 'G91'
+        elif code in ('G0', 'G1'):
+            xy = state[state['tool']]
+            for i, axis in enumerate('XY'):
+                if axis in params:
+                    xy[i] = xy[i] + float(params[axis]) if state['relative'] else float(params[axis])
+            if 'Z' in params:
+                state['Z'] = state['Z'] + float(params['Z']) if state['relative'] else float(params['Z'])
+            if 'F' in params:
+                state['F'] = float(params['F'])
+            if 'E' in params:
+                extrusions.append((state['tool'], round(xy[0], 4), round(xy[1], 4), round(state['Z'], 4), params['E']))
+    state['Z'] = round(state['Z'], 4)
+    state['T0'] = [round(v, 4) for v in state['T0']]
+    state['T1'] = [round(v, 4) for v in state['T1']]
+    return state, extrusions
+
+
+def check_rule_case(lines, expected):
+    output = io.StringIO()
+    writer = PeepholeWriter(output)
+    for line in lines:
+        writer.write(line + "\n")
+    writer.finish()
+    assert output.getvalue().splitlines() == expected, "%s, expected %s" % (output.getvalue().splitlines(), expected)
+
+
+def play(gcode, dr_args) -> str:
+    output = io.StringIO()
+    dr = DuelRunner(get_arg_parser().parse_args(dr_args))
+    dr.play_gcodes_stream_to(io.StringIO(gcode), output)
+    return output.getvalue()
+
+
+def check_file_case(gcode_file, dr_args, removed):
+    with open(gcode_file) as f:
+        gcode = f.read()
+    lines = play(gcode, dr_args).splitlines()
+    optimised = play(gcode, dr_args + ['--peephole']).splitlines()
+    if removed:
+        assert len(optimised) < len(lines), "%s: nothing optimised" % gcode_file
+    else:
+        assert optimised == lines, "%s: changed" % gcode_file
+    state, extrusions = simulate(lines)
+    optimised_state, optimised_extrusions = simulate(optimised)
+    assert optimised_state == state, "%s: %s != %s" % (gcode_file, optimised_state, state)
+    assert optimised_extrusions == extrusions, "%s: extrusions differ" % gcode_file
+
+
+def test_rules():
+    for lines, expected in test_data:
+        yield check_rule_case, lines, expected
+
+
+def test_files():
+    for gcode_file, dr_args, removed in file_test_data:
+        yield check_file_case, gcode_file, dr_args, removed
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# To run tests:
+#   pip3 install nose
+#   python3 -m nose test_placement_advisor.py
+
+import io
+from contextlib import redirect_stdout
+
+from duelingzero_postprocessing import DuelRunner, get_arg_parser
+from gcode_generator import generate_gcode
+from placement_advisor import PrintMoves, evaluate_offset, get_offsets, advise_placement
+from print_time import DEFAULT_BED, DEFAULT_LIMITS, read_bed_limits
+from toolhead import X_LOW, X_HIGH, Y_LOW, Y_HIGH
+
+SAMPLE_FILES = ["gcode/square_2_layer_alternating_4_layers_total.gcode", "gcode/square_1_layer_filled_1_perim.gcode",
+                "gcode/cylinder_1_layer_filled_1_perim.gcode"]
+
+generated_test_data = [
+    # generator arguments, post processed as sliced
+    ['--layers', '3', '--tool-period', '1'],
+    ['--layers', '2', '--tool-period', '1', '--changes-per-layer', '2'],
+    ['--layers', '2', '--tool-period', '1', '--target', 'simple'],
+    ['--layers', '2', '--tool-period', '1', '--target', 'backup'],
+    ['--layers', '2', '--tool-period', '1', '--target', 'segmented'],
+]
+
+offset_test_data = [
+    # object X, Y, offset X, Y; target moves stay where they are, they are left out here
+    (10, 10, 30, 20),
+    (50, 40, -20, 35),
+    (10, 10, 60, 0),   # the post processing fails
+    (80, 80, -70, -60),
+]
+
+rejected_test_data = [
+    "T1 ; handled by PPfD0\nG1 X10 Y10\n",
+    "G91\nG1 X10 Y10\n",
+    "G92 X0 Y0\nG1 X10 Y10\n",
+    "T2\nG1 X10 Y10\n",
+]
+
+
+def get_full_metrics(gcode: str) -> dict:
+    """Metrics of the full post processing, None if it fails"""
+    dr = DuelRunner(get_arg_parser().parse_args([]))
+    try:
+        with redirect_stdout(io.StringIO()):
+            dr.play_gcodes_stream_to(io.StringIO(gcode), io.StringIO())
+    except ZeroDivisionError:
+        return None
+    return dr.get_metrics()
+
+
+def check_as_sliced(gcode: str):
+    result = evaluate_offset(PrintMoves(io.StringIO(gcode)), 0.0, 0.0, DEFAULT_LIMITS)
+    expected = get_full_metrics(gcode)
+    assert {key: result[key] for key in expected} == expected, result
+    assert result['overhead'] >= 0.0
+
+
+def check_offset(x: int, y: int, dx: int, dy: int):
+    generator_args = ['--layers', '2', '--tool-period', '1', '--object']
+    moves = PrintMoves(io.StringIO(generate_gcode(generator_args + ['%d,%d,60,60' % (x, y)])))
+    result = evaluate_offset(moves, float(dx), float(dy), DEFAULT_LIMITS)
+    expected = get_full_metrics(generate_gcode(generator_args + ['%d,%d,60,60' % (x + dx, y + dy)]))
+    if expected is None:
+        assert result is None
+    else:
+        assert {key: result[key] for key in expected} == expected, result
+
+
+def test_offsets_on_bed():
+    moves = PrintMoves(io.StringIO(generate_gcode(['--layers', '1', '--object', '10,10,60,60'])))
+    offsets = get_offsets(moves, 5.0)
+    assert (0.0, 0.0) in offsets and len(set(offsets)) == len(offsets)
+    for dx, dy in offsets:
+        assert dx % 5.0 == 0 and dy % 5.0 == 0
+        assert moves.x_range[0] <= dx <= moves.x_range[1] and moves.y_range[0] <= dy <= moves.y_range[1]
+    # one more step leaves the bed
+    xs = [dx for dx, _ in offsets]
+    ys = [dy for _, dy in offsets]
+    assert min(xs) - 5.0 < moves.x_range[0] and max(xs) + 5.0 > moves.x_range[1]
+    assert min(ys) - 5.0 < moves.y_range[0] and max(ys) + 5.0 > moves.y_range[1]
+    assert all(abs(dx) <= 10.0 and abs(dy) <= 10.0 for dx, dy in get_offsets(moves, 5.0, 10.0))
+    # a print larger than the bed is evaluated as sliced only
+    park_bed = {'x': (X_LOW, X_HIGH), 'y': (Y_LOW, Y_HIGH)}
+    moves = PrintMoves(io.StringIO("G1 X%s Y10\nG1 X%s Y10\n" % (X_LOW - 1.0, X_HIGH + 1.0)), park_bed)
+    assert all(dx == 0.0 for dx, _ in get_offsets(moves, 5.0)) and (0.0, 0.0) in get_offsets(moves, 5.0)
+    moves = PrintMoves(io.StringIO("G1 X10 Y%s\nG1 X10 Y%s\n" % (Y_LOW, Y_HIGH)), park_bed)
+    assert get_offsets(moves, 5.0) and all(dy == 0.0 for _, dy in get_offsets(moves, 5.0))
+    # a print sticking out at the back is moved towards the front only
+    moves = PrintMoves(io.StringIO("G1 X10 Y20\nG1 X10 Y%s\n" % (Y_HIGH + 3.0)), park_bed)
+    ys = sorted(set(dy for _, dy in get_offsets(moves, 5.0)))
+    assert ys[0] == -15.0 and ys[-1] == 0.0, ys
+
+
+def test_bed_limits():
+    # [stepper_x] and [stepper_y] are in an included file
+    assert read_bed_limits() == {'x': (0.0, 180.0), 'y': (0.0, 180.0)}
+    assert read_bed_limits("missing.cfg") == DEFAULT_BED
+
+
+def test_advise_placement():
+    gcode = generate_gcode(['--layers', '2', '--tool-period', '1', '--object', '10,10,60,60'])
+    results, failed, as_sliced = advise_placement(io.StringIO(gcode), 10.0, limits=DEFAULT_LIMITS)
+    assert results and as_sliced in results
+    best = results[0]
+    assert (round(best['overhead'], 1), best['shuffles']) <= (round(as_sliced['overhead'], 1), as_sliced['shuffles'])
+    assert not set((result['dx'], result['dy']) for result in results) & set(failed)
+    # segmented moves not reaching the Y to split at fall back to backup sequences, no offset fails
+    gcode = generate_gcode(['--layers', '2', '--tool-period', '1', '--object', '70,50,60,60'])
+    results, failed, as_sliced = advise_placement(io.StringIO(gcode), 10.0, limits=DEFAULT_LIMITS)
+    assert as_sliced in results and not failed
+    # the samples reach beyond Y_HIGH, on the bed of printer.cfg
+    with open(SAMPLE_FILES[1], 'r') as f:
+        results, failed, as_sliced = advise_placement(f, 10.0, limits=DEFAULT_LIMITS)
+    assert as_sliced in results and len(results) + len(failed) > 1
+
+
+def check_rejected(gcode: str):
+    try:
+        PrintMoves(io.StringIO(gcode))
+    except ValueError:
+        return
+    assert False, "not rejected: %s" % gcode
+
+
+def test_placement_advisor():
+    for gcode_file in SAMPLE_FILES:
+        with open(gcode_file, 'r') as f:
+            yield check_as_sliced, f.read()
+    for generator_args in generated_test_data:
+        yield check_as_sliced, generate_gcode(generator_args)
+    for x, y, dx, dy in offset_test_data:
+        yield check_offset, x, y, dx, dy
+    for gcode in rejected_test_data:
+        yield check_rejected, gcode
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# To run tests:
+#   pip3 install nose
+#   python3 -m nose test_preheat.py
+
+import io
+
+from duelingzero_postprocessing import DuelRunner, get_arg_parser
+from gcode_generator import generate_gcode
+from preheat import PreheatWriter
+
+LIMITS = {'max_velocity': 300.0, 'max_z_velocity': 5.0}
+# 10 s of T0, then T1 for 10 + 5 + 5 s at 10 mm/s
+GCODE = ["M104 S245", "M104 S240 T1", "G1 X101 Y159 F600", "T1 ; handled by PPfD0", "G1 X164 Y101 F600",
+         "G1 X164 Y151", "G1 X114 Y151", "T0 ; handled by PPfD0", "G1 X1 Y149"]
+
+test_data = [
+    # input lines, warm-up time, expected output lines
+    # T0 is heated back 10 s before it is needed
+    (GCODE, 10.0,
+     ["M104 S245", "M104 S240 T1", "G1 X101 Y159 F600", "T1 ; handled by PPfD0", "M104 S175 T0 ; PPfD0 idle",
+      "G1 X164 Y101 F600", "M104 S245 T0 ; PPfD0 preheat", "G1 X164 Y151", "G1 X114 Y151",
+      "T0 ; handled by PPfD0", "M104 S175 T1 ; PPfD0 idle", "G1 X1 Y149"]),
+    # not enough time to cool down and heat again, T0 is not idled
+    (GCODE, 25.0, GCODE[:7] + ["T0 ; handled by PPfD0", "M104 S175 T1 ; PPfD0 idle", "G1 X1 Y149"]),
+    # as early as possible, right after the tool change before
+    (GCODE, 18.0,
+     GCODE[:4] + ["M104 S175 T0 ; PPfD0 idle", "M104 S245 T0 ; PPfD0 preheat"] + GCODE[4:7] +
+     ["T0 ; handled by PPfD0", "M104 S175 T1 ; PPfD0 idle", "G1 X1 Y149"]),
+    # tool activations inserted by the post processing are no tool changes
+    (["M104 S245", "M104 S240 T1", "T1 ; PPfD0 t1_shuffle", "G0 Y100", "T0 ; PPfD0 t0_activate", "G1 X50"], 10.0,
+     ["M104 S245", "M104 S240 T1", "T1 ; PPfD0 t1_shuffle", "G0 Y100", "T0 ; PPfD0 t0_activate", "G1 X50"]),
+    # the input sets a standby temperature itself, T0 is not heated back
+    (GCODE[:5] + ["M104 S200 T0"] + GCODE[5:], 10.0,
+     GCODE[:4] + ["M104 S175 T0 ; PPfD0 idle", GCODE[4], "M104 S200 T0"] + GCODE[5:8] +
+     ["M104 S175 T1 ; PPfD0 idle", "G1 X1 Y149"]),
+    (GCODE[:4] + ["M104 S200 T0"] + GCODE[4:], 10.0,
+     GCODE[:4] + ["M104 S200 T0"] + GCODE[4:8] + ["M104 S175 T1 ; PPfD0 idle", "G1 X1 Y149"]),
+    # print temperatures from PRINT_START
+    (["PRINT_START EXT_TEMP=230 BED_TEMP=60"] + GCODE[2:5], 10.0,
+     ["PRINT_START EXT_TEMP=230 BED_TEMP=60"] + GCODE[2:4] + ["M104 S175 T0 ; PPfD0 idle", GCODE[4]]),
+    # print temperature unknown, nothing is idled
+    (GCODE[2:], 10.0, GCODE[2:]),
+]
+
+generator_test_data = [
+    # generator arguments, expected idle and preheat lines
+    (['--layers', '6', '--tool-period', '2'], 2, 1),
+    (['--layers', '4', '--tool-period', '1'], 3, 2),
+    (['--layers', '3', '--changes-per-layer', '3'], 9, 8),
+]
+
+
+def write(lines: list, warmup_time: float) -> list:
+    output = io.StringIO()
+    writer = PreheatWriter(output, 175.0, warmup_time, LIMITS)
+    for line in lines:
+        writer.write(line + "\n")
+    writer.finish()
+    return output.getvalue().splitlines()
+
+
+def check_writer_case(lines, warmup_time, expected):
+    output = write(lines, warmup_time)
+    assert output == expected, output
+    # reprocessing does not change the output
+    assert write(output, warmup_time) == output
+
+
+def play(gcode: str) -> str:
+    output = io.StringIO()
+    DuelRunner(get_arg_parser().parse_args(['--preheat'])).play_gcodes_stream_to(io.StringIO(gcode), output)
+    return output.getvalue()
+
+
+def check_generated_case(generator_args, idle, preheat):
+    output = play(generate_gcode(generator_args))
+    assert output.count("PPfD0 idle") == idle and output.count("PPfD0 preheat") == preheat
+    assert play(output) == output
+
+
+def test_preheat():
+    for lines, warmup_time, expected in test_data:
+        yield check_writer_case, lines, warmup_time, expected
+    for generator_args, idle, preheat in generator_test_data:
+        yield check_generated_case, generator_args, idle, preheat
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# To run tests:
+#   pip3 install nose
+#   python3 -m nose test_print_time.py
+
+from gcode_tokenizer import tokenize_gcode
+from print_time import PrintTimeEstimator, read_printer_limits, estimate_file, estimate_post_processed, \
+    get_overhead_report, DEFAULT_LIMITS
+
+# 100mm at 100mm/s with 3000mm/s^2: 2 * 1/30s accelerating over 5/3mm, 290/3mm cruising
+LONG_MOVE = 2.0 / 30 + (100.0 - 10.0 / 3) / 100.0
+
+test_data = [
+    # gcode, estimated time in seconds
+    ("G92 X0 Y0\nG1 X100 F6000", LONG_MOVE),
+    # too short to reach the feed rate: accelerate to sqrt(3000 * 10) and decelerate
+    ("G92 X0 Y0\nG1 X10 F18000", 2 * (3000.0 * 10) ** 0.5 / 3000),
+    # feed rate limited by max_velocity
+    ("G92 X0 Y0\nG1 X300 F60000", 2 * 0.1 + (300.0 - 30.0) / 300.0),
+    # straight junction at full speed
+    ("G92 X0 Y0\nG1 X50 F6000\nG1 X100", LONG_MOVE),
+    # reversal is a full stop
+    ("G92 X0 Y0\nG1 X100 F6000\nG1 X0", 2 * LONG_MOVE),
+    # relative coordinates
+    ("G92 X0 Y0\nG91\nG1 X50 F6000\nG1 X50\nG90", LONG_MOVE),
+    # Z limited by max_z_velocity and max_z_accel
+    ("G1 Z10 F6000", 2 * 0.05 + (10.0 - 0.25) / 5.0),
+    # M204 sets the acceleration
+    ("G92 X0 Y0\nM204 S1000\nG1 X100 F6000", 2 * 0.1 + (100.0 - 10.0) / 100.0),
+    # tools are followed separately, T1 starts parked at X164 Y1
+    ("T1\nG1 X164 Y1 F6000", 0.0),
+    ("G92 X0 Y0\nG1 X100 F6000\nT1\nG92 X0 Y0\nG1 X100\nT0\nG1 X0", 3 * LONG_MOVE),
+    # a corner slows down
+    ("G92 X0 Y0\nG1 X100 F6000\nG1 Y100", None),
+]
+
+
+def estimate(gcode: str) -> float:
+    estimator = PrintTimeEstimator(dict(DEFAULT_LIMITS))
+    estimator.play_lines(tokenize_gcode(gcode))
+    return estimator.total_time
+
+
+def check_estimate_case(gcode, expected):
+    estimated = estimate(gcode)
+    if expected is None:
+        # corner: slower than one straight move of the same length, faster than two stops
+        assert estimate("G92 X0 Y0\nG1 X200 F6000") < estimated < 2 * LONG_MOVE, "%s: %f" % (gcode, estimated)
+    else:
+        assert abs(estimated - expected) < 1e-6, "%s: %f, expected %f" % (gcode, estimated, expected)
+
+
+def check_layers_case():
+    estimator = PrintTimeEstimator(dict(DEFAULT_LIMITS))
+    estimator.play_lines(tokenize_gcode("G92 X0 Y0\nG1 X100 F6000\n;LAYER_CHANGE\nG1 X0\n;LAYER_CHANGE"))
+    assert len(estimator.layer_times) == 3
+    assert abs(estimator.layer_times[0] - LONG_MOVE) < 1e-6 and abs(estimator.layer_times[1] - LONG_MOVE) < 1e-6
+    assert estimator.layer_times[2] == 0.0
+
+
+def check_overhead_case(gcode_file):
+    limits = read_printer_limits()
+    report = get_overhead_report(estimate_file(gcode_file, limits), estimate_post_processed(gcode_file, limits))
+    assert report['layers_matched']
+    assert report['overhead'] > 0, "%s: overhead %f" % (gcode_file, report['overhead'])
+    overheads = [layer['overhead'] for layer in report['worst_layers']]
+    assert overheads == sorted(overheads, reverse=True)
+
+
+def test_estimate():
+    for gcode, expected in test_data:
+        yield check_estimate_case, gcode, expected
+
+
+def test_layers():
+    yield check_layers_case,
+
+
+def test_printer_limits():
+    limits = read_printer_limits()
+    assert limits['max_velocity'] == 300.0 and limits['max_accel'] == 3000.0
+    assert limits['max_z_velocity'] == 5.0 and limits['max_z_accel'] == 100.0
+
+
+def test_overhead():
+    for gcode_file in ("gcode/square_2_layer_alternating_4_layers_total.gcode", "examples/squares.gcode"):
+        yield check_overhead_case, gcode_file
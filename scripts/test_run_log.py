@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# To run tests:
+#   pip3 install nose
+#   python3 -m nose test_run_log.py
+
+import io
+import json
+import os
+import tempfile
+from contextlib import redirect_stderr, redirect_stdout
+
+from duelingzero_postprocessing import DuelRunner, get_arg_parser
+from point import Point
+from run_log import RunLog
+
+GCODE = "G1 X10 Y10 F600\nG1 X20 Y10\nT1\nG1 X150 Y140\nT0\nG1 X10 Y20\n"
+GCODE_FILE = "gcode/square_2_layer_alternating_4_layers_total.gcode"
+
+level_test_data = [
+    # level, events written
+    ('error', ['error']),
+    ('warning', ['error', 'warning']),
+    ('info', ['error', 'warning', 'info']),
+    ('debug', ['error', 'warning', 'info', 'debug']),
+    ('trace', ['error', 'warning', 'info', 'debug', 'trace']),
+]
+
+runner_test_data = [
+    # arguments of the post processing, events expected in the log, events not expected
+    ([], ['start', 'finish'], ['right_simple_shuffle', 'line']),
+    (['--log-level', 'warning'], [], ['start', 'finish']),
+    (['--verbose'], ['start', 'park', 'right_simple_shuffle', 'finish'], ['line']),
+    (['--log-level', 'trace'], ['start', 'park', 'right_simple_shuffle', 'line', 'finish'], []),
+]
+
+
+def read_log(text: str) -> list:
+    return [json.loads(line) for line in text.splitlines()]
+
+
+def check_level_case(level, expected):
+    output = io.StringIO()
+    log = RunLog(output, level)
+    for name in ['error', 'warning', 'info', 'debug', 'trace']:
+        getattr(log, name)(name)
+    records = read_log(output.getvalue())
+    assert [record['event'] for record in records] == expected, records
+    assert all(record['level'] == record['event'] for record in records)
+    assert log.tracing == (level == 'trace') and log.debugging == (level in ['debug', 'trace'])
+
+
+def test_fields():
+    output = io.StringIO()
+    log = RunLog(output)
+    log.context = {'file': "a.gcode"}
+    log.info('park', position=Point(1, 159), tool=0)
+    record = read_log(output.getvalue())[0]
+    assert record['position'] == [1, 159] and record['tool'] == 0 and record['file'] == "a.gcode", record
+    assert record['time'] >= 0.0
+    # nothing is logged without output, not even errors
+    log = RunLog()
+    log.error('error')
+    assert not log.is_enabled('error') and not log.tracing
+
+
+def test_verbose():
+    dr = DuelRunner(get_arg_parser().parse_args(['--verbose']))
+    assert dr.verbose and dr.log.is_enabled('debug')
+    dr.verbose = False
+    assert not dr.verbose and not dr.log.is_enabled('info')
+    with redirect_stdout(io.StringIO()) as output:
+        dr.verbose = True
+        dr.play_gcodes_stream_to(io.StringIO(GCODE), io.StringIO())
+    assert [record['event'] for record in read_log(output.getvalue())] == ['park', 'park']
+    # --verbose does not lower a level given
+    dr = DuelRunner(get_arg_parser().parse_args(['--log-level', 'trace']))
+    dr.verbose = True
+    dr.verbose = False
+    assert dr.log.get_level() == 'trace'
+
+
+def run_with_log(args: list, run) -> list:
+    """Records logged to a temporary file by run(DuelRunner of args)"""
+    tmp_dir = tempfile.mkdtemp()
+    log_file = os.path.join(tmp_dir, "run.log")
+    try:
+        dr = DuelRunner(get_arg_parser().parse_args(args + ['--log', log_file]))
+        try:
+            run(dr)
+        finally:
+            dr.log.close()
+        with open(log_file, 'r') as f:
+            return read_log(f.read())
+    finally:
+        for name in os.listdir(tmp_dir):
+            os.remove(os.path.join(tmp_dir, name))
+        os.rmdir(tmp_dir)
+
+
+def check_runner_case(args, expected, unexpected):
+    def play(dr):
+        with redirect_stdout(io.StringIO()):
+            dr.play_file(GCODE_FILE, os.devnull)
+
+    events = [record['event'] for record in run_with_log(args, play)]
+    assert all(event in events for event in expected), events
+    assert not set(events) & set(unexpected), events
+    if 'line' in events:
+        with open(GCODE_FILE, 'r') as f:
+            assert events.count('line') == len(f.readlines())
+    assert 'flight_recorder' not in events
+
+
+def test_unsafe_line():
+    errors = []
+
+    def check(dr):
+        errors.append(dr.check_file("examples/squares.gcode"))
+
+    records = run_with_log(['--check', '--flight-recorder', '4'], check)
+    assert errors[0] is not None
+    assert records[0]['event'] == 'unsafe_line' and records[0]['reason'] == errors[0].reason, records
+    lines = [record for record in records if record['event'] == 'flight_recorder']
+    assert 0 < len(lines) <= 4 and len(records) == len(lines) + 1
+    # the unsafe line is the last one, with the positions before it
+    assert lines[-1]['line'] == errors[0].line.gcode_str.strip() == records[0]['line']
+    assert lines[-1]['t0'] == records[0]['position'] or lines[-1]['t1'] == records[0]['position']
+    assert [record['line_no'] for record in lines] == list(range(lines[0]['line_no'], lines[-1]['line_no'] + 1))
+
+
+def test_unsafe_line_without_log():
+    # --check reports the unsafe line, the flight recorder is not dumped to stderr
+    for args in (['--check'], ['--check', '--verbose']):
+        dr = DuelRunner(get_arg_parser().parse_args(args))
+        with redirect_stdout(io.StringIO()), redirect_stderr(io.StringIO()) as stderr:
+            error = dr.check_file("examples/squares.gcode")
+        assert error is not None and stderr.getvalue() == "", stderr.getvalue()
+
+
+def check_error_exit(recorder_size: int):
+    dr = DuelRunner(get_arg_parser().parse_args(['--flight-recorder', str(recorder_size)]))
+    try:
+        with redirect_stdout(io.StringIO()), redirect_stderr(io.StringIO()) as stderr:
+            dr.play_gcodes_stream_to(io.StringIO(GCODE + "T2\n"), io.StringIO())
+    except SystemExit:
+        pass
+    else:
+        assert False, "no exit at T2"
+    records = read_log(stderr.getvalue())
+    if recorder_size == 0:
+        assert records == []
+        return
+    assert records[0]['event'] == 'error_exit' and records[0]['state']['active_instance'] == 'left', records
+    assert [record['line'] for record in records[1:]] == (GCODE + "T2").splitlines()[-recorder_size:]
+
+
+def test_run_log():
+    for level, expected in level_test_data:
+        yield check_level_case, level, expected
+    for args, expected, unexpected in runner_test_data:
+        yield check_runner_case, args, expected, unexpected
+    for recorder_size in [0, 3, 64]:
+        yield check_error_exit, recorder_size
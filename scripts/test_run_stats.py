@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# To run tests:
+#   pip3 install nose
+#   python3 -m nose test_run_stats.py
+
+import filecmp
+import json
+import os
+import shutil
+import tempfile
+
+from duelingzero_postprocessing import DuelRunner, get_arg_parser
+from run_stats import count_lines
+
+test_data = [
+    # gcode file, extra arguments
+    ("gcode/square_2_layer_alternating_4_layers_total.gcode", []),
+    ("gcode/square_2_layer_alternating_4_layers_total.gcode", ['--zero-copy']),
+    ("gcode/square_2_layer_alternating_4_layers_total.gcode", ['--no-prescreen']),
+    ("gcode/cylinder_1_layer_filled_10_perim.gcode", []),
+    ("examples/squares.gcode", []),
+]
+
+count_lines_data = [
+    # content, lines
+    (b"", 0),
+    (b"G1 X1\n", 1),
+    (b"G1 X1", 1),
+    (b"G1 X1\n\nG1 X2", 3),
+]
+
+
+def check_stats_case(gcode_file, extra_args):
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        stats_path = os.path.join(tmp_dir, "stats.json")
+        output = os.path.join(tmp_dir, "out.gcode")
+        dr = DuelRunner(get_arg_parser().parse_args(['--stats', stats_path] + extra_args))
+        dr.verbose = False
+        dr.play_file(gcode_file, output)
+        dr.stats.write_report(stats_path)
+        with open(stats_path, 'r') as f:
+            report = json.load(f)
+
+        # statistics do not change the output
+        reference_output = os.path.join(tmp_dir, "reference.gcode")
+        dr_reference = DuelRunner(get_arg_parser().parse_args(extra_args))
+        dr_reference.verbose = False
+        dr_reference.play_file(gcode_file, reference_output)
+        assert filecmp.cmp(output, reference_output, shallow=False), "%s: output differs" % gcode_file
+
+        with open(gcode_file, 'r') as f:
+            layer_changes = sum(1 for text_line in f if text_line.startswith(";LAYER_CHANGE"))
+        assert len(report['layers']) == layer_changes + 1, "%s: %d layers" % (gcode_file, len(report['layers']))
+        assert report['totals'] == dr.get_metrics()
+        for key, value in report['totals'].items():
+            assert sum(layer[key] for layer in report['layers']) == value, "%s: %s per layer" % (gcode_file, key)
+        assert sum(layer['lines'] for layer in report['layers']) == report['lines_processed']
+        if '--zero-copy' not in extra_args:
+            assert report['lines_processed'] == report['lines_in'], "%s: lines processed" % gcode_file
+        assert report['lines_in'] == count_lines(gcode_file)
+        assert report['inserted_lines'] == report['lines_out'] - report['lines_in']
+        assert report['bytes_in'] == os.path.getsize(gcode_file)
+        assert report['bytes_out'] == os.path.getsize(output)
+        assert set(report['phases']) == {'parse', 'collision', 'emit'}
+        assert sum(report['phases'].values()) <= report['wall_time'] + 1e-6
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def check_count_lines_case(content, lines):
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp_dir, "lines.gcode")
+        with open(path, 'wb') as f:
+            f.write(content)
+        assert count_lines(path) == lines, "%r: %d lines" % (content, count_lines(path))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_stats():
+    for gcode_file, extra_args in test_data:
+        yield check_stats_case, gcode_file, extra_args
+
+
+def test_count_lines():
+    for content, lines in count_lines_data:
+        yield check_count_lines_case, content, lines
@@ -3,9 +3,13 @@
 #   pip3 install nose
 #   python3 -m nose test_toolhead.py
 
+import random
+
 from point import Point
 
 from toolhead import form_toolhead_sweep, TOOLHEAD_X_WIDTH, TOOLHEAD_Y_HEIGHT, get_toolhead_bounds
+from toolhead import check_for_overlap, check_for_overlap_sweep, check_for_overlap_shapely, check_for_overlap_sweep_shapely
+from toolhead import check_for_overlap_sweep_quad, check_segment_box, set_sweep_margins
 
 test_data = [
     (Point(0.0, 0.0),
@@ -19,7 +23,47 @@ test_data = [
     (Point(0.0, 0.0),
      Point(100.0, 100.0),
      Point(100.0 + (TOOLHEAD_X_WIDTH / 2 )- 1, 100.0 + (TOOLHEAD_Y_HEIGHT / 2) - 1),
-     True)
+     True),
+    # passing by at 0.5 mm
+    (Point(0.0, 0.0),
+     Point(100.0, 0.0),
+     Point(50.0, TOOLHEAD_Y_HEIGHT + 0.5),
+     False),
+    # touching at the corner of the swept hexagon
+    (Point(0.0, 0.0),
+     Point(100.0, 100.0),
+     Point(100.0 + TOOLHEAD_X_WIDTH, 100.0 + TOOLHEAD_Y_HEIGHT),
+     True),
+    # the start position overlaps, missed by the quad
+    (Point(0.0, 10.0),
+     Point(10.0, 0.0),
+     Point(1.0 - TOOLHEAD_X_WIDTH, 9.0 + TOOLHEAD_Y_HEIGHT),
+     True),
+]
+
+quad_test_data = [
+    # start, end, inactive, overlap of the quad
+    (Point(0.0, 10.0), Point(10.0, 0.0), Point(1.0 - TOOLHEAD_X_WIDTH, 9.0 + TOOLHEAD_Y_HEIGHT), False),
+    (Point(0.0, 0.0), Point(10.0, 10.0), Point(0, TOOLHEAD_X_WIDTH / 2 + 1.0), True),
+]
+
+margin_test_data = [
+    # start, end, inactive, margin x, margin y, expected overlap
+    (Point(0.0, 0.0), Point(100.0, 0.0), Point(50.0, TOOLHEAD_Y_HEIGHT + 0.5), 0.0, 1.0, True),
+    (Point(0.0, 0.0), Point(100.0, 0.0), Point(50.0, TOOLHEAD_Y_HEIGHT + 0.5), 1.0, 0.0, False),
+    (Point(0.0, 0.0), Point(0.0, 100.0), Point(TOOLHEAD_X_WIDTH - 0.2, 50.0), -0.25, 0.0, False),
+    (Point(0.0, 0.0), Point(100.0, 100.0), Point(100.0 + TOOLHEAD_X_WIDTH, 100.0 + TOOLHEAD_Y_HEIGHT), -0.25, -0.25,
+     False),
+]
+
+segment_box_test_data = [
+    # start, end, box (min x, min y, max x, max y), expected
+    (Point(0.0, 0.0), Point(10.0, 0.0), (10.0, -1.0, 12.0, 1.0), True),
+    (Point(0.0, 0.0), Point(9.5, 0.0), (10.0, -1.0, 12.0, 1.0), False),
+    (Point(0.0, 3.0), Point(3.0, 0.0), (0.0, 0.0, 1.0, 1.0), False),
+    (Point(0.0, 2.0), Point(2.0, 0.0), (0.0, 0.0, 1.0, 1.0), True),
+    (Point(0.5, 0.5), Point(0.5, 0.5), (0.0, 0.0, 1.0, 1.0), True),
+    (Point(-5.0, 0.5), Point(5.0, 0.5), (0.0, 0.0, 1.0, 1.0), True),
 ]
 
 
@@ -27,9 +71,79 @@ def check_toolhead_sweep(start, end, inactive, desired_outcome):
     outcome = form_toolhead_sweep(start, end).intersects(get_toolhead_bounds(inactive))
     assert outcome == desired_outcome, "start: %s, end: %s, inactive: %s, desired: %s, actual, %s" % \
                                        (start, end, inactive, desired_outcome, outcome)
+    outcome = check_for_overlap_sweep(start, end, inactive)
+    assert outcome == desired_outcome, "analytic start: %s, end: %s, inactive: %s, desired: %s, actual, %s" % \
+                                       (start, end, inactive, desired_outcome, outcome)
+
+
+def check_quad(start, end, inactive, desired_outcome):
+    assert check_for_overlap_sweep_quad(start, end, inactive) == desired_outcome
+
+
+def check_margins(start, end, inactive, margin_x, margin_y, desired_outcome):
+    set_sweep_margins(margin_x, margin_y)
+    try:
+        assert check_for_overlap_sweep(start, end, inactive) == desired_outcome
+        assert check_for_overlap_sweep_shapely(start, end, inactive) == desired_outcome
+    finally:
+        set_sweep_margins(0.0, 0.0)
+
+
+def check_segment_box_case(start, end, box, desired_outcome):
+    assert check_segment_box(start, end, *box) == desired_outcome
+    assert check_segment_box(end, start, *box) == desired_outcome
 
 
 def test_toolhead_sweeps():
     for test_input in test_data:
         start, end, inactive, desired_outcome = test_input
         yield check_toolhead_sweep, start, end, inactive, desired_outcome
+    for start, end, inactive, desired_outcome in quad_test_data:
+        yield check_quad, start, end, inactive, desired_outcome
+    for start, end, inactive, margin_x, margin_y, desired_outcome in margin_test_data:
+        yield check_margins, start, end, inactive, margin_x, margin_y, desired_outcome
+    for start, end, box, desired_outcome in segment_box_test_data:
+        yield check_segment_box_case, start, end, box, desired_outcome
+
+
+BACKEND_SEEDS = range(20)
+BACKEND_CASES_PER_SEED = 500
+
+
+def random_position(rng):
+    # mostly on the bed, some on grid positions to hit touching / flat / vertical cases
+    if rng.random() < 0.3:
+        return Point(rng.randrange(-20, 190, 5) / 2.0, rng.randrange(-20, 190, 5) / 2.0)
+    return Point(rng.uniform(-10.0, 175.0), rng.uniform(-10.0, 170.0))
+
+
+def check_backends_agree(seed):
+    rng = random.Random(seed)
+    for _ in range(BACKEND_CASES_PER_SEED):
+        start = random_position(rng)
+        end = start.copy() if rng.random() < 0.05 else random_position(rng)
+        inactive = random_position(rng)
+        assert check_for_overlap(end, inactive) == check_for_overlap_shapely(end, inactive), \
+            "overlap end: %s, inactive: %s" % (end, inactive)
+        assert check_for_overlap_sweep(start, end, inactive) == check_for_overlap_sweep_shapely(start, end, inactive), \
+            "overlap sweep start: %s, end: %s, inactive: %s" % (start, end, inactive)
+
+
+def check_quad_exact_agree(seed):
+    # the quad and the end position cover the exact swept area but the start position
+    rng = random.Random(seed)
+    for _ in range(BACKEND_CASES_PER_SEED):
+        start = random_position(rng)
+        end = random_position(rng)
+        inactive = random_position(rng)
+        if check_for_overlap(start, inactive):
+            continue
+        quad = check_for_overlap_sweep_quad(start, end, inactive) or check_for_overlap(end, inactive)
+        assert quad == check_for_overlap_sweep(start, end, inactive), \
+            "quad start: %s, end: %s, inactive: %s" % (start, end, inactive)
+
+
+def test_backends_agree():
+    for seed in BACKEND_SEEDS:
+        yield check_backends_agree, seed
+        yield check_quad_exact_agree, seed
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# To run tests:
+#   pip3 install nose
+#   python3 -m nose test_two_object.py
+
+import io
+
+from duelingzero_postprocessing import DuelRunner, get_arg_parser
+from gcode_generator import generate_gcode
+from gcode_tokenizer import tokenize_gcode_stream
+from two_object import ObjectProgram, TwoHeadSimulator, merge_programs
+
+test_data = [
+    # line, tool of the input, expected line
+    ("T0", 1, "T1"),
+    ("T0 ; tool", 1, "T1 ; tool"),
+    ("M104 S245 T0 ; set temperature", 1, "M104 S245 T1 ; set temperature"),
+    ("M109 S245 T1", 0, "M109 S245 T0"),
+    ("M104 S245 ; set temperature", 1, "M104 S245 ; set temperature"),
+    ("G1 X10 Y20 E1.5", 1, "G1 X10 Y20 E1.5"),
+]
+
+merge_test_data = [
+    # left generator arguments, right generator arguments, expected tools of the layers, collisions merged
+    # duplicated parts in the left and right half
+    (['--layers', '4', '--object', '10,20,50,50'], ['--layers', '4', '--object', '105,90,50,50'],
+     [0, 1, 0, 1, 0, 1, 0, 1], False),
+    # objects reaching into the other half, post processing is needed
+    (['--layers', '2', '--object', '10,20,90,50'], ['--layers', '2', '--object', '60,100,90,40'],
+     [0, 1, 0, 1], True),
+    # different layer heights, interleaved by Z
+    (['--layers', '2', '--layer-height', '0.4', '--object', '10,20,50,50'],
+     ['--layers', '4', '--layer-height', '0.2', '--object', '105,90,50,50'], [0, 1, 1, 0, 1, 1], False),
+]
+
+
+def generate(generator_args) -> list:
+    return generate_gcode(generator_args + ['--tool-period', '0', '--thumbnail-lines', '2']).splitlines(keepends=True)
+
+
+def simulate(lines) -> TwoHeadSimulator:
+    simulator = TwoHeadSimulator()
+    simulator.play_lines(tokenize_gcode_stream(lines))
+    return simulator
+
+
+def get_layer_tools(lines) -> list:
+    tools = []
+    tool = 0
+    for line in lines:
+        if line[:1] == 'T':
+            tool = int(line[1])
+        elif line.startswith(';LAYER_CHANGE'):
+            tools.append(tool)
+    return tools
+
+
+def check_retarget_case(line, tool, expected):
+    program = ObjectProgram(io.StringIO(""), tool)
+    assert program.retarget(line) == expected, "%s, expected %s" % (program.retarget(line), expected)
+
+
+def check_merge_case(left_args, right_args, expected_tools, collisions):
+    left = generate(left_args)
+    right = generate(right_args)
+    merged = list(merge_programs(ObjectProgram(left, 0), ObjectProgram(right, 1)))
+    assert get_layer_tools(merged) == expected_tools, "%s, expected %s" % (get_layer_tools(merged), expected_tools)
+    assert merged.count("print_end ; end gcode") == 1
+    # the other head does not stand in the way of a single object program
+    left_extruded = simulate(left).extruded[0]
+    right_extruded = simulate(right).extruded[0]
+    simulator = simulate(merged)
+    assert bool(simulator.collisions) == collisions, simulator.collisions[:1]
+    output = io.StringIO()
+    dr = DuelRunner(get_arg_parser().parse_args(['--park', 'dynamic']))
+    dr.play_gcodes_stream_to((line + "\n" for line in merged), output)
+    simulator = simulate(output.getvalue().splitlines())
+    report = simulator.get_report()
+    assert report['collisions'] == 0, report['first_collision']
+    assert abs(report['extruded'][0] - left_extruded) < 1e-6, (report['extruded'], left_extruded)
+    assert abs(report['extruded'][1] - right_extruded) < 1e-6, (report['extruded'], right_extruded)
+    assert abs(sum(report['head_times'].values()) - report['print_time']) < 1e-6
+
+
+def check_absolute_extrusion():
+    # absolute extrusion of the left input continues after the layers of the relative right input
+    with open("gcode/square_2_layer.gcode") as f:
+        left = f.readlines()
+    right = generate(['--layers', '2', '--object', '105,90,50,50'])
+    merged = list(merge_programs(ObjectProgram(left, 0), ObjectProgram(right, 1)))
+    assert "G92 E28.25002 ; restored by two object mode" in merged
+    assert abs(simulate(merged).extruded[0] - simulate(left).extruded[0]) < 1e-6
+
+
+def check_multi_tool_input():
+    gcode = generate_gcode(['--layers', '2', '--thumbnail-lines', '2'])
+    try:
+        right = ObjectProgram(generate(['--layers', '2']), 1)
+        list(merge_programs(ObjectProgram(io.StringIO(gcode), 0), right))
+    except ValueError:
+        return
+    assert False, "input with T0 and T1 merged"
+
+
+def test_retarget():
+    for line, tool, expected in test_data:
+        yield check_retarget_case, line, tool, expected
+
+
+def test_merge():
+    for left_args, right_args, expected_tools, collisions in merge_test_data:
+        yield check_merge_case, left_args, right_args, expected_tools, collisions
+
+
+def test_inputs():
+    yield check_absolute_extrusion,
+    yield check_multi_tool_input,
@@ -1,6 +1,9 @@
 #!/usr/bin/env python3
 
-from shapely.geometry import Polygon
+try:
+    from shapely.geometry import MultiPoint, Polygon
+except ImportError:  # shapely is only needed for the reference collision backend
+    MultiPoint = Polygon = None
 
 from point import Point
 
@@ -26,6 +29,10 @@ BACKOFF_SPEED = 15000
 PARK_SPEED = 15000
 MOVE_TO_SPEED = 15000
 
+# Change these values to match your heaters, used by --preheat.
+IDLE_TEMP = 175.0            # the inactive toolhead waits at this temperature
+HEATER_WARMUP_TIME = 30.0    # seconds to heat from IDLE_TEMP to print temperature
+
 # Change these values to match your toolhead.  Values are for a MiniAB/MiniAS.
 EXTRA_TOOLHEAD_CLEARANCE = 0.25
 TOOLHEAD_X_WIDTH = 40.0 + EXTRA_TOOLHEAD_CLEARANCE * 2
@@ -35,8 +42,151 @@ X_BACKOFF_LEN = TOOLHEAD_X_WIDTH + 5
 T0_X_BACKOFF = 165.0 - X_BACKOFF_LEN
 T1_X_BACKOFF = X_BACKOFF_LEN
 
+# Safety margins of moves, kept between the toolheads on top of EXTRA_TOOLHEAD_CLEARANCE. May be negative.
+SWEEP_MARGIN_X = 0.0
+SWEEP_MARGIN_Y = 0.0
+
+# Collision checks are done analytically by default. 'shapely' uses polygons and is kept as reference, 'quad' is
+# the former approximation of the swept area, kept for comparison.
+COLLISION_BACKENDS = ['analytic', 'shapely', 'quad']
+COLLISION_BACKEND = 'analytic'
+
+
+def set_collision_backend(backend: str):
+    """Select the implementation used by check_for_overlap and check_for_overlap_sweep"""
+    global COLLISION_BACKEND
+    if backend not in COLLISION_BACKENDS:
+        raise ValueError("Unknown collision backend: %s" % backend)
+    if backend == 'shapely' and Polygon is None:
+        raise ImportError("Collision backend 'shapely' requires shapely to be installed")
+    COLLISION_BACKEND = backend
+
+
+def set_sweep_margins(margin_x: float, margin_y: float):
+    """Set the safety margins used by the swept area checks of moves"""
+    global SWEEP_MARGIN_X, SWEEP_MARGIN_Y
+    SWEEP_MARGIN_X = margin_x
+    SWEEP_MARGIN_Y = margin_y
+
+
+def get_sweep_extents() -> tuple:
+    """Return (x, y) distances of the toolhead centers below which a move runs into the inactive toolhead.
+    The inactive toolhead grown by these to each side is the Minkowski sum of both toolheads and the margins."""
+    return TOOLHEAD_X_WIDTH + SWEEP_MARGIN_X, TOOLHEAD_Y_HEIGHT + SWEEP_MARGIN_Y
+
+
+def get_toolhead_box(p):
+    """Return (min_x, min_y, max_x, max_y) of the toolhead at p"""
+    return (p.x - TOOLHEAD_X_WIDTH / 2, p.y - TOOLHEAD_Y_HEIGHT / 2,
+            p.x + TOOLHEAD_X_WIDTH / 2, p.y + TOOLHEAD_Y_HEIGHT / 2)
+
+
+# Not quite rect bounds, but most of it.  Rect bounds can cover the rest of the true swept area.
+# Used by the 'quad' backend only, the other backends check the exact swept area.
+def get_toolhead_sweep_corners(p_a, p_b):
+    """Return the corners of the quad covering the area swept by the translated rectangle,
+    but not the "far away" corners of it. The quad is a parallelogram, degenerated to a line if p_a == p_b."""
+    # Align points so that p1 is to left of p2
+    if p_a.x < p_b.x:
+        p1 = p_a
+        p2 = p_b
+    else:
+        p1 = p_b
+        p2 = p_a
+
+    if p1.y > p2.y:
+        # Top left to bottom right
+        return [(p1.x - TOOLHEAD_X_WIDTH / 2, p1.y - TOOLHEAD_Y_HEIGHT / 2),
+                (p1.x + TOOLHEAD_X_WIDTH / 2, p1.y + TOOLHEAD_Y_HEIGHT / 2),
+                (p2.x + TOOLHEAD_X_WIDTH / 2, p2.y + TOOLHEAD_Y_HEIGHT / 2),
+                (p2.x - TOOLHEAD_X_WIDTH / 2, p2.y - TOOLHEAD_Y_HEIGHT / 2)]
+    else:
+        # Bottom left to top right, or left to right and flat.
+        return [(p1.x - TOOLHEAD_X_WIDTH / 2, p1.y + TOOLHEAD_Y_HEIGHT / 2),
+                (p1.x + TOOLHEAD_X_WIDTH / 2, p1.y - TOOLHEAD_Y_HEIGHT / 2),
+                (p2.x + TOOLHEAD_X_WIDTH / 2, p2.y - TOOLHEAD_Y_HEIGHT / 2),
+                (p2.x - TOOLHEAD_X_WIDTH / 2, p2.y + TOOLHEAD_Y_HEIGHT / 2)]
+
+
+def check_for_overlap(p1, p2):
+    """True if the toolheads at p1 and p2 overlap or touch"""
+    if COLLISION_BACKEND == 'shapely':
+        return check_for_overlap_shapely(p1, p2)
+    # axis aligned bounding boxes
+    min_x1, min_y1, max_x1, max_y1 = get_toolhead_box(p1)
+    min_x2, min_y2, max_x2, max_y2 = get_toolhead_box(p2)
+    return min_x1 <= max_x2 and min_x2 <= max_x1 and min_y1 <= max_y2 and min_y2 <= max_y1
+
+
+def check_for_overlap_margins(toolhead_pos, inactive_toolhead_pos):
+    """True if the toolhead at toolhead_pos comes closer to the inactive toolhead than the sweep margins allow,
+    check_for_overlap of the end position of a move. The 'quad' backend has no margins."""
+    if COLLISION_BACKEND == 'quad':
+        return check_for_overlap(toolhead_pos, inactive_toolhead_pos)
+    return check_for_overlap_sweep(toolhead_pos, toolhead_pos, inactive_toolhead_pos)
+
+
+def check_for_overlap_sweep(toolhead_pos, next_toolhead_pos, inactive_toolhead_pos):
+    """True if the toolhead moving from toolhead_pos to next_toolhead_pos sweeps over the inactive toolhead.
+    The swept area is the Minkowski sum of the toolhead and the move, a hexagon. It overlaps the inactive toolhead
+    if the move of the center crosses the inactive toolhead grown by get_sweep_extents."""
+    if COLLISION_BACKEND == 'shapely':
+        return check_for_overlap_sweep_shapely(toolhead_pos, next_toolhead_pos, inactive_toolhead_pos)
+    if COLLISION_BACKEND == 'quad':
+        return check_for_overlap_sweep_quad(toolhead_pos, next_toolhead_pos, inactive_toolhead_pos)
+    extent_x, extent_y = get_sweep_extents()
+    return check_segment_box(toolhead_pos, next_toolhead_pos,
+                             inactive_toolhead_pos.x - extent_x, inactive_toolhead_pos.y - extent_y,
+                             inactive_toolhead_pos.x + extent_x, inactive_toolhead_pos.y + extent_y)
+
+
+def check_segment_box(p_a, p_b, min_x, min_y, max_x, max_y) -> bool:
+    """True if the segment from p_a to p_b touches the box. Liang-Barsky clipping, the parameters along the segment
+    are kept as fractions, so touching is decided without division."""
+    dx = p_b.x - p_a.x
+    dy = p_b.y - p_a.y
+    enter_n, enter_d = 0.0, 1.0
+    leave_n, leave_d = 1.0, 1.0
+    for p, q in ((-dx, p_a.x - min_x), (dx, max_x - p_a.x), (-dy, p_a.y - min_y), (dy, max_y - p_a.y)):
+        if p == 0:
+            if q < 0:
+                return False   # parallel and outside
+        elif p < 0:
+            if -q * enter_d > enter_n * -p:
+                enter_n, enter_d = -q, -p
+        elif q * leave_d < leave_n * p:
+            leave_n, leave_d = q, p
+    return enter_n * leave_d <= leave_n * enter_d
+
+
+def check_for_overlap_sweep_quad(toolhead_pos, next_toolhead_pos, inactive_toolhead_pos):
+    """Former approximation: the quad of get_toolhead_sweep_corners, without margins. Together with the check of
+    the end position it misses only the part of the start position outside of the quad."""
+    quad = get_toolhead_sweep_corners(toolhead_pos, next_toolhead_pos)
+    min_x, min_y, max_x, max_y = get_toolhead_box(inactive_toolhead_pos)
+    # Separating axis test. Axes x and y, the normals of the box, are a bounding box check.
+    quad_xs = [c[0] for c in quad]
+    quad_ys = [c[1] for c in quad]
+    if max(quad_xs) < min_x or min(quad_xs) > max_x or max(quad_ys) < min_y or min(quad_ys) > max_y:
+        return False
+    # Remaining axes are the normals of the two edge directions of the parallelogram.
+    box = [(min_x, min_y), (max_x, min_y), (max_x, max_y), (min_x, max_y)]
+    for (ax, ay), (bx, by) in ((quad[0], quad[1]), (quad[1], quad[2])):
+        normal_x = ay - by
+        normal_y = bx - ax
+        if normal_x == 0 and normal_y == 0:
+            continue  # no move, the quad is a line
+        quad_proj = [x * normal_x + y * normal_y for x, y in quad]
+        box_proj = [x * normal_x + y * normal_y for x, y in box]
+        if max(quad_proj) < min(box_proj) or max(box_proj) < min(quad_proj):
+            return False
+    return True
+
+
 
 def get_shapely_rectangle(p1, p2):
+    if Polygon is None:
+        raise ImportError("shapely is required for polygon based toolhead bounds")
     return Polygon([(p1.x, p1.y), (p2.x, p1.y), (p2.x, p2.y), (p1.x, p2.y)])
 
 
@@ -47,39 +197,24 @@ def get_toolhead_bounds(p):
 
 
 # https://gis.stackexchange.com/questions/90055/finding-if-two-polygons-intersect-in-python
-def check_for_overlap(p1, p2):
+def check_for_overlap_shapely(p1, p2):
     poly1 = get_toolhead_bounds(p1)
     poly2 = get_toolhead_bounds(p2)
     overlap = poly1.intersects(poly2)
     return overlap
 
 
-def check_for_overlap_sweep(toolhead_pos, next_toolhead_pos, inactive_toolhead_pos):
+def check_for_overlap_sweep_shapely(toolhead_pos, next_toolhead_pos, inactive_toolhead_pos):
     return form_toolhead_sweep(toolhead_pos, next_toolhead_pos).intersects(
         get_toolhead_bounds(inactive_toolhead_pos))
 
 
-# Not quite rect bounds, but most of it.  Rect bounds can cover the rest of the true swept area.
 def form_toolhead_sweep(p_a, p_b):
-    """Return Polygon with quad covering the area swept by the translated rectangle,
-    but not the "far away" corners of it."""
-    # Align points so that p1 is to left of p2
-    if p_a.x < p_b.x:
-        p1 = p_a
-        p2 = p_b
-    else:
-        p1 = p_b
-        p2 = p_a
-
-    if p1.y > p2.y:
-        # Top left to bottom right
-        return Polygon([(p1.x - TOOLHEAD_X_WIDTH / 2, p1.y - TOOLHEAD_Y_HEIGHT / 2),
-                        (p1.x + TOOLHEAD_X_WIDTH / 2, p1.y + TOOLHEAD_Y_HEIGHT / 2),
-                        (p2.x + TOOLHEAD_X_WIDTH / 2, p2.y + TOOLHEAD_Y_HEIGHT / 2),
-                        (p2.x - TOOLHEAD_X_WIDTH / 2, p2.y - TOOLHEAD_Y_HEIGHT / 2)])
-    else:
-        # Bottom left to top right, or left to right and flat.
-        return Polygon([(p1.x - TOOLHEAD_X_WIDTH / 2, p1.y + TOOLHEAD_Y_HEIGHT / 2),
-                        (p1.x + TOOLHEAD_X_WIDTH / 2, p1.y - TOOLHEAD_Y_HEIGHT / 2),
-                        (p2.x + TOOLHEAD_X_WIDTH / 2, p2.y - TOOLHEAD_Y_HEIGHT / 2),
-                        (p2.x - TOOLHEAD_X_WIDTH / 2, p2.y + TOOLHEAD_Y_HEIGHT / 2)])
+    """Return Polygon of the area swept by the toolhead moving from p_a to p_b, grown by the margins: the convex hull
+    of the toolhead at both ends"""
+    if Polygon is None:
+        raise ImportError("shapely is required for polygon based toolhead sweeps")
+    half_x = TOOLHEAD_X_WIDTH / 2 + SWEEP_MARGIN_X
+    half_y = TOOLHEAD_Y_HEIGHT / 2 + SWEEP_MARGIN_Y
+    return MultiPoint([(p.x + sx * half_x, p.y + sy * half_y) for p in (p_a, p_b) for sx in (-1, 1)
+                       for sy in (-1, 1)]).convex_hull
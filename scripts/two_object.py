@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+# Two object mode: one single tool G-code file per gantry, merged into one program printing both objects.
+# The left input is printed by T0, the right one by T1, their objects placed in the left and right half of the bed.
+#
+# Klipper runs a single motion queue and T0 / T1 just select the carriage the following moves go to, so one
+# G-code program can not move both gantries at the same time. The heads take turns instead: the layers of both
+# inputs are interleaved by Z (left first on equal Z), a layer change is the collision safe point to switch.
+# The merged program is then post processed by DuelRunner, with dynamic parks by default, so a head whose object
+# is out of the way of the other one is left where it is instead of parked.
+# Per input the positioning and extrusion modes, the extruder position (absolute E) and the feed rate are restored
+# after every switch, tool numbers and the T parameter of M104 / M109 are rewritten to the tool of the input.
+# The start G-code of the left input is used, of the right one only the temperature commands. The end G-code of
+# the left input ends the program, the one of the right input is dropped.
+#
+# TwoHeadSimulator plays a program offline: every move of the active head is checked against the other head with
+# the checks from toolhead.py, the other one standing still meanwhile, and timed with the print time estimator.
+# It reports the collisions and the time every head is busy. The sum is the print time, the larger one is what a
+# firmware moving both gantries concurrently could get down to.
+#
+# Sample invocations:
+#   ./two_object.py --left part_a.gcode --right part_b.gcode --output both.gcode
+#   ./two_object.py --simulate both.gcode
+#       checks and times an existing program
+
+import argparse
+import io
+import sys
+from contextlib import redirect_stdout
+
+from gcodeparser.commands import Commands
+
+from arc import check_for_overlap_move
+from duelingzero_postprocessing import DuelRunner, get_arg_parser, atomic_output
+from gcode_tokenizer import tokenize_gcode_stream
+from park_planner import PARK_MODES
+from peephole import split_line, is_tool
+from point import Point
+from print_time import PrintTimeEstimator, read_printer_limits, format_duration, PRINTER_CFG
+from toolhead import check_for_overlap
+
+LAYER_CHANGE: str = ";LAYER_CHANGE"
+END_GCODE: str = ";TYPE:Custom"   # PrusaSlicer / OrcaSlicer mark of the end G-code after the last layer
+TEMPERATURE_CODES = ('M104', 'M109')
+Z_EPSILON = 1e-6
+SWITCH_COMMENT = "two object mode"
+
+
+def find_end_gcode(lines: list) -> int:
+    """Index of the first line of the end G-code in the lines of the last layer, len(lines) if there is none"""
+    for i in range(len(lines) - 1, -1, -1):
+        if lines[i].startswith(END_GCODE):
+            return i
+    for i, line in enumerate(lines):
+        code = split_line(line)[0]
+        if code and code[0] not in 'GMT':
+            return i   # first macro, i.e. print_end
+    return len(lines)
+
+
+def split_layers(text_lines):
+    """Generator splitting G-code lines at ;LAYER_CHANGE into ('header', lines), ('layer', lines) ...
+    ('footer', lines). The footer is the end G-code split from the last layer."""
+    kind = 'header'
+    chunk = []
+    for line in text_lines:
+        line = line.rstrip('\r\n')
+        if line.startswith(LAYER_CHANGE):
+            yield kind, chunk
+            kind = 'layer'
+            chunk = []
+        chunk.append(line)
+    end = find_end_gcode(chunk) if kind == 'layer' else len(chunk)
+    yield kind, chunk[:end]
+    yield 'footer', chunk[end:]
+
+
+def get_layer_z(lines: list):
+    """Z of a layer from its ;Z: comment or its first Z move, None if there is neither"""
+    for line in lines:
+        if line.startswith(';Z:'):
+            return float(line[3:])
+        code, params, _ = split_line(line)
+        if code in ('G0', 'G1') and 'Z' in params:
+            return float(params['Z'])
+    return None
+
+
+class ObjectProgram:
+    def __init__(self, text_lines, tool: int):
+        """Single tool program read layer by layer from text_lines, printed by tool"""
+        self.tool: int = tool
+        self.input_tools = set()
+        self.relative: bool = False
+        self.relative_e: bool = False
+        self.e: str = '0'   # as written by the input, restored exactly
+        self.feed_rate = None
+        self.z: float = 0.0
+        self.chunks = split_layers(text_lines)
+        _, self.header = next(self.chunks)
+        self.footer = None
+        self.next_layer = None
+        self.read_layer()
+
+    def read_layer(self):
+        kind, lines = next(self.chunks)
+        if kind == 'footer':
+            self.footer = lines
+            self.next_layer = None
+        else:
+            self.next_layer = lines
+            z = get_layer_z(lines)
+            self.z = self.z if z is None else z
+
+    def take_layer(self) -> list:
+        layer = self.next_layer
+        self.read_layer()
+        return layer
+
+    def retarget(self, line: str) -> str:
+        """line with the tool numbers of tool changes and temperature commands rewritten to self.tool"""
+        code, params, _ = split_line(line)
+        if is_tool(code):
+            self.input_tools.add(code)
+            if len(self.input_tools) > 1:
+                raise ValueError("two object mode needs single tool inputs, found %s" % sorted(self.input_tools))
+        elif not (code in TEMPERATURE_CODES and 'T' in params):
+            return line
+        text, separator, comment = line.partition(';')
+        words = text.split()
+        words = [words[0]] + ["T%d" % self.tool if word[0] in 'Tt' else word for word in words[1:]]
+        if is_tool(code):
+            words[0] = "T%d" % self.tool
+        return ' '.join(words) + (' ' + separator + comment if separator else '')
+
+    def track(self, line: str):
+        code, params, _ = split_line(line)
+        if code == 'G90':
+            self.relative = False
+        elif code == 'G91':
+            self.relative = True
+        elif code == 'M82':
+            self.relative_e = False
+        elif code == 'M83':
+            self.relative_e = True
+        elif code == 'G92' and 'E' in params:
+            self.e = params['E']
+        elif code in ('G0', 'G1', 'G2', 'G3'):
+            if 'F' in params:
+                self.feed_rate = params['F']
+            if 'E' in params and not self.relative and not self.relative_e:
+                self.e = params['E']
+
+    def play(self, lines: list):
+        """Generator of lines retargeted to self.tool, following the modes they set"""
+        for line in lines:
+            line = self.retarget(line)
+            self.track(line)
+            yield line
+
+    def get_restore_lines(self) -> list:
+        """Lines restoring the modes, extruder position and feed rate of this program after a switch"""
+        comment = " ; restored by %s" % SWITCH_COMMENT
+        lines = [("G91" if self.relative else "G90") + comment, ("M83" if self.relative_e else "M82") + comment]
+        if not self.relative_e:
+            lines.append("G92 E%s" % self.e + comment)
+        if self.feed_rate is not None:
+            lines.append("G1 F%s" % self.feed_rate + comment)
+        return lines
+
+
+def merge_programs(left: ObjectProgram, right: ObjectProgram):
+    """Generator of the lines of the program printing left with T0 and right with T1, taking turns per layer"""
+    yield from left.play(left.header)
+    for line in right.header:
+        right.track(line)   # modes only, start G-code is the one of left
+        if split_line(line)[0] in TEMPERATURE_CODES:
+            yield right.retarget(line)
+    active = left.tool   # T0 is active at the start of every program
+    while left.next_layer is not None or right.next_layer is not None:
+        if right.next_layer is None or (left.next_layer is not None and left.z <= right.z + Z_EPSILON):
+            program = left
+        else:
+            program = right
+        if program.tool != active:
+            yield "T%d ; %s" % (program.tool, SWITCH_COMMENT)
+            yield from program.get_restore_lines()
+            active = program.tool
+        yield from program.play(program.take_layer())
+    if active != left.tool and left.footer:
+        yield "T%d ; %s" % (left.tool, SWITCH_COMMENT)
+        yield from left.get_restore_lines()
+    yield from left.play(left.footer)
+
+
+def write_two_object_file(left_file: str, right_file: str, f_output: str, passed_args=None):
+    """Merge left_file and right_file and post process the program into f_output with DuelRunner.
+    Returns the DuelRunner, None if passed_args is None and the program is written as merged."""
+    with open(left_file, 'r') as f_left, open(right_file, 'r') as f_right, atomic_output(f_output) as f_out:
+        lines = (line + "\n" for line in merge_programs(ObjectProgram(f_left, 0), ObjectProgram(f_right, 1)))
+        if passed_args is None:
+            f_out.writelines(lines)
+            return None
+        dr = DuelRunner(passed_args)
+        with redirect_stdout(io.StringIO()):
+            dr.play_gcodes_stream_to(lines, f_out)
+        return dr
+
+
+class TwoHeadSimulator:
+    def __init__(self, limits: dict = None):
+        """Offline simulation of a program for both heads, see the header of this file"""
+        self.estimator = PrintTimeEstimator(limits)
+        self.line_no: int = 0
+        self.collisions = []
+        self.head_times = {0: 0.0, 1: 0.0}
+        self.extruded = {0: 0.0, 1: 0.0}
+        self.timed: float = 0.0   # time of the moves already assigned to a head
+
+    def assign_time(self):
+        """Full stop, the time of the moves since the last one is the time of the active head"""
+        estimator = self.estimator
+        estimator.flush()
+        self.head_times[estimator.tool] += estimator.total_time - self.timed
+        self.timed = estimator.total_time
+
+    def play_move(self, line):
+        estimator = self.estimator
+        tool = estimator.tool
+        start = Point(*estimator.positions[tool])
+        e = estimator.extruders[tool]
+        estimator.play_move(line)
+        end = Point(*estimator.positions[tool])
+        self.extruded[tool] += estimator.extruders[tool] - e
+        if (start.x, start.y) == (end.x, end.y):
+            return
+        other = Point(*estimator.positions[1 - tool])
+        if check_for_overlap(end, other) or check_for_overlap_move(start, end, other, line):
+            self.collisions.append({'line': self.line_no + 1, 'time': estimator.total_time, 'tool': tool,
+                                    'start': (start.x, start.y), 'end': (end.x, end.y), 'other': (other.x, other.y)})
+
+    def play_line(self, line):
+        if line.type == Commands.MOVE:
+            self.play_move(line)
+        else:
+            if line.type == Commands.TOOLCHANGE:
+                self.assign_time()
+            self.estimator.play_line(line)
+        self.line_no += 1
+
+    def play_lines(self, lines):
+        for line in lines:
+            self.play_line(line)
+        self.assign_time()
+
+    def get_report(self) -> dict:
+        total_time = self.estimator.total_time
+        concurrent_time = max(self.head_times.values())
+        return {'print_time': total_time, 'head_times': dict(self.head_times),
+                'concurrent_time': concurrent_time,
+                'concurrent_saving_percent': (total_time - concurrent_time) / total_time * 100 if total_time else 0.0,
+                'extruded': dict(self.extruded), 'collisions': len(self.collisions),
+                'first_collision': self.collisions[0] if self.collisions else None}
+
+
+def simulate_file(gcode_file: str, limits: dict = None) -> TwoHeadSimulator:
+    simulator = TwoHeadSimulator(limits)
+    with open(gcode_file, 'r') as f:
+        simulator.play_lines(tokenize_gcode_stream(f))
+    return simulator
+
+
+def print_simulation_report(report: dict):
+    print("Estimated print time:    %s (%.1fs)" % (format_duration(report['print_time']), report['print_time']))
+    for tool, head_time in sorted(report['head_times'].items()):
+        print("T%d busy:                 %s (%.1fs), extruded %.1fmm" % (tool, format_duration(head_time), head_time,
+                                                                        report['extruded'][tool]))
+    print("Both gantries at a time: %s (%.1fs, %.1f%% less)" % (format_duration(report['concurrent_time']),
+                                                                report['concurrent_time'],
+                                                                report['concurrent_saving_percent']))
+    if report['first_collision'] is None:
+        print("No collisions")
+    else:
+        collision = report['first_collision']
+        print("%d collisions, first in line %d: T%d moving %s -> %s, other head at %s" %
+              (report['collisions'], collision['line'], collision['tool'], collision['start'], collision['end'],
+               collision['other']))
+
+
+def get_two_object_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Print two single tool G-code files at once, one per gantry.")
+    parser.add_argument('--left', help="Single tool G-code for the left gantry (T0)")
+    parser.add_argument('--right', help="Single tool G-code for the right gantry (T1)")
+    parser.add_argument('--output', help="Output file of the post processed program")
+    parser.add_argument('--park', help="Park positions of the post processing", choices=PARK_MODES, default='dynamic')
+    parser.add_argument('--no-post-processing', help="Write the merged program without post processing",
+                        action='store_true')
+    parser.add_argument('--simulate', help="Only simulate the given program")
+    parser.add_argument('--printer-cfg', help="Klipper config with the [printer] limits", default=PRINTER_CFG)
+    return parser
+
+
+def main(passed_args) -> int:
+    if passed_args.simulate:
+        gcode_file = passed_args.simulate
+    elif passed_args.left and passed_args.right and passed_args.output:
+        dr_args = None if passed_args.no_post_processing else get_arg_parser().parse_args(['--park', passed_args.park])
+        try:
+            write_two_object_file(passed_args.left, passed_args.right, passed_args.output, dr_args)
+        except ValueError as e:
+            print(e)
+            return 1
+        gcode_file = passed_args.output
+    else:
+        print("--left, --right and --output or --simulate are needed")
+        return 1
+    simulator = simulate_file(gcode_file, read_printer_limits(passed_args.printer_cfg))
+    report = simulator.get_report()
+    print_simulation_report(report)
+    return 1 if report['collisions'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(get_two_object_arg_parser().parse_args()))